@@ -3,9 +3,11 @@ from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import caches
 from twitter.cache import USER_PROFILE_PATTERN
+from utils.backend_calls import InstrumentedCache
+from utils.cache_versions import CacheVersions
 from utils.memcached_helper import MemcachedHelper
 
-cache = caches['testing'] if settings.TESTING else caches['default']
+cache = InstrumentedCache(caches['testing'] if settings.TESTING else caches['default'])
 
 class UserService:
 
@@ -22,7 +24,7 @@ class UserService:
         1. Profile is not get through its own ID
         2. Profile should support get_or_create
         """
-        key = USER_PROFILE_PATTERN.format(user_id=user_id)
+        key = cls.get_profile_key(user_id)
         profile = cache.get(key)
         # Load from cache first
         if profile:
@@ -36,8 +38,12 @@ class UserService:
     
     @classmethod
     def invalidate_profile(cls, user_id):
-        key = USER_PROFILE_PATTERN.format(user_id=user_id)
+        key = cls.get_profile_key(user_id)
         cache.delete(key)
+
+    @classmethod
+    def get_profile_key(cls, user_id):
+        return CacheVersions.format_key(USER_PROFILE_PATTERN, UserProfile, 'pickle', user_id=user_id)
         
     # After we finished all the User and UserProfile cache related function
     # We should globally search user foreign key or UserSerializer
@@ -48,4 +54,55 @@ class UserService:
     @classmethod
     def get_user_by_id(cls, user_id):
         return MemcachedHelper.get_object_through_cache(User, user_id)
-    # This is to move the original function in friendships.models to here
\ No newline at end of file
+    # This is to move the original function in friendships.models to here
+
+    @classmethod
+    def get_profiles_through_cache(cls, user_ids):
+        """
+        Batch version of get_profile_through_cache
+        :return: dict, user id -> profile
+        """
+        keys = {user_id: cls.get_profile_key(user_id) for user_id in set(user_ids)}
+        if not keys:
+            return {}
+        cached = cache.get_many(list(keys.values()))
+        profiles = {
+            user_id: cached[key]
+            for user_id, key in keys.items()
+            if key in cached
+        }
+        missing_ids = [user_id for user_id in keys if user_id not in profiles]
+        if missing_ids:
+            loaded = {
+                profile.user_id: profile
+                for profile in UserProfile.objects.filter(user_id__in=missing_ids)
+            }
+            not_created_ids = [user_id for user_id in missing_ids if user_id not in loaded]
+            if not_created_ids:
+                # same as get_profile_through_cache, the profiles are created on the first access
+                # ignore_conflicts: someone else could have just created some of them (user is unique)
+                UserProfile.objects.bulk_create(
+                    [UserProfile(user_id=user_id) for user_id in not_created_ids],
+                    ignore_conflicts=True,
+                )
+                loaded.update({
+                    profile.user_id: profile
+                    for profile in UserProfile.objects.filter(user_id__in=not_created_ids)
+                })
+            cache.set_many({keys[user_id]: profile for user_id, profile in loaded.items()})
+            profiles.update(loaded)
+        return profiles
+
+    @classmethod
+    def get_users_through_cache(cls, user_ids):
+        """
+        The users of a page with their profiles, for the serializers of a user list
+        2 get_many to memcached in total, rather than 2 gets for each user (user and profile)
+        :return: dict, user id -> user, user.profile is already there
+        """
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        profiles = cls.get_profiles_through_cache(list(users))
+        for user_id, user in users.items():
+            user._cached_user_profile = profiles[user_id]
+            # see accounts.models.get_profile
+        return users
\ No newline at end of file
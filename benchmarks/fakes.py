@@ -0,0 +1,162 @@
+"""
+In-memory stand-ins of Redis and HBase for the benchmarks,
+so they can run on a laptop without any of the services.
+
+Redis: fakeredis (pip install -r requirements-dev.txt, lua is needed by utils.redis_scripts)
+HBase: InMemoryHBaseConnection below, only the part of the happybase API used by django_hbase
+
+The stand-ins are installed into the singletons of RedisClient and HBaseClient,
+nothing else in the code is patched.
+"""
+import bisect
+import struct
+
+
+def _to_bytes(value):
+    if value is None or isinstance(value, bytes):
+        return value
+    return str(value).encode('utf-8')
+
+
+class InMemoryBatch:
+
+    def __init__(self, table):
+        self.table = table
+        self.mutations = []
+
+    def put(self, row, data):
+        self.mutations.append((row, data))
+
+    def delete(self, row, columns=None):
+        self.mutations.append((row, None))
+
+    def send(self):
+        for row, data in self.mutations:
+            if data is None:
+                self.table.delete(row)
+            else:
+                self.table.put(row, data)
+        self.mutations = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+
+class InMemoryTable:
+    """
+    Rows are kept in a dict, row keys are also kept sorted for the scans
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.data = {}
+        self.row_keys = []
+
+    def put(self, row, data):
+        row = _to_bytes(row)
+        if row not in self.data:
+            bisect.insort(self.row_keys, row)
+            self.data[row] = {}
+        for column, value in data.items():
+            self.data[row][_to_bytes(column)] = _to_bytes(value)
+
+    def row(self, row, columns=None):
+        return dict(self.data.get(_to_bytes(row), {}))
+
+    def rows(self, rows, columns=None):
+        rows = [_to_bytes(row) for row in rows]
+        return [(row, dict(self.data[row])) for row in rows if row in self.data]
+
+    def counter_inc(self, row, column, value=1):
+        # A counter is an 8-byte big-endian long, same as in HBase
+        count = self.counter_get(row, column) + value
+        self.counter_set(row, column, count)
+        return count
+
+    def counter_set(self, row, column, value=0):
+        self.put(row, {column: struct.pack('>q', value)})
+
+    def counter_get(self, row, column):
+        value = self.row(row).get(_to_bytes(column))
+        return struct.unpack('>q', value)[0] if value else 0
+
+    def delete(self, row, columns=None):
+        row = _to_bytes(row)
+        if row in self.data:
+            del self.data[row]
+            self.row_keys.pop(bisect.bisect_left(self.row_keys, row))
+
+    def batch(self, **kwargs):
+        return InMemoryBatch(self)
+
+    def scan(self, row_start=None, row_stop=None, row_prefix=None, limit=None, reverse=False, **kwargs):
+        row_start, row_stop, row_prefix = _to_bytes(row_start), _to_bytes(row_stop), _to_bytes(row_prefix)
+        if reverse:
+            # reverse: from row_start (included) down to row_stop (excluded)
+            end = len(self.row_keys) if not row_start else bisect.bisect_right(self.row_keys, row_start)
+            start = 0 if not row_stop else bisect.bisect_right(self.row_keys, row_stop)
+            row_keys = self.row_keys[start:end][::-1]
+        else:
+            start = 0 if not row_start else bisect.bisect_left(self.row_keys, row_start)
+            end = len(self.row_keys) if not row_stop else bisect.bisect_left(self.row_keys, row_stop)
+            row_keys = self.row_keys[start:end]
+
+        count = 0
+        for row in row_keys:
+            if row_prefix is not None and not row.startswith(row_prefix):
+                continue
+            yield row, dict(self.data[row])
+            count += 1
+            if limit and count >= limit:
+                return
+
+
+class InMemoryHBaseConnection:
+
+    def __init__(self):
+        self.table_objects = {}
+
+    def tables(self):
+        return [name.encode('utf-8') for name in self.table_objects]
+
+    def create_table(self, name, families):
+        self.table_objects[name] = InMemoryTable(name)
+
+    def delete_table(self, name, disable=False):
+        self.table_objects.pop(name, None)
+
+    def table(self, name):
+        if isinstance(name, bytes):
+            name = name.decode('utf-8')
+        if name not in self.table_objects:
+            self.table_objects[name] = InMemoryTable(name)
+        return self.table_objects[name]
+
+
+def install():
+    """
+    Replace the connections of RedisClient and HBaseClient with the in-memory ones
+    """
+    import fakeredis
+    import redis
+    from django.conf import settings
+    from django_hbase.client import HBaseClient
+    from utils.backend_calls import InstrumentedHBaseConnection, InstrumentedRedis
+    from utils.redis_client import RedisClient
+
+    # Still InstrumentedRedis, only the connections in the pool are fake, so the calls are counted
+    RedisClient.reset()
+    RedisClient.connections = [
+        InstrumentedRedis(connection_pool=redis.ConnectionPool(
+            connection_class=fakeredis.FakeConnection,
+            server=fakeredis.FakeServer(),
+        ))
+        for _ in settings.REDIS_NODES
+    ]
+    hbase_connection = InstrumentedHBaseConnection(InMemoryHBaseConnection())
+    HBaseClient.reset()
+    HBaseClient.connection_factory = lambda: hbase_connection
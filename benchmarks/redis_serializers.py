@@ -0,0 +1,124 @@
+"""
+Compare the serializers of utils.redis_serializers for the cached objects:
+bytes per item, encode and decode time per item.
+
+No DB or Redis is needed, the objects are created in memory.
+
+    python -m benchmarks.redis_serializers
+    python -m benchmarks.redis_serializers --items 1000 --repeat 5 --json
+"""
+import argparse
+import json
+import os
+import time
+
+import django
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'twitter.settings')
+    django.setup()
+
+
+def make_objects(count):
+    """
+    Objects in the same shape as the ones in the Redis lists
+    """
+    from newsfeeds.models import HBaseNewsFeed, NewsFeed
+    from tweets.models import Tweet
+    from utils.time_helper import datetime_to_timestamp, utc_now
+
+    now = utc_now()
+    tweets = [
+        Tweet(
+            id=i + 1,
+            user_id=i % 100 + 1,
+            content='This is tweet number {} of a benchmark, long enough like a real one'.format(i),
+            created_at=now,
+            updated_at=now,
+            likes_count=i % 7,
+            comments_count=i % 3,
+        )
+        for i in range(count)
+    ]
+    newsfeeds = [
+        NewsFeed(id=i + 1, user_id=1, tweet_id=i + 1, created_at=now)
+        for i in range(count)
+    ]
+    hbase_newsfeeds = [
+        HBaseNewsFeed(user_id=1, tweet_id=i + 1, created_at=datetime_to_timestamp(now) + i)
+        for i in range(count)
+    ]
+    return {
+        'tweets.Tweet': tweets,
+        'newsfeeds.NewsFeed': newsfeeds,
+        'newsfeeds.HBaseNewsFeed': hbase_newsfeeds,
+    }
+
+
+def bench_serializer(serializer, objects, repeat):
+    best_encode, best_decode = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        serialized_list = [serializer.serialize(obj) for obj in objects]
+        encode = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for serialized_data in serialized_list:
+            serializer.deserialize(serialized_data)
+        decode = time.perf_counter() - start
+
+        best_encode = encode if best_encode is None else min(best_encode, encode)
+        best_decode = decode if best_decode is None else min(best_decode, decode)
+
+    total_bytes = sum(
+        len(data if isinstance(data, bytes) else data.encode('utf-8'))
+        for data in serialized_list
+    )
+    return {
+        'bytes_per_item': total_bytes / len(objects),
+        'encode_us_per_item': best_encode / len(objects) * 1000000,
+        'decode_us_per_item': best_decode / len(objects) * 1000000,
+    }
+
+
+def run(items=1000, repeat=5):
+    from utils.redis_serializers import SERIALIZERS
+
+    results = []
+    for model_label, objects in make_objects(items).items():
+        for name, serializer in SERIALIZERS.items():
+            result = bench_serializer(serializer, objects, repeat)
+            result.update({'model': model_label, 'serializer': name, 'items': items})
+            results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = parser.parse_args()
+
+    setup_django()
+    results = run(args.items, args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print('{:<24} {:<10} {:>10} {:>12} {:>12}'.format(
+        'model', 'serializer', 'bytes/item', 'encode us', 'decode us',
+    ))
+    for result in results:
+        print('{:<24} {:<10} {:>10.1f} {:>12.2f} {:>12.2f}'.format(
+            result['model'],
+            result['serializer'],
+            result['bytes_per_item'],
+            result['encode_us_per_item'],
+            result['decode_us_per_item'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,313 @@
+"""
+Replay recorded requests against the Django test client or a running server (e.g. gunicorn),
+and report p50/p95/p99 latency and error rate per endpoint.
+
+One JSON request per line:
+    {"method": "GET", "path": "/api/newsfeeds/", "query": "created_at__lt=...", "user_id": 3}
+    {"method": "POST", "path": "/api/tweets/", "data": {"content": "hello"}, "user_id": 3}
+- method: default GET
+- path: may contain the query string as well, lines without a path are skipped
+- query: string or dict, optional
+- data: body of POST/PUT/PATCH, optional
+- user_id: who sends the request, optional, anonymous if missing
+The production log lines of utils.middlewares.BackendCallsMiddleware are in this format too.
+
+    python -m benchmarks.replay traffic.jsonl
+    python -m benchmarks.replay traffic.jsonl --concurrency 8 --rate 200 --loop 3
+    python -m benchmarks.replay traffic.jsonl --target http://127.0.0.1:8000 --login admin:password
+
+--target client (default): Django test client in this process, users are authenticated by user_id
+    By default it runs on benchmarks.settings with a new test database, same as benchmarks.run:
+    --backends fake (default) needs no service, --backends local uses the test database and redis db 0
+    of the local services. The production settings are only used when asked for explicitly:
+        DJANGO_SETTINGS_MODULE=twitter.settings python -m benchmarks.replay traffic.jsonl
+--target http://...: real HTTP requests, users are all the one of --login (or anonymous)
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import django
+
+ID_PATTERN = re.compile(r'/\d+(?=/|$)')
+
+
+def load_entries(path, limit=None):
+    """
+    :return: (entries, number of skipped lines)
+    """
+    entries, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                skipped += 1
+                continue
+            if not isinstance(entry, dict) or not entry.get('path'):
+                skipped += 1
+                continue
+            entries.append(entry)
+            if limit and len(entries) >= limit:
+                break
+    return entries, skipped
+
+
+def get_url(entry):
+    query = entry.get('query')
+    if not query:
+        return entry['path']
+    if isinstance(query, dict):
+        query = urlencode(query, doseq=True)
+    separator = '&' if '?' in entry['path'] else '?'
+    return entry['path'] + separator + query
+
+
+def get_endpoint(entry):
+    """
+    GET /api/tweets/12/?a=b -> GET /api/tweets/{id}/
+    """
+    path = entry['path'].split('?')[0]
+    return '{} {}'.format(entry.get('method', 'GET').upper(), ID_PATTERN.sub('/{id}', path))
+
+
+def percentile(sorted_values, percent):
+    """
+    Nearest-rank percentile of a sorted list
+    """
+    if not sorted_values:
+        return None
+    index = max(0, int(round(percent / 100 * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class ClientTarget:
+    """
+    Django test client, one APIClient for each (thread, user)
+    """
+
+    def __init__(self, backends='fake'):
+        # The test database of benchmarks.settings is created here and destroyed by close()
+        self.test_database = 'DJANGO_SETTINGS_MODULE' not in os.environ
+        if self.test_database:
+            from benchmarks.run import setup_django
+            setup_django(backends)
+        else:
+            django.setup()
+            from django.test.utils import setup_test_environment
+            setup_test_environment()
+            # testserver in ALLOWED_HOSTS
+        self.local = threading.local()
+        self.users = {}
+
+    def get_client(self, user_id):
+        from django.contrib.auth.models import User
+        from rest_framework.test import APIClient
+
+        if not hasattr(self.local, 'clients'):
+            self.local.clients = {}
+        if user_id not in self.local.clients:
+            client = APIClient()
+            if user_id is not None:
+                if user_id not in self.users:
+                    self.users[user_id] = User.objects.filter(id=user_id).first()
+                if self.users[user_id] is not None:
+                    client.force_authenticate(self.users[user_id])
+            self.local.clients[user_id] = client
+        return self.local.clients[user_id]
+
+    def send(self, entry):
+        client = self.get_client(entry.get('user_id'))
+        method = getattr(client, entry.get('method', 'GET').lower())
+        if entry.get('data') is not None:
+            response = method(get_url(entry), entry['data'], format='json')
+        else:
+            response = method(get_url(entry))
+        return response.status_code
+
+    def close(self):
+        from django.db import connections
+        if self.test_database:
+            from benchmarks.run import teardown_django
+            teardown_django()
+        connections.close_all()
+
+
+class HTTPTarget:
+    """
+    Real HTTP requests with the requests library, one session for each thread
+    """
+
+    def __init__(self, base_url, login=None, timeout=10):
+        self.base_url = base_url.rstrip('/')
+        self.login = login
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def get_session(self):
+        import requests
+
+        if hasattr(self.local, 'session'):
+            return self.local.session
+        session = requests.Session()
+        if self.login:
+            username, password = self.login.split(':', 1)
+            response = session.post(
+                self.base_url + '/api/accounts/login/',
+                data={'username': username, 'password': password},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+        self.local.session = session
+        return session
+
+    def send(self, entry):
+        session = self.get_session()
+        headers = {}
+        if 'csrftoken' in session.cookies:
+            # SessionAuthentication checks CSRF for unsafe methods
+            headers['X-CSRFToken'] = session.cookies['csrftoken']
+        response = session.request(
+            entry.get('method', 'GET').upper(),
+            self.base_url + get_url(entry),
+            json=entry.get('data'),
+            headers=headers,
+            timeout=self.timeout,
+        )
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+def replay(target, entries, concurrency=1, rate=None):
+    """
+    Send the entries in order with `concurrency` workers.
+    rate: requests per second of all the workers, None for as fast as possible
+    (open loop: requests are started on schedule, no matter how slow the previous ones are,
+    until all the workers are busy)
+
+    :return: {endpoint: [(latency in seconds, status code or None for exception)]}
+    """
+    results = {}
+    lock = threading.Lock()
+
+    def send(entry):
+        start = time.perf_counter()
+        try:
+            status = target.send(entry)
+        except Exception:
+            status = None
+        latency = time.perf_counter() - start
+        with lock:
+            results.setdefault(get_endpoint(entry), []).append((latency, status))
+
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for index, entry in enumerate(entries):
+            if rate:
+                delay = started_at + index / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            executor.submit(send, entry)
+    return results, time.perf_counter() - started_at
+
+
+def summarize(results, duration):
+    report = []
+    for endpoint, samples in sorted(results.items()):
+        latencies = sorted(latency for latency, _ in samples)
+        errors = sum(1 for _, status in samples if status is None or status >= 500)
+        client_errors = sum(1 for _, status in samples if status is not None and 400 <= status < 500)
+        report.append({
+            'endpoint': endpoint,
+            'requests': len(samples),
+            'error_rate': errors / len(samples),
+            'client_error_rate': client_errors / len(samples),
+            'mean_ms': sum(latencies) / len(latencies) * 1000,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p95_ms': percentile(latencies, 95) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+        })
+    total = sum(item['requests'] for item in report)
+    return {
+        'duration_s': duration,
+        'requests': total,
+        'throughput_rps': total / duration if duration else None,
+        'endpoints': report,
+    }
+
+
+def print_report(report):
+    print('{:<48} {:>8} {:>8} {:>8} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'requests', 'errors', '4xx', 'p50 ms', 'p95 ms', 'p99 ms',
+    ))
+    for item in report['endpoints']:
+        print('{:<48} {:>8} {:>7.1f}% {:>7.1f}% {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            item['endpoint'],
+            item['requests'],
+            item['error_rate'] * 100,
+            item['client_error_rate'] * 100,
+            item['p50_ms'],
+            item['p95_ms'],
+            item['p99_ms'],
+        ))
+    print('{} requests in {:.2f}s, {:.1f} requests/s'.format(
+        report['requests'],
+        report['duration_s'],
+        report['throughput_rps'] or 0,
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('log', help='JSON lines of the recorded requests')
+    parser.add_argument('--target', default='client', help='"client" or the base url of a server')
+    parser.add_argument('--login', help='username:password for --target http://...')
+    parser.add_argument(
+        '--backends',
+        choices=('fake', 'local'),
+        default='fake',
+        help='services of --target client, see benchmarks.settings',
+    )
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--rate', type=float, help='requests per second, default: as fast as possible')
+    parser.add_argument('--loop', type=int, default=1, help='replay the log this many times')
+    parser.add_argument('--limit', type=int, help='only the first N requests of the log')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args()
+
+    entries, skipped = load_entries(args.log, args.limit)
+    if skipped:
+        print('{} lines without a request path are skipped'.format(skipped), file=sys.stderr)
+    if not entries:
+        print('No request to replay in {}'.format(args.log), file=sys.stderr)
+        sys.exit(1)
+
+    if args.target == 'client':
+        target = ClientTarget(args.backends)
+    else:
+        target = HTTPTarget(args.target, args.login)
+    try:
+        results, duration = replay(target, entries * args.loop, args.concurrency, args.rate)
+    finally:
+        target.close()
+
+    report = summarize(results, duration)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,324 @@
+"""
+Benchmarks of the hot paths: newsfeed list, tweet list, follower list, fanout and the cache serializers.
+
+For each data size, it seeds one author with N followers and N tweets,
+and one of the followers (the viewer) with N newsfeeds. Then each endpoint is called
+with a cold cache (Redis and memcached cleared before every call) and a warm cache.
+Latencies are in ms, backend calls are counted by utils.backend_calls.
+
+    python -m benchmarks.run
+    python -m benchmarks.run --sizes 10,100,1000 --repeat 5 --hbase --output before.json
+    python -m benchmarks.run --compare before.json
+
+--backends fake (default) needs no service: sqlite, locmem, fakeredis and in-memory HBase
+--backends local uses MySQL/memcached/Redis/HBase of twitter.settings, see benchmarks.settings
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import django
+
+VIEW_BENCHMARKS = ('newsfeeds.list', 'tweets.list', 'friendships.followers')
+
+
+def setup_django(backends):
+    os.environ['BENCHMARK_BACKENDS'] = backends
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'benchmarks.settings'
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    # ALLOWED_HOSTS for the test client, etc.
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    if backends == 'fake':
+        from benchmarks import fakes
+        fakes.install()
+
+
+def teardown_django():
+    from django.conf import settings
+    from django.db import connection
+    connection.creation.destroy_test_db(settings.DATABASES['default']['NAME'], verbosity=0)
+
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL,
+        ).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def clear_cache(use_hbase):
+    from django.core.cache import caches
+    from utils.redis_client import RedisClient
+    RedisClient.clear()
+    caches['testing'].clear()
+    # the gatekeepers are in Redis too
+    set_hbase_switches(use_hbase)
+
+
+def reset_hbase_tables():
+    from django_hbase.models import HBaseModel
+    for hbase_model_class in HBaseModel.__subclasses__():
+        hbase_model_class.drop_table()
+        hbase_model_class.create_table()
+
+
+def set_hbase_switches(on):
+    from gatekeeper.models import GateKeeper
+    for gk_name in ('switch_friendship_to_hbase', 'switch_newsfeed_to_hbase'):
+        GateKeeper.set_kv(gk_name, 'percent', 100 if on else 0)
+
+
+def seed(size, use_hbase):
+    """
+    One author with `size` followers and `size` tweets,
+    the first follower (viewer) has the `size` tweets in the newsfeeds
+
+    bulk_create / batch_create are used, so no listener or fanout is triggered while seeding
+    """
+    from django.contrib.auth.models import User
+    from friendships.models import Friendship, HBaseFollower, HBaseFollowing, HBaseFriendship
+    from newsfeeds.models import HBaseNewsFeed, NewsFeed
+    from tweets.models import Tweet
+
+    author = User.objects.create_user(username='author{}'.format(size))
+    User.objects.bulk_create([
+        User(username='follower{}_{}'.format(size, i))
+        for i in range(size)
+    ])
+    followers = list(
+        User.objects.filter(username__startswith='follower{}_'.format(size)).order_by('id')
+    )
+    Friendship.objects.bulk_create([
+        Friendship(from_user=follower, to_user=author)
+        for follower in followers
+    ])
+    Tweet.objects.bulk_create([
+        Tweet(user=author, content='benchmark tweet {}'.format(i), photo_urls=[])
+        for i in range(size)
+    ])
+    tweets = list(Tweet.objects.filter(user=author))
+    viewer = followers[0]
+
+    if use_hbase:
+        now = int(time.time() * 1000000)
+        HBaseFollower.batch_create([
+            {'to_user_id': author.id, 'created_at': now + i, 'from_user_id': follower.id}
+            for i, follower in enumerate(followers)
+        ])
+        HBaseFollowing.batch_create([
+            {'from_user_id': follower.id, 'created_at': now + i, 'to_user_id': author.id}
+            for i, follower in enumerate(followers)
+        ])
+        HBaseFriendship.batch_create([
+            {'from_user_id': follower.id, 'to_user_id': author.id, 'created_at': now + i}
+            for i, follower in enumerate(followers)
+        ])
+        HBaseNewsFeed.batch_create([
+            {'user_id': viewer.id, 'created_at': tweet.timestamp + i, 'tweet_id': tweet.id}
+            for i, tweet in enumerate(tweets)
+        ])
+    else:
+        NewsFeed.objects.bulk_create([
+            NewsFeed(user=viewer, tweet=tweet, created_at=tweet.created_at)
+            for tweet in tweets
+        ])
+    return author, viewer
+
+
+def summarize(name, size, cache, latencies, calls, **kwargs):
+    result = {
+        'name': name,
+        'size': size,
+        'cache': cache,
+        'runs': len(latencies),
+        'min_ms': min(latencies) * 1000,
+        'median_ms': statistics.median(latencies) * 1000,
+        'max_ms': max(latencies) * 1000,
+        'calls': {
+            backend: value['count']
+            for backend, value in calls.items()
+        },
+    }
+    result.update(kwargs)
+    return result
+
+
+def bench_view(name, client, url, params, size, repeat, use_hbase):
+    results = []
+    for cache in ('cold', 'warm'):
+        latencies = []
+        response = None
+        if cache == 'warm':
+            clear_cache(use_hbase)
+            client.get(url, params)
+        for _ in range(repeat):
+            if cache == 'cold':
+                clear_cache(use_hbase)
+            start = time.perf_counter()
+            response = client.get(url, params)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise Exception('{} {} returned {}'.format(name, url, response.status_code))
+        results.append(summarize(name, size, cache, latencies, response.backend_calls))
+    return results
+
+
+def bench_fanout(author, size, repeat, use_hbase):
+    from newsfeeds.tasks import fanout_newsfeeds_main_task
+    from tweets.models import Tweet
+    from utils.backend_calls import BackendCalls
+
+    latencies = []
+    calls = None
+    for i in range(repeat):
+        # a new tweet for each run, fanout is called by the tweet API rather than the listeners
+        tweet = Tweet.objects.create(user=author, content='fanout tweet {}'.format(i), photo_urls=[])
+        created_at = tweet.timestamp if use_hbase else tweet.created_at
+        with BackendCalls.collect() as calls:
+            start = time.perf_counter()
+            fanout_newsfeeds_main_task(tweet.id, created_at, author.id)
+            latencies.append(time.perf_counter() - start)
+    return [summarize('newsfeeds.fanout', size, None, latencies, calls)]
+
+
+def bench_serializers(size, repeat):
+    from benchmarks import redis_serializers
+
+    results = []
+    for result in redis_serializers.run(size, repeat):
+        results.append({
+            'name': 'serializers.{}.{}'.format(result['model'], result['serializer']),
+            'size': size,
+            'cache': None,
+            'bytes_per_item': result['bytes_per_item'],
+            'encode_us_per_item': result['encode_us_per_item'],
+            'decode_us_per_item': result['decode_us_per_item'],
+        })
+    return results
+
+
+def run(sizes, repeat, use_hbase, only=None):
+    from django.db import transaction
+    from rest_framework.test import APIClient
+
+    def selected(name):
+        return only is None or any(name.startswith(prefix) for prefix in only)
+
+    results = []
+    for size in sizes:
+        clear_cache(use_hbase)
+        reset_hbase_tables()
+        # everything seeded for this size is rolled back at the end
+        with transaction.atomic():
+            author, viewer = seed(size, use_hbase)
+            client = APIClient()
+            client.force_authenticate(viewer)
+            views = {
+                'newsfeeds.list': ('/api/newsfeeds/', {}),
+                'tweets.list': ('/api/tweets/', {'user_id': author.id}),
+                'friendships.followers': ('/api/friendships/{}/followers/'.format(author.id), {}),
+            }
+            for name in VIEW_BENCHMARKS:
+                if selected(name):
+                    url, params = views[name]
+                    results.extend(bench_view(name, client, url, params, size, repeat, use_hbase))
+            if selected('newsfeeds.fanout'):
+                results.extend(bench_fanout(author, size, repeat, use_hbase))
+            transaction.set_rollback(True)
+        if selected('serializers'):
+            results.extend(bench_serializers(size, repeat))
+    return results
+
+
+def get_result_key(result):
+    return result['name'], result['size'], result['cache']
+
+
+def compare(results, baseline):
+    """
+    Print the change of the median latency (and backend calls) against a previous run
+    """
+    baseline_results = {get_result_key(result): result for result in baseline['results']}
+    print('{:<48} {:>6} {:<5} {:>12} {:>12} {:>8}  {}'.format(
+        'name', 'size', 'cache', 'before ms', 'after ms', 'change', 'calls changed',
+    ))
+    for result in results:
+        before = baseline_results.get(get_result_key(result))
+        if before is None or 'median_ms' not in result:
+            continue
+        change = (result['median_ms'] - before['median_ms']) / before['median_ms'] * 100
+        calls_changed = {
+            backend: '{}->{}'.format(before['calls'].get(backend), count)
+            for backend, count in result['calls'].items()
+            if before['calls'].get(backend) != count
+        }
+        print('{:<48} {:>6} {:<5} {:>12.2f} {:>12.2f} {:>+7.1f}%  {}'.format(
+            result['name'],
+            result['size'],
+            result['cache'] or '-',
+            before['median_ms'],
+            result['median_ms'],
+            change,
+            calls_changed or '',
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--sizes', default='10,100,1000', help='comma separated data sizes')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--backends', choices=('fake', 'local'), default='fake')
+    parser.add_argument('--hbase', action='store_true', help='turn on the HBase gatekeepers')
+    parser.add_argument('--only', help='comma separated name prefixes, e.g. newsfeeds,serializers')
+    parser.add_argument('--output', help='write the JSON results to this file, default: stdout')
+    parser.add_argument('--compare', help='JSON results of a previous run to compare with')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    only = args.only.split(',') if args.only else None
+
+    setup_django(args.backends)
+    try:
+        results = run(sizes, args.repeat, args.hbase, only)
+    finally:
+        teardown_django()
+
+    report = {
+        'meta': {
+            'git_commit': get_git_commit(),
+            'timestamp': int(time.time()),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'backends': args.backends,
+            'hbase': args.hbase,
+            'sizes': sizes,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    elif not args.compare:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
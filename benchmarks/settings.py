@@ -0,0 +1,37 @@
+"""
+Settings for the benchmarks, see benchmarks.run
+
+BENCHMARK_BACKENDS=fake (default): sqlite, locmem cache, fakeredis and in-memory HBase
+BENCHMARK_BACKENDS=local: MySQL, memcached, Redis and HBase of twitter.settings,
+    with the same isolation as the unit tests (test database, redis db 0, test_ HBase tables)
+"""
+from twitter.settings import *  # noqa
+
+# Same isolation as `python manage.py test`
+TESTING = True
+REDIS_DB = 0
+REDIS_NODES = [
+    {'host': REDIS_HOST, 'port': REDIS_PORT, 'db': REDIS_DB},
+]
+CELERY_TASK_ALWAYS_EAGER = True
+# fanout tasks run in the same process, so they can be timed
+DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
+MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'django-twitter-test-media')
+RATELIMIT_ENABLE = False
+BACKEND_CALLS_IN_HEADERS = True
+
+if os.getenv('BENCHMARK_BACKENDS', 'fake') == 'fake':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:',
+        }
+    }
+    CACHES = {
+        name: {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': name,
+            'TIMEOUT': 86400,
+        }
+        for name in ('default', 'testing', 'ratelimit')
+    }
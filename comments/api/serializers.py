@@ -6,6 +6,7 @@ from accounts.api.serializers import UserSerializerForComment
 from comments.models import Comment
 from likes.services import LikeService
 from tweets.models import Tweet
+from utils.counter_helper import CounterHelper
 
 
 class CommentSerializer(serializers.ModelSerializer):
@@ -45,10 +46,15 @@ class CommentSerializer(serializers.ModelSerializer):
         )
 
     def get_has_liked(self, obj):
+        # liked_comment_ids: computed by the view for the whole page, see LikeService.get_liked_object_ids
+        liked_comment_ids = self.context.get('liked_comment_ids')
+        if liked_comment_ids is not None:
+            return obj.id in liked_comment_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
     def get_likes_count(self, obj):
-        return obj.like_set.count()
+        # SELECT COUNT(*) for each comment -> Redis GET, same as TweetSerializer
+        return CounterHelper.get_count(obj, 'likes_count')
     
 
 class CommentSerializerForCreate(serializers.ModelSerializer):
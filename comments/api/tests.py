@@ -3,6 +3,9 @@ from rest_framework.test import APIClient
 
 from comments.models import Comment
 from testing.testcases import TestCase
+from tweets.constants import TWEET_DETAIL_COMMENTS_LIMIT
+from utils.counter_helper import CounterHelper
+from utils.paginations import EndlessPagination
 
 COMMENT_URL = '/api/comments/'
 COMMENT_DETAIL_URL = '/api/comments/{}/'
@@ -147,6 +150,48 @@ class CommentAPITestCase(TestCase):
             'user_id': self.user2.id
         })
         self.assertEqual(len(response.data['comments']), 2)
+        self.assertEqual(response.data['has_next_page'], False)
+
+        # Negative case: tweet_id is not a number
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_pagination_and_cache(self):
+        page_size = EndlessPagination.page_size
+        comments = [
+            self.create_comment(self.user1, self.tweet, str(i))
+            for i in range(page_size + 5)
+        ]
+        newest_first = [comment.id for comment in comments[::-1]]
+
+        # first page from the cache, next page from DB
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual([c['id'] for c in response.data['comments']], newest_first[:page_size])
+        response = self.anonymous_client.get(COMMENT_URL, {
+            'tweet_id': self.tweet.id,
+            'created_at__lt': response.data['comments'][-1]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual([c['id'] for c in response.data['comments']], newest_first[page_size:])
+
+        # the cached list follows create, update and delete
+        response = self.user2_client.post(COMMENT_URL, {'tweet_id': self.tweet.id, 'content': 'new one'})
+        new_comment_id = response.data['id']
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['comments'][0]['id'], new_comment_id)
+        self.user2_client.put(COMMENT_DETAIL_URL.format(new_comment_id), {'content': 'edited'})
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['comments'][0]['content'], 'edited')
+        self.user2_client.delete(COMMENT_DETAIL_URL.format(new_comment_id))
+        response = self.anonymous_client.get(COMMENT_URL, {'tweet_id': self.tweet.id})
+        self.assertEqual(response.data['comments'][0]['id'], newest_first[0])
+
+        # tweet detail only has the newest comments, comments_count is the total
+        response = self.anonymous_client.get(TWEET_DETAIL_URL.format(self.tweet.id))
+        self.assertEqual(len(response.data['comments']), TWEET_DETAIL_COMMENTS_LIMIT)
+        self.assertEqual(response.data['comments'][0]['id'], newest_first[0])
+        self.assertEqual(response.data['comments_count'], len(comments))
 
     def test_comments_count(self):
         # Setup: Create a new tweet with no like/comment
@@ -184,12 +229,15 @@ class CommentAPITestCase(TestCase):
             client.post(COMMENT_URL, data)
             response = client.get(tweet_url)
             self.assertEqual(response.data['comments_count'], i + 1)
+            # the DB is updated by the flush
+            CounterHelper.flush()
             self.tweet.refresh_from_db()
             self.assertEqual(self.tweet.comments_count, i + 1)
         
         comment_data = self.user2_client.post(COMMENT_URL, data).data
         response = self.user2_client.get(tweet_url)
         self.assertEqual(response.data['comments_count'], 3)
+        CounterHelper.flush()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 3)
 
@@ -199,6 +247,7 @@ class CommentAPITestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.user2_client.get(tweet_url)
         self.assertEqual(response.data['comments_count'], 3)
+        CounterHelper.flush()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 3)
 
@@ -207,5 +256,6 @@ class CommentAPITestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.user1_client.get(tweet_url)
         self.assertEqual(response.data['comments_count'], 2)
+        CounterHelper.flush()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 2)
\ No newline at end of file
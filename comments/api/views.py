@@ -4,15 +4,18 @@ from comments.api.serializers import (
     CommentSerializerForUpdate,
 )
 from comments.models import Comment
+from comments.services import CommentService
 from django.contrib.auth.models import User
 from django.utils.decorators import method_decorator
 from inbox.services import NotificationService
+from likes.services import LikeService
 from ratelimit.decorators import ratelimit
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from utils.decorators import required_params
+from utils.paginations import EndlessPagination
 from utils.permissions import IsObjectOwner
 
 
@@ -47,6 +50,7 @@ class CommentViewSet(viewsets.GenericViewSet):
     # GET /api/comments/<pk>/
 
     filterset_fields = ('tweet_id',)
+    pagination_class = EndlessPagination
     # after you installed django-filter
     
     def get_permissions(self):
@@ -93,9 +97,18 @@ class CommentViewSet(viewsets.GenericViewSet):
         # AFTER django filter
         queryset = self.get_queryset()
         # this get_queryset is using the `queryset = Comment.objects.all()` above
-        comments = self.filter_queryset(queryset).\
-                prefetch_related('user').\
-                order_by('-created_at')
+        queryset = self.filter_queryset(queryset)
+        # filter_queryset also validates tweet_id (400 if it is not a number)
+
+        # Pagination: a hot tweet could have thousands of comments
+        # The newest ones are in the Redis list of the tweet, older pages use the index (tweet, created_at)
+        cached_comments = CommentService.get_cached_comments(int(request.query_params['tweet_id']))
+        comments = self.paginator.paginate_cached_list(cached_comments, request)
+        if comments is None:
+            comments = list(self.paginator.paginate_queryset(
+                queryset.prefetch_related('user'),
+                request,
+            ))
         # prefetch_related('user'): to utilize the massive amount of SQL query.
         # check serializer CommentSerializer class for more information
         # you can also user select_related('user'), it will use the JOIN query
@@ -107,13 +120,19 @@ class CommentViewSet(viewsets.GenericViewSet):
         serializer = CommentSerializer(
             comments, 
             many=True,
-            context={'request': request},
+            context={
+                'request': request,
+                'liked_comment_ids': LikeService.get_liked_object_ids(
+                    request.user, Comment, [comment.id for comment in comments],
+                ),
+            },
         )
         # many=True means it will return a list of Comment objects
 
         return Response({
             'success': True, 
             'comments': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
         }, status=status.HTTP_200_OK)
     
     @method_decorator(ratelimit(key='user', rate='3/s', method='POST', block=True))
@@ -1,31 +1,34 @@
-from utils.listeners import invalidate_object_cache
-from utils.redis_helper import RedisHelper
+from utils.counter_helper import CounterHelper
+from utils.listeners import invalidate_object_cache, run_now_and_on_commit
 
 def increase_comments_count(sender, instance, created, ** kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
-
     if not created:
         return
     
-    Tweet.objects.filter(id=instance.tweet_id).update(
-        comments_count=F('comments_count') + 1
-    )
-    
+    # No UPDATE comments_count = comments_count + 1 here, the delta is written to the DB later
+    # see utils.counter_helper.CounterHelper
+    #
     # Then, how about cache?
     # If you don't update cache, the likes and comments count will be highly different compare to the source of truth
     #
     # We will use the increase and decrease portol provided by the Cache providors
     # -> likes and comments count should be stripping from tweet in cache, so we can use the protols
     # -> otherwise, every click will cause a cache invalidate for the whole tweet
-    RedisHelper.increase_count(instance.tweet, 'comments_count')
+    CounterHelper.increase_count(instance.tweet, 'comments_count')
 
 def decrease_comments_count(sender, instance, **kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
+    CounterHelper.decrease_count(instance.tweet, 'comments_count')
+
+
+def push_comment_to_cache(sender, instance, created, **kwargs):
+    from comments.services import CommentService
+    if created:
+        CommentService.push_comment_to_cache(instance)
+        return
+    # edited
+    run_now_and_on_commit(CommentService.invalidate_comments_cache, instance)
 
-    Tweet.objects.filter(id=instance.tweet_id).update(
-        comments_count=F('comments_count') - 1
-    )
-    RedisHelper.decrease_count(instance.tweet, 'comments_count')
 
+def invalidate_comments_cache(sender, instance, **kwargs):
+    from comments.services import CommentService
+    run_now_and_on_commit(CommentService.invalidate_comments_cache, instance)
@@ -0,0 +1,46 @@
+# Generated by Django 3.2.19 on 2026-10-19 16:40
+
+from django.db import migrations
+from django.db.models import Count
+
+BATCH_SIZE = 1000
+
+
+def backfill_likes_count(apps, schema_editor):
+    """
+    likes_count of the existing comments is 0 after 0002, count their likes in the likes table
+    The comments with the same count are updated by one query, BATCH_SIZE ids at a time
+    """
+    Comment = apps.get_model('comments', 'Comment')
+    Like = apps.get_model('likes', 'Like')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    content_type = ContentType.objects.filter(app_label='comments', model='comment').first()
+    if content_type is None:
+        # a new database, no like can point to a comment yet
+        return
+
+    groups = {}
+    counts = Like.objects.filter(content_type=content_type)\
+        .order_by()\
+        .values_list('object_id')\
+        .annotate(count=Count('id'))
+    for comment_id, count in counts.iterator():
+        groups.setdefault(count, []).append(comment_id)
+    for count, comment_ids in groups.items():
+        comment_ids.sort()
+        for start in range(0, len(comment_ids), BATCH_SIZE):
+            Comment.objects.filter(id__in=comment_ids[start:start + BATCH_SIZE])\
+                .update(likes_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('comments', '0002_comment_likes_count'),
+        ('likes', '0001_initial'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_likes_count, migrations.RunPython.noop),
+    ]
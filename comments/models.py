@@ -3,7 +3,12 @@ from django.contrib.contenttypes.models import ContentType
 from django.db import models
 from django.db.models.signals import pre_delete, post_save
 
-from comments.listeners import increase_comments_count, decrease_comments_count
+from comments.listeners import (
+    decrease_comments_count,
+    increase_comments_count,
+    invalidate_comments_cache,
+    push_comment_to_cache,
+)
 from likes.models import Like
 from tweets.models import Tweet
 from utils.memcached_helper import MemcachedHelper
@@ -21,6 +26,10 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    likes_count = models.IntegerField(default=0, null=True)
+    # null=True: same as Tweet.likes_count, no table lock while migrating
+    # existing comments are filled by reconcile_counters_task
+
     class Meta:
         index_together = (('tweet', 'created_at'),)
         ordering = ['-created_at']
@@ -49,4 +58,6 @@ class Comment(models.Model):
         return (utc_now() - self.created_at).seconds / 3600
     
 pre_delete.connect(decrease_comments_count, sender=Comment)
-post_save.connect(increase_comments_count, sender=Comment)
\ No newline at end of file
+post_save.connect(increase_comments_count, sender=Comment)
+post_save.connect(push_comment_to_cache, sender=Comment)
+pre_delete.connect(invalidate_comments_cache, sender=Comment)
@@ -0,0 +1,38 @@
+from comments.models import Comment
+from twitter.cache import TWEET_COMMENTS_PATTERN
+from utils.cache_versions import CacheVersions
+from utils.redis_helper import RedisHelper
+
+
+def lazy_load_comments(tweet_id):
+    def _lazy_load(limit):
+        return Comment.objects.filter(tweet_id=tweet_id).order_by('-created_at')[:limit]
+        # Using the index (tweet, created_at)
+    return _lazy_load
+
+
+class CommentService(object):
+
+    @classmethod
+    def get_tweet_comments_key(cls, tweet_id):
+        return CacheVersions.format_key(TWEET_COMMENTS_PATTERN, Comment, tweet_id=tweet_id)
+
+    @classmethod
+    def get_cached_comments(cls, tweet_id):
+        """
+        The newest REDIS_LIST_LENGTH_LIMIT comments of a tweet, newest first
+        """
+        key = cls.get_tweet_comments_key(tweet_id)
+        return RedisHelper.load_objects(key, lazy_load_comments(tweet_id))
+
+    @classmethod
+    def push_comment_to_cache(cls, comment):
+        key = cls.get_tweet_comments_key(comment.tweet_id)
+        RedisHelper.push_object(key, comment, lazy_load_comments(comment.tweet_id))
+
+    @classmethod
+    def invalidate_comments_cache(cls, comment):
+        """
+        An edited or deleted comment can be anywhere in the list, simply reload the list next time
+        """
+        RedisHelper.invalidate_objects(cls.get_tweet_comments_key(comment.tweet_id))
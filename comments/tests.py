@@ -1,3 +1,7 @@
+from django.apps import apps
+from importlib import import_module
+
+from comments.models import Comment
 from testing.testcases import TestCase
 
 
@@ -33,3 +37,18 @@ class CommentModelTest(TestCase):
         user2 = self.create_user('user2')
         self.create_like(user2, self.comment)
         self.assertEqual(self.comment.like_set.count(), 2)
+
+    def test_backfill_likes_count(self):
+        """
+        Data migration: likes_count of the comments existing before the column
+        """
+        comment2 = self.create_comment(self.user1, self.tweet)
+        self.create_like(self.user1, self.comment)
+        self.create_like(self.create_user('user2'), self.comment)
+        self.create_like(self.user1, comment2)
+        Comment.objects.update(likes_count=0)
+
+        migration = import_module('comments.migrations.0003_backfill_comment_likes_count')
+        migration.backfill_likes_count(apps, None)
+        self.assertEqual(Comment.objects.get(id=self.comment.id).likes_count, 2)
+        self.assertEqual(Comment.objects.get(id=comment2.id).likes_count, 1)
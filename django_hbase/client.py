@@ -1,14 +1,40 @@
 import happybase
+import threading
 from django.conf import settings
+from utils.backend_calls import InstrumentedHBaseConnection
 
 
 class HBaseClient:
-    connection = None
+    """
+    One happybase connection for each thread
+
+    A happybase.Connection is one Thrift socket, it is NOT thread safe:
+    two threads calling HBase on the same socket at the same time interleave their frames,
+    and both of them could read the other's (or a broken) response.
+    The request threads and the threads of the shadow reads (utils.shadow_reads) all read HBase,
+    so each thread opens its own connection on the first HBase call, and keeps using it.
+    """
+    local = threading.local()
+    connection_factory = None
+    # Set by benchmarks.fakes to use the in-memory HBase, one instance shared by all the threads
 
     @classmethod
     def get_connection(cls):
-        if cls.connection:
-            return cls.connection
-        cls.connection = happybase.Connection(settings.HBASE_HOST)
-        # HBase normally have no username or password, thus, we will not provide public access in most of cases.
-        return cls.connection
\ No newline at end of file
+        connection = getattr(cls.local, 'connection', None)
+        if connection is not None:
+            return connection
+        if cls.connection_factory is not None:
+            connection = cls.connection_factory()
+        else:
+            connection = InstrumentedHBaseConnection(happybase.Connection(settings.HBASE_HOST))
+            # Instrumented: calls are counted by utils.middlewares.BackendCallsMiddleware
+            # HBase normally have no username or password, thus, we will not provide public access in most of cases.
+        cls.local.connection = connection
+        return connection
+
+    @classmethod
+    def reset(cls):
+        """
+        Drop the connections, say, before forking: the child processes must not share the sockets
+        """
+        cls.local = threading.local()
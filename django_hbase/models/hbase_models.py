@@ -237,6 +237,25 @@ class HBaseModel:
         table = cls.get_table()
         row_data = table.row(row_key)
         return cls.init_from_row(row_key, row_data)
+
+    # HBaseModel.batch_get()
+    # Friendship.batch_get([{from_user_id: 1, to_user_id: 2}, {from_user_id: 1, to_user_id: 3}])
+    @classmethod
+    def batch_get(cls, batch_keys):
+        """
+        Point reads of many rows in ONE round-trip, rather than calling get() in a loop
+        :return: instances in the same order as batch_keys, None if the row is not there
+        """
+        row_keys = [cls.serialize_row_key(keys) for keys in batch_keys]
+        if not row_keys:
+            return []
+        table = cls.get_table()
+        row_data_hash = dict(table.rows(row_keys))
+        # rows() only returns the rows found
+        return [
+            cls.init_from_row(row_key, row_data_hash.get(row_key))
+            for row_key in row_keys
+        ]
     
     # START: This part is for unit testing
 
@@ -298,6 +317,15 @@ class HBaseModel:
         start, stop, prefix are all accept tuples
         (row key 1, row key 2, ...)
         """
+        return list(cls.scan(start=start, stop=stop, prefix=prefix, limit=limit, reverse=reverse))
+
+    @classmethod
+    def scan(cls, start=None, stop=None, prefix=None, limit=None, reverse=False, batch_size=1000):
+        """
+        Same as filter, but a generator: the instances are yielded while the rows are scanned,
+        happybase fetches batch_size rows from HBase at a time
+        So a scan of millions of rows (e.g. an export) never holds all of them in the memory
+        """
         # Serialize tuple to string
         row_start = cls.serialize_row_key_from_tuple(start)
         row_stop = cls.serialize_row_key_from_tuple(stop)
@@ -305,16 +333,20 @@ class HBaseModel:
 
         # Scan the table
         table = cls.get_table()
-        rows = table.scan(row_start, row_stop, row_prefix, limit=limit, reverse=reverse)
+        rows = table.scan(
+            row_start,
+            row_stop,
+            row_prefix,
+            limit=limit,
+            reverse=reverse,
+            batch_size=batch_size,
+        )
         # https://happybase.readthedocs.io/en/latest/api.html search scan
         # Also go advanced_tools/hbase/02-before-filter.md for examples
 
-        # Deserialize to instance list
-        results = []
+        # Deserialize to instances
         for row_key, row_data in rows:
-            instance = cls.init_from_row(row_key, row_data)
-            results.append(instance)
-        return results
+            yield cls.init_from_row(row_key, row_data)
     
     @classmethod
     def delete(cls, **kwargs):
@@ -1,6 +1,7 @@
 from accounts.api.serializers import UserSerializerForFriendship
 from accounts.services import UserService
 from django.contrib.auth.models import User
+from friendships.constants import RELATIONSHIPS_USER_IDS_LIMIT
 from friendships.models import Friendship
 from friendships.services import FriendshipService
 from rest_framework import serializers
@@ -27,22 +28,24 @@ class BaseFriendshipSerializer(serializers.Serializer): # Serializer is the most
     def get_user_id(self, obj):
         raise NotImplementedError
 
-    def _get_following_user_id_set(self):
-        if self.context['request'].user.is_anonymous:
-            return {}
-        if hasattr(self, '_cached_following_user_id_set'):
-            return self._cached_following_user_id_set 
-        user_id_set = FriendshipService.get_following_user_id_set(
-            self.context['request'].user.id,
-        )
-        setattr(self, '_cached_following_user_id_set', user_id_set)
-        return user_id_set
-    
     def get_has_followed(self, obj):
-        return self.get_user_id(obj) in self._get_following_user_id_set()
+        # The views check the whole page at once and pass the result by the context,
+        # see FriendshipViewSet._get_followed_user_ids
+        followed_user_ids = self.context.get('followed_user_ids')
+        if followed_user_ids is not None:
+            return self.get_user_id(obj) in followed_user_ids
+        request = self.context.get('request')
+        if request is None or request.user.is_anonymous:
+            return False
+        user_id = self.get_user_id(obj)
+        return user_id in FriendshipService.get_followed_user_ids(request.user.id, [user_id])
     
     def get_user(self, obj):
-        user = UserService.get_user_by_id(self.get_user_id(obj))
+        user_id = self.get_user_id(obj)
+        # The views load the users of the whole page at once, see FriendshipViewSet._get_page_context
+        user = self.context.get('users', {}).get(user_id)
+        if user is None:
+            user = UserService.get_user_by_id(user_id)
         return UserSerializerForFriendship(user).data
         # we need .data to transfer this to a dict
     
@@ -82,4 +85,33 @@ class FriendshipSerializerForCreate(serializers.Serializer):
         )
     
     def update(self, instance, validated_data):
-        pass
\ No newline at end of file
+        pass
+
+
+class FriendshipSerializerForRelationships(serializers.Serializer):
+    """
+    Validate the query params of GET /api/friendships/relationships/
+    user_ids: comma separated, e.g. 1,2,3
+    """
+    user_ids = serializers.CharField()
+
+    def validate_user_ids(self, value):
+        try:
+            user_ids = [int(user_id) for user_id in value.split(',') if user_id.strip()]
+        except ValueError:
+            raise ValidationError('user_ids should be comma separated integers')
+        if not user_ids:
+            raise ValidationError('user_ids should not be empty')
+        # Keep the order of the client, drop the duplicates
+        user_ids = list(dict.fromkeys(user_ids))
+        if len(user_ids) > RELATIONSHIPS_USER_IDS_LIMIT:
+            raise ValidationError(
+                'At most {} user_ids in one request'.format(RELATIONSHIPS_USER_IDS_LIMIT)
+            )
+        return user_ids
+
+    def create(self, validated_data):
+        pass
+
+    def update(self, instance, validated_data):
+        pass
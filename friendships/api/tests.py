@@ -1,13 +1,24 @@
+import json
+
+from django.contrib.auth.models import User
+from friendships.constants import MUTUAL_FOLLOWERS_MAX_SIZE, RELATIONSHIPS_USER_IDS_LIMIT
 from friendships.models import Friendship
 from friendships.services import FriendshipService
+from friendships.tasks import build_follow_suggestions_task
 from rest_framework.test import APIClient
 from testing.testcases import TestCase
+from utils.backend_calls import BackendCalls
 from utils.paginations import EndlessPagination
 
 FOLLOW_URL = '/api/friendships/{}/follow/'
 UNFOLLOW_URL = '/api/friendships/{}/unfollow/'
 FOLLOWERS_URL = '/api/friendships/{}/followers/'
 FOLLOWINGS_URL = '/api/friendships/{}/followings/'
+RELATIONSHIPS_URL = '/api/friendships/relationships/'
+LIST_URL = '/api/friendships/'
+EXPORT_URL = '/api/friendships/export/'
+SUGGESTIONS_URL = '/api/friendships/suggestions/'
+MUTUAL_FOLLOWERS_URL = '/api/friendships/{}/mutual_followers/'
 
 
 class FriendshipApiTests(TestCase):
@@ -245,3 +256,187 @@ class FriendshipApiTests(TestCase):
         for result in response.data['results']:
             has_followed = (result['user']['id'] % 2 == 0)
             self.assertEqual(result['has_followed'], has_followed)
+
+    def test_relationships(self):
+        user3 = self.create_user('user3')
+        self.create_friendship(from_user=self.user1, to_user=self.user2)
+        self.create_friendship(from_user=user3, to_user=self.user1)
+        self.create_friendship(from_user=self.user1, to_user=user3)
+
+        # Anonymous User should not access
+        response = self.anonymous_client.get(RELATIONSHIPS_URL, {'user_ids': self.user2.id})
+        self.assertEqual(response.status_code, 403)
+
+        # Bad inputs
+        response = self.user1_client.get(RELATIONSHIPS_URL)
+        self.assertEqual(response.status_code, 400)
+        response = self.user1_client.get(RELATIONSHIPS_URL, {'user_ids': '1,abc'})
+        self.assertEqual(response.status_code, 400)
+        response = self.user1_client.get(RELATIONSHIPS_URL, {
+            'user_ids': ','.join(str(i) for i in range(1, RELATIONSHIPS_USER_IDS_LIMIT + 2)),
+        })
+        self.assertEqual(response.status_code, 400)
+
+        user_ids = [self.user2.id, user3.id, 12345, self.user2.id]
+        response = self.user1_client.get(RELATIONSHIPS_URL, {
+            'user_ids': ','.join(str(user_id) for user_id in user_ids),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['relationships'], [
+            {'user_id': self.user2.id, 'following': True, 'followed_by': False},
+            {'user_id': user3.id, 'following': True, 'followed_by': True},
+            {'user_id': 12345, 'following': False, 'followed_by': False},
+        ])
+
+        # the other direction
+        response = self.user2_client.get(RELATIONSHIPS_URL, {'user_ids': self.user1.id})
+        self.assertEqual(response.data['relationships'], [
+            {'user_id': self.user1.id, 'following': False, 'followed_by': True},
+        ])
+
+    def test_mutual_followers(self):
+        url = MUTUAL_FOLLOWERS_URL.format(self.user1.id)
+        followings = [
+            User.objects.get(username='user2_following{}'.format(i))
+            for i in range(3)
+        ]
+        for following in followings[:2]:
+            self.create_friendship(from_user=following, to_user=self.user1)
+
+        response = self.anonymous_client.get(url)
+        self.assertEqual(response.status_code, 403)
+        response = self.user2_client.get(url, {'size': 'abc'})
+        self.assertEqual(response.status_code, 400)
+        response = self.user2_client.get(url, {'size': MUTUAL_FOLLOWERS_MAX_SIZE + 1})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.user2_client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            [user['id'] for user in response.data['users']],
+            [followings[0].id, followings[1].id],
+        )
+        response = self.user2_client.get(url, {'size': 1})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([user['id'] for user in response.data['users']], [followings[0].id])
+        response = self.user2_client.get(url, {'size': 0})
+        self.assertEqual(response.data, {'count': 2, 'users': []})
+        # user1 follows nobody
+        response = self.user1_client.get(MUTUAL_FOLLOWERS_URL.format(self.user2.id))
+        self.assertEqual(response.data, {'count': 0, 'users': []})
+
+    def test_suggestions(self):
+        followings = [
+            User.objects.get(username='user2_following{}'.format(i))
+            for i in range(3)
+        ]
+        user3 = self.create_user('user3')
+        self.create_friendship(from_user=self.user1, to_user=self.user2)
+        self.create_friendship(from_user=self.user1, to_user=user3)
+        self.create_friendship(from_user=self.user2, to_user=self.user1)
+        self.create_friendship(from_user=user3, to_user=followings[0])
+
+        response = self.anonymous_client.get(SUGGESTIONS_URL)
+        self.assertEqual(response.status_code, 403)
+        # nothing before the batch
+        response = self.user1_client.get(SUGGESTIONS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['suggestions'], [])
+
+        with self.settings(FOLLOW_SUGGESTIONS_BLOCK_SIZE=3):
+            build_follow_suggestions_task()
+        response = self.user1_client.get(SUGGESTIONS_URL)
+        suggestions = response.data['suggestions']
+        # followed by both user2 and user3
+        self.assertEqual(suggestions[0]['user']['id'], followings[0].id)
+        self.assertEqual(suggestions[0]['mutual_count'], 2)
+        self.assertEqual(
+            {suggestion['user']['id'] for suggestion in suggestions[1:]},
+            {followings[1].id, followings[2].id},
+        )
+        self.assertEqual([suggestion['mutual_count'] for suggestion in suggestions[1:]], [1, 1])
+        # user2 follows user1 back, but user1 is not a suggestion of user1 itself
+        response = self.user2_client.get(SUGGESTIONS_URL)
+        self.assertEqual(
+            [suggestion['user']['id'] for suggestion in response.data['suggestions']],
+            [user3.id],
+        )
+
+        # followed after the batch
+        self.create_friendship(from_user=self.user1, to_user=followings[0])
+        response = self.user1_client.get(SUGGESTIONS_URL)
+        self.assertEqual(len(response.data['suggestions']), 2)
+        self.assertNotIn(
+            followings[0].id,
+            [suggestion['user']['id'] for suggestion in response.data['suggestions']],
+        )
+        # no graph traversal in the request: ZREVRANGE + SMISMEMBER
+        self.assertEqual(response.backend_calls['redis']['count'], 2)
+
+        with self.settings(FOLLOW_SUGGESTIONS_LIMIT=1):
+            build_follow_suggestions_task()
+        response = self.user1_client.get(SUGGESTIONS_URL)
+        self.assertEqual(len(response.data['suggestions']), 1)
+
+    def test_list(self):
+        page_size = EndlessPagination.page_size
+        friendships = []
+        for i in range(page_size + 2):
+            follower = self.create_user('user1_follower{}'.format(i))
+            friendships.append(self.create_friendship(from_user=follower, to_user=self.user1))
+        self.create_friendship(from_user=self.user2, to_user=friendships[-1].from_user)
+
+        # Bad inputs
+        response = self.user2_client.get(LIST_URL)
+        self.assertEqual(response.status_code, 400)
+        response = self.user2_client.get(LIST_URL, {'type': 'followers'})
+        self.assertEqual(response.status_code, 400)
+
+        # paginated, the users of a page are loaded at once
+        with BackendCalls.collect() as calls:
+            response = self.user2_client.get(LIST_URL, {'type': 'followers', 'to_user_id': self.user1.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['followers']), page_size)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(response.data['followers'][0]['has_followed'], True)
+        self.assertEqual(response.data['followers'][1]['has_followed'], False)
+        self.assertEqual(
+            response.data['followers'][0]['user']['username'],
+            friendships[-1].from_user.username,
+        )
+        self.assertLessEqual(calls['memcached']['count'], 4)
+
+        response = self.user2_client.get(LIST_URL, {
+            'type': 'followers',
+            'to_user_id': self.user1.id,
+            'created_at__lt': response.data['followers'][-1]['created_at'],
+        })
+        self.assertEqual(len(response.data['followers']), 2)
+        self.assertEqual(response.data['has_next_page'], False)
+
+        response = self.user2_client.get(LIST_URL, {'type': 'followings', 'from_user_id': self.user2.id})
+        self.assertEqual(len(response.data['followings']), 4)
+        response = self.user2_client.get(LIST_URL, {
+            'type': 'followings',
+            'from_user_id': self.user2.id,
+            'to_user_id': friendships[-1].from_user_id,
+        })
+        self.assertEqual(response.data['is_following'], True)
+
+    def test_export(self):
+        response = self.anonymous_client.get(EXPORT_URL, {'type': 'followers', 'to_user_id': self.user2.id})
+        self.assertEqual(response.status_code, 403)
+        response = self.user1_client.get(EXPORT_URL, {'type': 'followers'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.user1_client.get(EXPORT_URL, {'type': 'followers', 'to_user_id': self.user2.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        followers = Friendship.objects.filter(to_user=self.user2).order_by('-created_at')
+        self.assertEqual([row['user_id'] for row in rows], [fs.from_user_id for fs in followers])
+
+        response = self.user1_client.get(EXPORT_URL, {'type': 'followings', 'from_user_id': self.user2.id})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(len(rows), 3)
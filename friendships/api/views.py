@@ -1,11 +1,25 @@
+import json
+
+from accounts.api.serializers import UserSerializerForFriendship
+from accounts.services import UserService
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from friendships.api.serializers import (
     FollowerSerializer,
     FollowingSerializer,
-    FriendshipSerializerForCreate
+    FriendshipSerializerForCreate,
+    FriendshipSerializerForRelationships,
+)
+from friendships.constants import (
+    FOLLOW_SUGGESTIONS_PAGE_SIZE,
+    FRIENDSHIP_EXPORT_BATCH_SIZE,
+    MUTUAL_FOLLOWERS_MAX_SIZE,
+    MUTUAL_FOLLOWERS_SIZE,
 )
 from friendships.models import HBaseFollower, HBaseFollowing, Friendship
+from friendships.recommendations import FollowSuggestions
 from friendships.services import FriendshipService
 from gatekeeper.models import GateKeeper
 from ratelimit.decorators import ratelimit
@@ -13,6 +27,7 @@ from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from utils.decorators import required_params
 from utils.paginations import EndlessPagination
 
 
@@ -21,6 +36,40 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     serializer_class = FriendshipSerializerForCreate
     pagination_class = EndlessPagination
 
+    def _get_followed_user_ids(self, request, user_ids):
+        """
+        Which users of the page the viewer has followed, one SMISMEMBER for the whole page
+        """
+        if request.user.is_anonymous:
+            return set()
+        return FriendshipService.get_followed_user_ids(request.user.id, user_ids)
+
+    def _get_page_context(self, request, page, serializer_class):
+        """
+        Everything the serializer needs for a page, loaded for the whole page at once:
+        the users with profiles (2 memcached calls) and has_followed (1 Redis call)
+        Rather than a few calls for each row
+        """
+        get_user_id = serializer_class().get_user_id
+        user_ids = [get_user_id(friendship) for friendship in page]
+        return {
+            'request': request,
+            'users': UserService.get_users_through_cache(user_ids),
+            'followed_user_ids': self._get_followed_user_ids(request, user_ids),
+        }
+
+    def _paginate_followers(self, request, to_user_id):
+        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            return self.paginator.paginate_hbase(HBaseFollower, (to_user_id,), request)
+        friendships = Friendship.objects.filter(to_user_id=to_user_id).order_by('-created_at')
+        return self.paginator.paginate_queryset(friendships, request)
+
+    def _paginate_followings(self, request, from_user_id):
+        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            return self.paginator.paginate_hbase(HBaseFollowing, (from_user_id,), request)
+        friendships = Friendship.objects.filter(from_user_id=from_user_id).order_by('-created_at')
+        return self.paginator.paginate_queryset(friendships, request)
+
     @action(methods=['get'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
     def followers(self, request, pk):
@@ -30,14 +79,13 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         GET /api/friendships/<pk>/followers/
         """
         pk = int(pk) # In case type transform in paginator
-        paginator = self.paginator
-        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            page = paginator.paginate_hbase(HBaseFollower, (pk,), request)
-        else:
-            friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
-            page = paginator.paginate_queryset(friendships, request)
-        serializer = FollowerSerializer(page, many=True, context={'request': request})
-        return paginator.get_paginated_response(serializer.data)
+        page = self._paginate_followers(request, pk)
+        serializer = FollowerSerializer(
+            page,
+            many=True,
+            context=self._get_page_context(request, page, FollowerSerializer),
+        )
+        return self.paginator.get_paginated_response(serializer.data)
     
     @action(methods=['get'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
@@ -48,14 +96,13 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         GET /api/friendships/<pk>/followings/
         """
         pk = int(pk)
-        paginator = self.paginator
-        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            page = paginator.paginate_hbase(HBaseFollowing, (pk,), request)
-        else:
-            friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
-            page = paginator.paginate_queryset(friendships, request)
-        serializer = FollowingSerializer(page, many=True, context={'request': request})
-        return paginator.get_paginated_response(serializer.data)
+        page = self._paginate_followings(request, pk)
+        serializer = FollowingSerializer(
+            page,
+            many=True,
+            context=self._get_page_context(request, page, FollowingSerializer),
+        )
+        return self.paginator.get_paginated_response(serializer.data)
     
     @action(methods=['post'], detail=True, permission_classes=[IsAuthenticated])
     @method_decorator(ratelimit(key='user', rate='10/s', method='POST', block=True))
@@ -112,42 +159,211 @@ class FriendshipViewSet(viewsets.GenericViewSet):
             'deleted': deleted,
         }, status=status.HTTP_200_OK)
 
-    def list(self,request):
+    @action(methods=['get'], detail=False, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
+    @required_params(method='get', params=['user_ids'])
+    def relationships(self, request):
+        """
+        Follow states between the logged-in user and a list of users, in one request
+        GET /api/friendships/relationships/?user_ids=1,2,3
+
+        Rather than one request for each user of a user list, search results or tweet authors
+        - following: the logged-in user has followed the user, one SMISMEMBER of the following set
+        - followed_by: the user has followed the logged-in user, one IN query (or one HBase batch read)
+        """
+        serializer = FriendshipSerializerForRelationships(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Please check your input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        user_ids = serializer.validated_data['user_ids']
+        following_ids = FriendshipService.get_followed_user_ids(request.user.id, user_ids)
+        followed_by_ids = FriendshipService.get_follower_user_ids(request.user.id, user_ids)
+        return Response({
+            'relationships': [
+                {
+                    'user_id': user_id,
+                    'following': user_id in following_ids,
+                    'followed_by': user_id in followed_by_ids,
+                }
+                for user_id in user_ids
+            ],
+        }, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=True, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
+    def mutual_followers(self, request, pk):
+        """
+        The users the logged-in user follows who also follow user pk,
+        for "followed by X, Y and N others you follow" on a profile page
+        GET /api/friendships/<pk>/mutual_followers/?size=3
+
+        size: how many of them are returned with the count, 0 for the count only
+        """
+        size = request.query_params.get('size', str(MUTUAL_FOLLOWERS_SIZE))
+        if not size.isdigit() or int(size) > MUTUAL_FOLLOWERS_MAX_SIZE:
+            return Response({
+                'success': False,
+                'message': 'size should be a number between 0 and {}'.format(MUTUAL_FOLLOWERS_MAX_SIZE),
+            }, status=status.HTTP_400_BAD_REQUEST)
+        size = int(size)
+        count, mutual_ids = FriendshipService.get_mutual_followers(
+            request.user.id,
+            int(pk),
+            count_only=size == 0,
+        )
+        users = UserService.get_users_through_cache(mutual_ids[:size])
+        return Response({
+            'count': count,
+            'users': [
+                UserSerializerForFriendship(users[user_id]).data
+                for user_id in mutual_ids[:size]
+                if user_id in users
+            ],
+        }, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='3/s', method='GET', block=True))
+    def suggestions(self, request):
+        """
+        Who to follow for the logged-in user
+        GET /api/friendships/suggestions/
+
+        The suggestions are computed for all the users by a daily batch (friendships.recommendations),
+        here it's only one ZREVRANGE, one SMISMEMBER to drop the users followed since then,
+        and the users from memcached
+        """
+        suggestions = FollowSuggestions.get_suggestions(request.user.id, FOLLOW_SUGGESTIONS_PAGE_SIZE)
+        users = UserService.get_users_through_cache([user_id for user_id, _ in suggestions])
+        return Response({
+            'suggestions': [
+                {
+                    'user': UserSerializerForFriendship(users[user_id]).data,
+                    'mutual_count': mutual_count,
+                }
+                for user_id, mutual_count in suggestions
+                if user_id in users
+                # deleted users
+            ],
+        }, status=status.HTTP_200_OK)
+
+    @action(methods=['get'], detail=False, permission_classes=[IsAuthenticated])
+    @method_decorator(ratelimit(key='user', rate='1/m', method='GET', block=True))
+    def export(self, request):
+        """
+        Full follower/following list as newline delimited JSON, one friendship per line
+        GET /api/friendships/export/?type=followers&to_user_id=1
+        GET /api/friendships/export/?type=followings&from_user_id=1
+
+        A StreamingHttpResponse writes the rows while they are scanned from MySQL/HBase,
+        FRIENDSHIP_EXPORT_BATCH_SIZE rows at a time,
+        so a user with 1M followers never has all of them in the memory of the worker
+        """
+        params = self._get_list_params(request)
+        if isinstance(params, Response):
+            return params
+        list_type, user_id = params
+        return StreamingHttpResponse(
+            self._export_lines(list_type, user_id),
+            content_type='application/x-ndjson',
+        )
+
+    def _export_lines(self, list_type, user_id):
+        if GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            hbase_model_class = HBaseFollower if list_type == 'followers' else HBaseFollowing
+            friendships = hbase_model_class.scan(
+                prefix=(user_id, None),
+                reverse=True,
+                batch_size=FRIENDSHIP_EXPORT_BATCH_SIZE,
+            )
+            # newest first, same as the pages
+            if list_type == 'followers':
+                rows = ((fs.from_user_id, fs.created_at) for fs in friendships)
+            else:
+                rows = ((fs.to_user_id, fs.created_at) for fs in friendships)
+        elif list_type == 'followers':
+            rows = Friendship.objects.filter(to_user_id=user_id)\
+                .order_by('-created_at')\
+                .values_list('from_user_id', 'created_at')\
+                .iterator(chunk_size=FRIENDSHIP_EXPORT_BATCH_SIZE)
+        else:
+            rows = Friendship.objects.filter(from_user_id=user_id)\
+                .order_by('-created_at')\
+                .values_list('to_user_id', 'created_at')\
+                .iterator(chunk_size=FRIENDSHIP_EXPORT_BATCH_SIZE)
+            # iterator(): the rows are not kept in the queryset cache
+        for friend_id, created_at in rows:
+            yield json.dumps(
+                {'user_id': friend_id, 'created_at': created_at},
+                cls=DjangoJSONEncoder,
+            ) + '\n'
+
+    def _get_list_params(self, request):
+        """
+        :return: (type, user id) of the list, or a 400 response
+        """
+        list_type = request.query_params.get('type')
+        if list_type not in ('followers', 'followings'):
+            return Response({
+                'message': 'This is friendship API, please define request type in get parm (followers/followings)',
+                'error': 'invalid type',
+            }, status=status.HTTP_400_BAD_REQUEST)
+        param = 'to_user_id' if list_type == 'followers' else 'from_user_id'
+        if not request.query_params.get(param, '').isdigit():
+            return Response({
+                'message': 'mandatory parameter must exist ({} for this type)'.format(param),
+                'error': 'lack of mandatory parameter',
+            }, status=status.HTTP_400_BAD_REQUEST)
+            # verify mandatory parameter must exist
+        return list_type, int(request.query_params[param])
+
+    def list(self, request):
         """
         list function is for the GET function at the root endpoint of this API viewset
         Here I would like to provided a more restful API endpoint for followings/follower
+        GET /api/friendships/?type=followers&to_user_id=1
+        GET /api/friendships/?type=followings&from_user_id=1
+        GET /api/friendships/?type=followings&from_user_id=1&to_user_id=2
+
+        The lists are paginated by EndlessPagination (created_at__lt/created_at__gt) like the other lists,
+        the whole list of a user could be millions of rows, use GET /api/friendships/export/ for that
         """
-        if request.query_params['type'] == 'followers':
-            if 'to_user_id' not in request.query_params:
-                return Response({
-                    'message': 'mandatory parameter must exist (to_user_id for this type)',
-                    'error': 'lack of mandatory parameter',
-                }, status=400)
-                # verify mandatory parameter must exist
-            friendships = Friendship.objects.filter(to_user_id=request.query_params['to_user_id']).order_by('-created_at')
-            serializer = FollowerSerializer(friendships, many=True)
-            return Response({'followers': serializer.data}, status=status.HTTP_200_OK)
+        params = self._get_list_params(request)
+        if isinstance(params, Response):
+            return params
+        list_type, user_id = params
+
+        if list_type == 'followers':
+            page = self._paginate_followers(request, user_id)
+            serializer = FollowerSerializer(
+                page,
+                many=True,
+                context=self._get_page_context(request, page, FollowerSerializer),
+            )
+            return Response({
+                'followers': serializer.data,
+                'has_next_page': self.paginator.has_next_page,
+            }, status=status.HTTP_200_OK)
             # return followers of an account
-        
-        elif request.query_params['type'] == 'followings':
-            if 'from_user_id' not in request.query_params:
-                return Response({
-                    'message': 'mandatory parameter must exist (from_user_id for this type)',
-                    'error': 'lack of mandatory parameter',
-                }, status=400)
-                # verify mandatory parameter must exist
-            friendships = Friendship.objects.filter(from_user_id=request.query_params['from_user_id']).order_by('-created_at')
-
-            if 'to_user_id' in request.query_params:
-                is_following = friendships.filter(to_user_id=request.query_params['to_user_id']).exists()
-                return Response({'is_following': is_following}, status=status.HTTP_200_OK)
-                # check the following relationship between from_user_id and to_user_id
-            
-            serializer = FollowingSerializer(friendships, many=True)
-            return Response({'followings': serializer.data}, status=status.HTTP_200_OK)
-            # return the followings list of an account
-
-        return Response(Response({
-            'message': 'This is friendship API, please define request type in get parm (followers/followings)'
-        }))
-        # default return with no useful information
+
+        if 'to_user_id' in request.query_params:
+            to_user_id = request.query_params['to_user_id']
+            is_following = to_user_id.isdigit() and int(to_user_id) in \
+                FriendshipService.get_followed_user_ids(user_id, [int(to_user_id)])
+            return Response({'is_following': is_following}, status=status.HTTP_200_OK)
+            # check the following relationship between from_user_id and to_user_id
+
+        page = self._paginate_followings(request, user_id)
+        serializer = FollowingSerializer(
+            page,
+            many=True,
+            context=self._get_page_context(request, page, FollowingSerializer),
+        )
+        return Response({
+            'followings': serializer.data,
+            'has_next_page': self.paginator.has_next_page,
+        }, status=status.HTTP_200_OK)
+        # return the followings list of an account
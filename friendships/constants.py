@@ -0,0 +1,12 @@
+# At most how many users GET /api/friendships/relationships/ can check in one request
+RELATIONSHIPS_USER_IDS_LIMIT = 100
+
+# How many rows are fetched from MySQL/HBase at a time by GET /api/friendships/export/
+FRIENDSHIP_EXPORT_BATCH_SIZE = 1000
+
+# How many users GET /api/friendships/suggestions/ returns
+FOLLOW_SUGGESTIONS_PAGE_SIZE = 20
+
+# How many of the mutual followers GET /api/friendships/<pk>/mutual_followers/ returns by default, and at most
+MUTUAL_FOLLOWERS_SIZE = 3
+MUTUAL_FOLLOWERS_MAX_SIZE = 20
@@ -0,0 +1,229 @@
+import json
+import os
+import time
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from friendships.models import HBaseFollower, Friendship
+from gatekeeper.models import GateKeeper
+from twitter.cache import FOLLOWER_DELTAS_PATTERN
+from utils.redis_client import RedisClient
+
+MANIFEST_NAME = 'followers.json'
+
+
+class FollowerGraphSnapshot:
+    """
+    The whole follower graph in two files, for the fanout workers to read without MySQL/HBase
+
+    Compressed sparse row (CSR):
+    - ids: the follower ids of all the users, int32, user 1's followers, then user 2's, ...
+      each user's followers are sorted
+    - offsets: int64, the followers of user u are ids[offsets[u]:offsets[u + 1]]
+    e.g. user 1 is followed by 3 and 5, user 3 is followed by 1:
+        offsets = [0, 0, 2, 2, 3]
+        ids = [3, 5, 1]
+    100M follows only take 400MB for the ids, 8 bytes for each user in the offsets
+
+    Both files are .npy, np.load(mmap_mode='r') maps them into the memory of the process:
+    - nothing is read until it is used, a fanout only touches the pages of one user
+    - the page cache is shared by all the workers on the machine
+    - ids[start:stop] is a view of the mapped file, no copy
+
+    The snapshot is only as new as its build (build_follower_snapshot_task, every hour),
+    the follows/unfollows after that are in the delta log, see record_delta
+    If the snapshot is missing or too old for the delta log, get_follower_ids returns None,
+    the caller reads the storage as before
+    """
+    snapshot = None
+    # (manifest, offsets, ids) of the loaded snapshot, shared by the whole process
+    checked_at = 0
+    # when the manifest was checked last time, a new snapshot is picked up within FOLLOWER_SNAPSHOT_CHECK_INTERVAL
+
+    @classmethod
+    def get_delta_key(cls, to_user_id):
+        return FOLLOWER_DELTAS_PATTERN.format(user_id=to_user_id)
+
+    @classmethod
+    def record_delta(cls, from_user_id, to_user_id, followed):
+        """
+        Called after each follow/unfollow, the delta log of to_user_id is a sorted set:
+        - member: from_user_id, so only the last follow/unfollow of the same user is kept
+        - score: time in ms, positive for a follow, negative for an unfollow
+        The deltas older than FOLLOWER_SNAPSHOT_DELTA_TTL are removed by the same pipeline,
+        both the old follows and unfollows are in (-cutoff, cutoff), so the log stays small
+        """
+        if settings.FOLLOWER_SNAPSHOT_DIR is None:
+            return
+        now = int(time.time() * 1000)
+        cutoff = now - settings.FOLLOWER_SNAPSHOT_DELTA_TTL * 1000
+        key = cls.get_delta_key(to_user_id)
+        pipeline = RedisClient.pipeline(transaction=False)
+        pipeline.zadd(key, {from_user_id: now if followed else -now})
+        pipeline.zremrangebyscore(key, '({}'.format(-cutoff), '({}'.format(cutoff))
+        pipeline.expire(key, settings.FOLLOWER_SNAPSHOT_DELTA_TTL)
+        pipeline.execute()
+
+    @classmethod
+    def get_deltas(cls, to_user_id, since):
+        """
+        :param since: time in ms, the deltas before it are already in the snapshot
+        :return: (followed ids, unfollowed ids) since then
+        """
+        key = cls.get_delta_key(to_user_id)
+        members = RedisClient.get_connection(key).zrange(key, 0, -1, withscores=True)
+        followed, unfollowed = [], []
+        for member, score in members:
+            if score >= since:
+                followed.append(int(member))
+            elif score <= -since:
+                unfollowed.append(int(member))
+        return followed, unfollowed
+
+    @classmethod
+    def get_follower_ids(cls, to_user_id):
+        """
+        :return: sorted follower ids as an int32 array, None if there is no usable snapshot
+        """
+        snapshot = cls.load()
+        if snapshot is None:
+            return None
+        manifest, offsets, ids = snapshot
+        if to_user_id + 1 < len(offsets):
+            follower_ids = ids[offsets[to_user_id]:offsets[to_user_id + 1]]
+        else:
+            # signed up after the snapshot
+            follower_ids = ids[:0]
+
+        # Clocks of the web servers and the snapshot builder are not the same,
+        # replaying a delta already in the snapshot changes nothing, so go back a bit more
+        since = manifest['started_at'] - settings.FOLLOWER_SNAPSHOT_CLOCK_SKEW * 1000
+        followed, unfollowed = cls.get_deltas(to_user_id, since)
+        if not followed and not unfollowed:
+            return follower_ids
+        follower_ids = follower_ids[~np.isin(follower_ids, unfollowed)]
+        return np.union1d(follower_ids, np.array(followed, dtype=np.int32))
+
+    @classmethod
+    def load(cls):
+        """
+        :return: (manifest, offsets, ids), None if there is no snapshot or it is too old
+        """
+        directory = settings.FOLLOWER_SNAPSHOT_DIR
+        if directory is None:
+            return None
+        now = time.time()
+        if cls.snapshot is None or now - cls.checked_at >= settings.FOLLOWER_SNAPSHOT_CHECK_INTERVAL:
+            cls.checked_at = now
+            cls.snapshot = cls._load_latest(directory)
+        if cls.snapshot is None:
+            return None
+
+        # The deltas before (now - FOLLOWER_SNAPSHOT_DELTA_TTL) are gone,
+        # a snapshot older than that can't be patched up, e.g. the builder has been down for hours
+        age = now - cls.snapshot[0]['started_at'] / 1000
+        if age > settings.FOLLOWER_SNAPSHOT_DELTA_TTL - settings.FOLLOWER_SNAPSHOT_CLOCK_SKEW:
+            return None
+        return cls.snapshot
+
+    @classmethod
+    def _load_latest(cls, directory):
+        try:
+            with open(os.path.join(directory, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        if cls.snapshot is not None and cls.snapshot[0]['version'] == manifest['version']:
+            return cls.snapshot
+        offsets = np.load(os.path.join(directory, manifest['offsets']), mmap_mode='r')
+        ids = np.load(os.path.join(directory, manifest['ids']), mmap_mode='r')
+        return manifest, offsets, ids
+
+    @classmethod
+    def build(cls, batch_size=10000):
+        """
+        Export the follower graph from the storage (MySQL or HBase, by the gatekeeper) into a new snapshot
+
+        1. read all the follows as (to_user_id, from_user_id) pairs, batch_size rows at a time
+        2. sort them by (to_user_id, from_user_id), offsets = cumulative sum of the follower counts
+        3. write the new files, then replace the manifest (atomic rename), the readers switch to it
+           on their next check; the snapshots before the last one are removed
+        The pairs are held in the memory as int32 arrays while sorting, about 16 bytes for each follow
+        :return: the manifest of the new snapshot
+        """
+        directory = settings.FOLLOWER_SNAPSHOT_DIR
+        os.makedirs(directory, exist_ok=True)
+        started_at = int(time.time() * 1000)
+        # taken BEFORE reading, the follows/unfollows from now on are replayed from the delta log
+        to_user_ids, from_user_ids = cls.load_edges(batch_size)
+
+        order = np.lexsort((from_user_ids, to_user_ids))
+        # lexsort: the last key is the primary one
+        ids = from_user_ids[order]
+        counts = np.bincount(to_user_ids, minlength=1)
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+
+        version = str(started_at)
+        manifest = {
+            'version': version,
+            'started_at': started_at,
+            'offsets': 'followers-{}.offsets.npy'.format(version),
+            'ids': 'followers-{}.ids.npy'.format(version),
+            'users': len(counts),
+            'follows': len(ids),
+        }
+        np.save(os.path.join(directory, manifest['offsets']), offsets)
+        np.save(os.path.join(directory, manifest['ids']), ids)
+        manifest_path = os.path.join(directory, MANIFEST_NAME)
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, manifest_path)
+
+        cls._remove_old_snapshots(directory, manifest)
+        return manifest
+
+    @classmethod
+    def load_edges(cls, batch_size):
+        """
+        :return: (to_user_ids, from_user_ids), two int32 arrays
+        """
+        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            rows = Friendship.objects.order_by().values_list('to_user_id', 'from_user_id')\
+                .iterator(chunk_size=batch_size)
+        else:
+            rows = (
+                (follower.to_user_id, follower.from_user_id)
+                for follower in HBaseFollower.scan(batch_size=batch_size)
+            )
+        chunks = []
+        while True:
+            chunk = np.fromiter(
+                (user_id for row in islice(rows, batch_size) for user_id in row),
+                dtype=np.int32,
+            )
+            if not len(chunk):
+                break
+            chunks.append(chunk)
+        edges = np.concatenate(chunks) if chunks else np.zeros(0, dtype=np.int32)
+        # flattened pairs: to, from, to, from, ...
+        return edges[0::2], edges[1::2]
+
+    @classmethod
+    def _remove_old_snapshots(cls, directory, manifest):
+        """
+        Keep the new snapshot and the one before it, which could still be used by the readers
+        A file mapped by a reader is still there for it after the removal
+        """
+        versions = set()
+        for name in os.listdir(directory):
+            if name.startswith('followers-') and name.endswith('.npy'):
+                versions.add(name.split('-')[1].split('.')[0])
+        for version in sorted(versions, key=int)[:-2]:
+            for suffix in ('offsets', 'ids'):
+                path = os.path.join(directory, 'followers-{}.{}.npy'.format(version, suffix))
+                if os.path.exists(path):
+                    os.remove(path)
+
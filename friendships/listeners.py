@@ -1,6 +1,9 @@
-def invalidate_following_cache(sender, instance, **kwargs):
+from utils.listeners import run_now_and_on_commit
+
+
+def add_following_to_cache(sender, instance, **kwargs):
     """
-    Invalidate cache function while triggered by a signal
+    Update the following set of from_user and the follower set of to_user while triggered by a signal
 
     Args:
         sender: The sender of the signal, same as the sender in the connect function
@@ -11,7 +14,30 @@ def invalidate_following_cache(sender, instance, **kwargs):
     # Why import here? 
     # If it is outside of this function, there will be an error of circular import
     # Cuz FriendshipService will import friendships.models, and 
-    # friendships.models will import this invalidate_following_cache
+    # friendships.models will import this listener
     # That's why we normally put this import into the function.
     # Force it import only when the function is executed
-    FriendshipService.invalidate_following_cache(instance.from_user_id)
\ No newline at end of file
+    run_now_and_on_commit(
+        FriendshipService.add_to_following_cache,
+        instance.from_user_id,
+        instance.to_user_id,
+    )
+    run_now_and_on_commit(
+        FriendshipService.add_to_follower_cache,
+        instance.from_user_id,
+        instance.to_user_id,
+    )
+
+
+def remove_following_from_cache(sender, instance, **kwargs):
+    from friendships.services import FriendshipService
+    run_now_and_on_commit(
+        FriendshipService.remove_from_following_cache,
+        instance.from_user_id,
+        instance.to_user_id,
+    )
+    run_now_and_on_commit(
+        FriendshipService.remove_from_follower_cache,
+        instance.from_user_id,
+        instance.to_user_id,
+    )
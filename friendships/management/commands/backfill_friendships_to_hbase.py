@@ -0,0 +1,324 @@
+"""
+Copy the Friendship rows in MySQL into the HBase tables, and check they match
+
+Before turning on switch_friendship_to_hbase, the HBase tables must have all the friendships and counts:
+    python manage.py backfill_friendships_to_hbase --workers 8
+    python manage.py backfill_friendships_to_hbase --counts --workers 8
+    python manage.py backfill_friendships_to_hbase --verify
+
+The rows are copied in id ranges (chunks), each chunk is done by a process of the pool,
+with one HBase batch for each table. A finished chunk is written into the checkpoint file,
+so an interrupted backfill can be run again and goes on from where it stopped.
+Writing the same row again only overwrites it, so redoing a chunk is harmless.
+
+Only the rows in MySQL are copied, unfollows after a chunk is done are not removed from HBase,
+that's what --verify is for: run it right before turning on the switch.
+
+--counts sets the follower/following counters in HBaseFriendshipCount from the rows copied into HBase,
+the user ids are split into chunks the same way. After the switch is on, follow/unfollow change
+the counters, so it only has to be run once, with the switch still off.
+
+The follows made in HBase before HBaseFriendship was added are only in HBaseFollowing/HBaseFollower,
+copy them into HBaseFriendship by scanning HBaseFollowing (in this process, chunk size rows at a time):
+    python manage.py backfill_friendships_to_hbase --from-hbase-followings
+"""
+import json
+import os
+import random
+from itertools import islice
+from multiprocessing import Pool
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Count, Max, Min
+from django_hbase.client import HBaseClient
+from friendships.models import (
+    Friendship,
+    HBaseFollower,
+    HBaseFollowing,
+    HBaseFriendship,
+    HBaseFriendshipCount,
+)
+from utils.time_helper import datetime_to_timestamp
+
+DEFAULT_CHUNK_SIZE = 10000
+DEFAULT_SAMPLE_SIZE = 1000
+
+
+def backfill_chunk(start_id, stop_id):
+    """
+    Copy the friendships with start_id <= id < stop_id
+    :return: (start_id, number of rows copied)
+    """
+    rows = list(
+        Friendship.objects.filter(id__gte=start_id, id__lt=stop_id)
+        .exclude(from_user_id=None)
+        .exclude(to_user_id=None)
+        .values_list('from_user_id', 'to_user_id', 'created_at')
+    )
+    # from_user/to_user are SET_NULL, the rows of deleted users are skipped
+    if rows:
+        batch_data = [
+            {
+                'from_user_id': from_user_id,
+                'to_user_id': to_user_id,
+                'created_at': datetime_to_timestamp(created_at),
+                # HBase row keys use microseconds, same as FriendshipService.follow
+            }
+            for from_user_id, to_user_id, created_at in rows
+        ]
+        # Same order as FriendshipService.follow: the relationship goes first
+        HBaseFriendship.batch_create(batch_data)
+        HBaseFollower.batch_create(batch_data)
+        HBaseFollowing.batch_create(batch_data)
+    return start_id, len(rows)
+
+
+def count_hbase_rows(hbase_model_class, user_id):
+    return sum(1 for _ in hbase_model_class.scan(prefix=(user_id, None)))
+
+
+def get_user_ids(start_id, stop_id):
+    return list(
+        User.objects.filter(id__gte=start_id, id__lt=stop_id).values_list('id', flat=True)
+    )
+
+
+def count_users_chunk(start_id, stop_id):
+    """
+    Set the counters of the users with start_id <= id < stop_id, by scanning their rows in HBase
+    :return: (start_id, number of users counted)
+    """
+    user_ids = get_user_ids(start_id, stop_id)
+    for user_id in user_ids:
+        HBaseFriendshipCount.set_count(user_id, 'followers', count_hbase_rows(HBaseFollower, user_id))
+        HBaseFriendshipCount.set_count(user_id, 'followings', count_hbase_rows(HBaseFollowing, user_id))
+    return start_id, len(user_ids)
+
+
+def verify_counts_chunk(start_id, stop_id):
+    """
+    Compare the follower/following counts of the users with start_id <= id < stop_id,
+    both the rows in HBase and the counters must match MySQL
+    :return: list of (user id, name, MySQL count, HBase rows, HBase counter) that don't match
+    """
+    user_ids = get_user_ids(start_id, stop_id)
+    mismatches = []
+    for name, field, hbase_model_class in (
+        ('followers', 'to_user_id', HBaseFollower),
+        ('followings', 'from_user_id', HBaseFollowing),
+    ):
+        mysql_counts = dict(
+            Friendship.objects.filter(**{field + '__in': user_ids})
+            .order_by()
+            .values_list(field)
+            .annotate(count=Count('id'))
+        )
+        counters = HBaseFriendshipCount.get_counts(name, user_ids)
+        for user_id in user_ids:
+            mysql_count = mysql_counts.get(user_id, 0)
+            hbase_count = count_hbase_rows(hbase_model_class, user_id)
+            if not mysql_count == hbase_count == counters[user_id]:
+                mismatches.append((user_id, name, mysql_count, hbase_count, counters[user_id]))
+    return mismatches
+
+
+class Command(BaseCommand):
+    help = 'Backfill the friendships from MySQL to HBase in parallel, or verify they match'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='size of the process pool, 1 runs everything in this process',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default='friendships_backfill.checkpoint',
+            help='file of the finished chunks, to resume an interrupted backfill',
+        )
+        parser.add_argument('--restart', action='store_true', help='ignore the checkpoint file')
+        parser.add_argument('--verify', action='store_true', help='compare MySQL and HBase, copy nothing')
+        parser.add_argument('--sample', type=int, default=DEFAULT_SAMPLE_SIZE)
+        parser.add_argument(
+            '--counts',
+            action='store_true',
+            help='set the follower/following counters in HBase from the rows copied, copy nothing',
+        )
+        parser.add_argument(
+            '--from-hbase-followings',
+            action='store_true',
+            help='fill HBaseFriendship from HBaseFollowing, for the follows made in HBase before it was added',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] <= 0 or options['workers'] <= 0:
+            raise CommandError('--chunk-size and --workers should be positive')
+        if options['verify']:
+            return self.verify(options)
+        if options['from_hbase_followings']:
+            return self.backfill_from_hbase_followings(options)
+        if options['counts']:
+            return self.backfill_counts(options)
+        return self.backfill(options)
+
+    def run_chunks(self, func, chunks, workers):
+        """
+        Yield the results of func(start_id, stop_id) for each chunk, in the order of the chunks
+        """
+        if workers == 1:
+            for start_id, stop_id in chunks:
+                yield func(start_id, stop_id)
+            return
+        # The processes are forked from this one, two processes on one socket would mess it up
+        # Close the MySQL and HBase connections BEFORE forking, each process opens its own when needed
+        connections.close_all()
+        HBaseClient.reset()
+        with Pool(workers) as pool:
+            results = [pool.apply_async(func, chunk) for chunk in chunks]
+            for result in results:
+                yield result.get()
+
+    def get_chunks(self, model_class, chunk_size, done=()):
+        id_range = model_class.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if id_range['min_id'] is None:
+            return []
+        first = id_range['min_id'] - id_range['min_id'] % chunk_size
+        return [
+            (start_id, start_id + chunk_size)
+            for start_id in range(first, id_range['max_id'] + 1, chunk_size)
+            if start_id not in done
+        ]
+
+    def load_checkpoint(self, path, chunk_size):
+        if not os.path.exists(path):
+            return set()
+        with open(path) as f:
+            checkpoint = json.load(f)
+        if checkpoint['chunk_size'] != chunk_size:
+            raise CommandError(
+                'The checkpoint was written with --chunk-size {}, use the same one or --restart'.format(
+                    checkpoint['chunk_size'],
+                )
+            )
+        return set(checkpoint['done'])
+
+    def save_checkpoint(self, path, chunk_size, done):
+        # Write a new file then rename, a crash in the middle never leaves a broken checkpoint
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'chunk_size': chunk_size, 'done': sorted(done)}, f)
+        os.replace(tmp_path, path)
+
+    def backfill(self, options):
+        chunk_size, path = options['chunk_size'], options['checkpoint']
+        done = set() if options['restart'] else self.load_checkpoint(path, chunk_size)
+        chunks = self.get_chunks(Friendship, chunk_size, done)
+        self.stdout.write('{} chunks to backfill, {} done before'.format(len(chunks), len(done)))
+
+        copied = 0
+        for start_id, count in self.run_chunks(backfill_chunk, chunks, options['workers']):
+            done.add(start_id)
+            copied += count
+            self.save_checkpoint(path, chunk_size, done)
+        self.stdout.write(self.style.SUCCESS('{} friendships copied to HBase'.format(copied)))
+
+    def backfill_from_hbase_followings(self, options):
+        """
+        Writing a relationship row again only overwrites it with the same created_at,
+        so there is no checkpoint, an interrupted run is simply run again
+        """
+        chunk_size = options['chunk_size']
+        followings = HBaseFollowing.scan(batch_size=chunk_size)
+        copied = 0
+        while True:
+            chunk = list(islice(followings, chunk_size))
+            if not chunk:
+                break
+            HBaseFriendship.batch_create([
+                {
+                    'from_user_id': following.from_user_id,
+                    'to_user_id': following.to_user_id,
+                    'created_at': following.created_at,
+                }
+                for following in chunk
+            ])
+            copied += len(chunk)
+        self.stdout.write(self.style.SUCCESS('{} relationships written to HBaseFriendship'.format(copied)))
+
+    def backfill_counts(self, options):
+        """
+        set_count overwrites the counters, so there is no checkpoint, an interrupted run is simply run again
+        """
+        chunks = self.get_chunks(User, options['chunk_size'])
+        counted = 0
+        for _, count in self.run_chunks(count_users_chunk, chunks, options['workers']):
+            counted += count
+        self.stdout.write(self.style.SUCCESS('counts of {} users written to HBase'.format(counted)))
+
+    def verify(self, options):
+        chunks = self.get_chunks(User, options['chunk_size'])
+        mismatches = []
+        for chunk_mismatches in self.run_chunks(verify_counts_chunk, chunks, options['workers']):
+            mismatches.extend(chunk_mismatches)
+        for user_id, name, mysql_count, hbase_count, counter in mismatches[:20]:
+            self.stderr.write('user {} {}: MySQL {}, HBase {}, HBase counter {}'.format(
+                user_id,
+                name,
+                mysql_count,
+                hbase_count,
+                counter,
+            ))
+
+        wrong_rows = self.verify_sampled_rows(options['sample'])
+        for friendship in wrong_rows[:20]:
+            self.stderr.write('friendship {} is missing or different in HBase'.format(friendship.id))
+
+        if mismatches or wrong_rows:
+            raise CommandError('{} counts and {} sampled rows don\'t match'.format(
+                len(mismatches),
+                len(wrong_rows),
+            ))
+        self.stdout.write(self.style.SUCCESS('MySQL and HBase match'))
+
+    def verify_sampled_rows(self, sample_size):
+        """
+        Pick random friendships, check they are in all the three HBase tables with the same created_at
+        Random ids rather than ORDER BY RAND(), which sorts the whole table
+        :return: the friendships not matched
+        """
+        id_range = Friendship.objects.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if id_range['min_id'] is None or sample_size <= 0:
+            return []
+        sample_ids = {
+            random.randint(id_range['min_id'], id_range['max_id'])
+            for _ in range(sample_size)
+        }
+        friendships = list(
+            Friendship.objects.filter(id__in=sample_ids)
+            .exclude(from_user_id=None)
+            .exclude(to_user_id=None)
+        )
+        relationships = HBaseFriendship.batch_get([
+            {'from_user_id': fs.from_user_id, 'to_user_id': fs.to_user_id}
+            for fs in friendships
+        ])
+        followings = HBaseFollowing.batch_get([
+            {'from_user_id': fs.from_user_id, 'created_at': datetime_to_timestamp(fs.created_at)}
+            for fs in friendships
+        ])
+        followers = HBaseFollower.batch_get([
+            {'to_user_id': fs.to_user_id, 'created_at': datetime_to_timestamp(fs.created_at)}
+            for fs in friendships
+        ])
+        wrong_rows = []
+        for fs, relationship, following, follower in zip(friendships, relationships, followings, followers):
+            created_at = datetime_to_timestamp(fs.created_at)
+            if relationship is None or relationship.created_at != created_at \
+                    or following is None or following.to_user_id != fs.to_user_id \
+                    or follower is None or follower.from_user_id != fs.from_user_id:
+                wrong_rows.append(fs)
+        return wrong_rows
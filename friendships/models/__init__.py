@@ -1,2 +1,2 @@
 from .friendship import Friendship
-from .hbase_friendship import HBaseFollower, HBaseFollowing
\ No newline at end of file
+from .hbase_friendship import HBaseFollower, HBaseFollowing, HBaseFriendship, HBaseFriendshipCount
\ No newline at end of file
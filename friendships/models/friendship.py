@@ -3,7 +3,7 @@ from django.db import models
 from django.db.models.signals import post_save, pre_delete
 
 from utils.memcached_helper import MemcachedHelper
-from friendships.listeners import invalidate_following_cache
+from friendships.listeners import add_following_to_cache, remove_following_from_cache
 
 
 # Create your models here.
@@ -54,7 +54,7 @@ class Friendship(models.Model):
         return MemcachedHelper.get_object_through_cache(User, self.to_user_id)
     
     
-# Hook up with listeners to invalidate cache
-pre_delete.connect(invalidate_following_cache, sender=Friendship)
-post_save.connect(invalidate_following_cache, sender=Friendship)
+# Hook up with listeners to keep the following/follower sets in Redis up to date
+pre_delete.connect(remove_following_from_cache, sender=Friendship)
+post_save.connect(add_following_to_cache, sender=Friendship)
 # event.connect(<function name you would like to proceed>, sender=<who triggered this event>)
@@ -1,3 +1,5 @@
+import struct
+
 from django_hbase import models
 
 
@@ -42,7 +44,78 @@ class HBaseFollower(models.HBaseModel):
         row_key = ('to_user_id', 'created_at')
 
 
+class HBaseFriendship(models.HBaseModel):
+    """
+    Store whether from_user_id follows to_user_id, row_key is from_user_id + to_user_id
+
+    which means it can support
+     - has from_user_id followed to_user_id, with ONE point read
+     - created_at of the relationship, which is the row key of the other two tables for unfollow
+    Without it, both need a scan of all the followings of from_user_id
+    """
+    # row keys
+    from_user_id = models.IntegerField(reverse=True)
+    to_user_id = models.IntegerField()
+    # column keys
+    created_at = models.TimestampField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_friendships'
+        row_key = ('from_user_id', 'to_user_id')
+
+
+class HBaseFriendshipCount(models.HBaseModel):
+    """
+    Follower and following counts of a user, row_key is user_id
+
+    The columns are HBase counters (happybase counter_inc): the region server increments them atomically,
+    follow/unfollow never read-modify-write them, and a count is ONE point read
+    rather than scanning all the rows of the user in HBaseFollower/HBaseFollowing
+    A counter is an 8-byte big-endian long rather than a string like the other fields,
+    so the counts are read by get_counts, not get()
+    """
+    # row keys
+    user_id = models.IntegerField(reverse=True)
+    # column keys
+    followers = models.IntegerField(column_family='cf')
+    followings = models.IntegerField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_friendship_counts'
+        row_key = ('user_id',)
+
+    @classmethod
+    def get_column(cls, name):
+        # name: 'followers' or 'followings'
+        return 'cf:{}'.format(name).encode('utf-8')
+
+    @classmethod
+    def increase(cls, user_id, name, amount):
+        row_key = cls.serialize_row_key({'user_id': user_id})
+        return cls.get_table().counter_inc(row_key, cls.get_column(name), amount)
+
+    @classmethod
+    def set_count(cls, user_id, name, count):
+        row_key = cls.serialize_row_key({'user_id': user_id})
+        cls.get_table().counter_set(row_key, cls.get_column(name), count)
+
+    @classmethod
+    def get_counts(cls, name, user_ids):
+        """
+        ONE round-trip for all the users
+        :return: dict, user id -> count, 0 for the users without a row
+        """
+        row_keys = {cls.serialize_row_key({'user_id': user_id}): user_id for user_id in user_ids}
+        column = cls.get_column(name)
+        counts = {user_id: 0 for user_id in user_ids}
+        for row_key, row_data in cls.get_table().rows(list(row_keys), columns=[column]):
+            if column in row_data:
+                counts[row_keys[row_key]] = struct.unpack('>q', row_data[column])[0]
+        return counts
+
+
 # Comparing the normal model with this one, you will find:
 # In HBase, although two pieces of data are same
 # But to support two sorting requirement, we need to use two tables to store the data
-# Actually, this is similar as indices of relational database, which also requires 2 index tables for data sorting.
\ No newline at end of file
+# Actually, this is similar as indices of relational database, which also requires 2 index tables for data sorting.
+# HBaseFriendship is the third one, like the unique index (from_user, to_user) of the Friendship table
\ No newline at end of file
@@ -0,0 +1,102 @@
+import numpy as np
+from django.conf import settings
+from friendships.graph_snapshot import FollowerGraphSnapshot
+from friendships.services import FriendshipService
+from scipy import sparse
+from twitter.cache import FOLLOW_SUGGESTIONS_PATTERN
+from utils.redis_client import RedisClient
+
+
+class FollowSuggestions:
+    """
+    "Who to follow": the friends of friends, scored by how many of your followings follow them
+
+    The follow graph as a sparse matrix A, A[u, v] = 1 if u follows v (CSR, one row for each user)
+    Then (A @ A)[u, w] = number of the users u follows who also follow w, all the scores in ONE product
+    - drop the users u already follows and u itself
+    - keep the top FOLLOW_SUGGESTIONS_LIMIT of each row
+
+    The rows are multiplied FOLLOW_SUGGESTIONS_BLOCK_SIZE users at a time (A[block] @ A),
+    the full product could be much bigger than A itself.
+    Run by build_follow_suggestions_task every day, the results are saved in Redis,
+    a sorted set for each user: member user id, score the number of mutual followings.
+    GET /api/friendships/suggestions/ only reads the sorted set, no graph traversal for a request
+    """
+
+    @classmethod
+    def get_key(cls, user_id):
+        return FOLLOW_SUGGESTIONS_PATTERN.format(user_id=user_id)
+
+    @classmethod
+    def build(cls, batch_size=10000):
+        """
+        :return: number of users with suggestions
+        """
+        to_user_ids, from_user_ids = FollowerGraphSnapshot.load_edges(batch_size)
+        size = int(max(to_user_ids.max(initial=0), from_user_ids.max(initial=0))) + 1
+        graph = sparse.csr_matrix(
+            (np.ones(len(to_user_ids), dtype=np.int32), (from_user_ids, to_user_ids)),
+            shape=(size, size),
+        )
+
+        saved = 0
+        block_size = settings.FOLLOW_SUGGESTIONS_BLOCK_SIZE
+        for start in range(0, size, block_size):
+            stop = min(start + block_size, size)
+            rows = graph[start:stop]
+            scores = cls._score_block(graph, rows, start)
+            saved += cls._save_block(scores, start)
+        return saved
+
+    @classmethod
+    def _score_block(cls, graph, rows, start):
+        """
+        :return: scores of the users start...start + len(rows), a CSR matrix
+        """
+        scores = rows @ graph
+        # the followings (rows) and the users themselves (the diagonal) are not candidates
+        known = rows + sparse.eye(rows.shape[0], graph.shape[1], k=start, dtype=np.int32, format='csr')
+        scores = scores - scores.multiply(known)
+        scores.eliminate_zeros()
+        return scores.tocsr()
+
+    @classmethod
+    def _save_block(cls, scores, start):
+        limit = settings.FOLLOW_SUGGESTIONS_LIMIT
+        pipeline = RedisClient.pipeline(transaction=False)
+        saved = 0
+        for i in range(scores.shape[0]):
+            key = cls.get_key(start + i)
+            # the old suggestions are replaced, or removed if there is none now
+            pipeline.delete(key)
+            begin, end = scores.indptr[i], scores.indptr[i + 1]
+            if begin == end:
+                continue
+            user_ids, counts = scores.indices[begin:end], scores.data[begin:end]
+            if len(counts) > limit:
+                top = np.argpartition(-counts, limit)[:limit]
+                user_ids, counts = user_ids[top], counts[top]
+            pipeline.zadd(key, dict(zip(user_ids.tolist(), counts.tolist())))
+            pipeline.expire(key, settings.FOLLOW_SUGGESTIONS_EXPIRE_TIME)
+            saved += 1
+        pipeline.execute()
+        return saved
+
+    @classmethod
+    def get_suggestions(cls, user_id, limit):
+        """
+        :return: [(user id, number of mutual followings)], the highest first
+        The users followed after the last build are filtered out by the following set, one SMISMEMBER
+        """
+        key = cls.get_key(user_id)
+        suggestions = RedisClient.get_connection(key).zrevrange(key, 0, -1, withscores=True)
+        suggestions = [(int(member), int(score)) for member, score in suggestions]
+        followed_user_ids = FriendshipService.get_followed_user_ids(
+            user_id,
+            [suggested_id for suggested_id, _ in suggestions],
+        )
+        return [
+            (suggested_id, count)
+            for suggested_id, count in suggestions
+            if suggested_id not in followed_user_ids
+        ][:limit]
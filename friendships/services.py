@@ -1,13 +1,37 @@
 import time
+from itertools import islice
 
 from django.conf import settings
-from django.core.cache import caches
-from friendships.models import HBaseFollower, HBaseFollowing, Friendship
+from django.contrib.auth.models import User
+from django.db.models import Count
+from friendships.graph_snapshot import FollowerGraphSnapshot
+from friendships.models import (
+    Friendship,
+    HBaseFollower,
+    HBaseFollowing,
+    HBaseFriendship,
+    HBaseFriendshipCount,
+)
 from gatekeeper.models import GateKeeper
-from twitter.cache import FOLLOWING_PATTERN
+from twitter.cache import (
+    FOLLOWER_SET_PATTERN,
+    FOLLOWER_VERSION_PATTERN,
+    FOLLOWING_SET_PATTERN,
+    FOLLOWING_VERSION_PATTERN,
+    FRIENDSHIP_COUNT_PATTERN,
+    FRIENDSHIP_COUNTS_VERSION_PATTERN,
+)
+from utils.redis_client import RedisClient
+from utils.redis_scripts import RedisScripts
+from utils.shadow_reads import ShadowReads
 
-cache = caches['testing'] if settings.TESTING else caches['default']
-# to define testing and prod cache setting
+FOLLOWING_SENTINEL = 0
+# Redis deletes a set once it is empty, so a loaded following/follower set always has this member
+# user ids start from 1, it can't be a real following
+
+# names of the counts, see FriendshipService.get_count_keys
+FOLLOWERS = 'followers'
+FOLLOWINGS = 'followings'
 
 
 class FriendshipService(object):
@@ -49,41 +73,322 @@ class FriendshipService(object):
     
     @classmethod
     def get_follower_ids(cls, to_user_id):
-        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(to_user_id=to_user_id)
-        else:
-            friendships = HBaseFollower.filter(prefix=(to_user_id, None))
-        return [friendship.from_user_id for friendship in friendships]
+        # Read from both stores for the users in the shadow reads gatekeeper, see utils.shadow_reads
+        return ShadowReads.read(
+            'friendships.follower_ids',
+            'switch_friendship_to_hbase',
+            to_user_id,
+            mysql_read=lambda: [
+                friendship.from_user_id
+                for friendship in Friendship.objects.filter(to_user_id=to_user_id)
+            ],
+            hbase_read=lambda: [
+                friendship.from_user_id
+                for friendship in HBaseFollower.filter(prefix=(to_user_id, None))
+            ],
+            normalize=sorted,
+        )
     
     @classmethod
     def get_following_user_id_set(cls, from_user_id):
         """
         Get the following user id set based on the from_user_id
         """
-        # TO DO: Cache in Redis
+        set_key, _ = cls.get_following_cache_keys(from_user_id)
+        connection = RedisClient.get_connection(set_key)
+        members = connection.smembers(set_key)
+        if not members:
+            if not cls._build_following_cache(from_user_id):
+                return cls._load_following_user_id_set(from_user_id)
+            members = connection.smembers(set_key)
+        return {int(member) for member in members} - {FOLLOWING_SENTINEL}
+
+    @classmethod
+    def get_followed_user_ids(cls, from_user_id, user_ids):
+        """
+        Which of the users from_user_id has followed
+
+        SMISMEMBER answers all the users of a page in one round-trip (SISMEMBER pipeline before Redis 6.2),
+        the sentinel goes first to tell whether the set is in the cache at all,
+        so a page doesn't load the whole following list of the viewer any more
+        :return: set of the followed user ids
+        """
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return set()
+        set_key, _ = cls.get_following_cache_keys(from_user_id)
+        results = RedisClient.smismember(set_key, [FOLLOWING_SENTINEL, *user_ids])
+        if not results[0]:
+            # Cache miss: build it lazily, then ask again
+            if cls._build_following_cache(from_user_id):
+                results = RedisClient.smismember(set_key, [FOLLOWING_SENTINEL, *user_ids])
+            if not results[0]:
+                # Someone followed/unfollowed while the set was being built, ask DB this time
+                return cls._get_followed_user_ids_from_db(from_user_id, user_ids)
+        return {
+            user_id
+            for user_id, result in zip(user_ids, results[1:])
+            if result
+        }
+
+    @classmethod
+    def get_follower_user_ids(cls, to_user_id, user_ids):
+        """
+        Which of the users have followed to_user_id, the reverse of get_followed_user_ids
+
+        Followers could be millions, they are only in Redis for the users with a few of them
+        (see get_mutual_followers), so it is ONE query in the source table:
+        - MySQL: WHERE to_user_id = <id> AND from_user_id IN (...), the unique index (from_user, to_user)
+        - HBase: point reads of HBaseFriendship (user_id, to_user_id), in one batch
+        :return: set of the follower ids
+        """
+        user_ids = list(set(user_ids))
+        if not user_ids:
+            return set()
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(from_user_id=from_user_id)
-        else:
-            friendships = HBaseFollowing.filter(prefix=(from_user_id, None))
-        user_id_set = set([
-            fs.to_user_id 
-            for fs in friendships
-        ]) 
-        return user_id_set
-    
+            return set(Friendship.objects.filter(
+                from_user_id__in=user_ids,
+                to_user_id=to_user_id,
+            ).values_list('from_user_id', flat=True))
+        friendships = HBaseFriendship.batch_get([
+            {'from_user_id': user_id, 'to_user_id': to_user_id}
+            for user_id in user_ids
+        ])
+        return {fs.from_user_id for fs in friendships if fs is not None}
+
+    @classmethod
+    def _get_followed_user_ids_from_db(cls, from_user_id, user_ids):
+        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            return set(Friendship.objects.filter(
+                from_user_id=from_user_id,
+                to_user_id__in=user_ids,
+            ).values_list('to_user_id', flat=True))
+        friendships = HBaseFriendship.batch_get([
+            {'from_user_id': from_user_id, 'to_user_id': user_id}
+            for user_id in user_ids
+        ])
+        return {fs.to_user_id for fs in friendships if fs is not None}
+
+    @classmethod
+    def _load_following_user_id_set(cls, from_user_id):
+        return ShadowReads.read(
+            'friendships.following_user_ids',
+            'switch_friendship_to_hbase',
+            from_user_id,
+            mysql_read=lambda: set([
+                fs.to_user_id 
+                for fs in Friendship.objects.filter(from_user_id=from_user_id)
+            ]),
+            hbase_read=lambda: set([
+                fs.to_user_id 
+                for fs in HBaseFollowing.filter(prefix=(from_user_id, None))
+            ]),
+        )
+
+    @classmethod
+    def get_following_cache_keys(cls, from_user_id):
+        """
+        :return: keys of the following set and its version counter
+        """
+        return (
+            FOLLOWING_SET_PATTERN.format(user_id=from_user_id),
+            FOLLOWING_VERSION_PATTERN.format(user_id=from_user_id),
+        )
+
+    @classmethod
+    def _build_following_cache(cls, from_user_id):
+        """
+        Load the followings from DB into the Redis set
+        The version is read BEFORE loading from DB, if any follow/unfollow happened after that,
+        the script will not save the (maybe outdated) result
+        :return: True if the set is there now
+        """
+        keys = cls.get_following_cache_keys(from_user_id)
+        return cls._build_set_cache(keys, lambda: cls._load_following_user_id_set(from_user_id))
+
+    @classmethod
+    def _build_set_cache(cls, keys, load_user_ids):
+        connection = RedisClient.get_connection(keys[0])
+        version = connection.get(keys[1])
+        user_id_set = load_user_ids()
+        built = RedisScripts.run(
+            'build_set_if_unchanged',
+            keys=list(keys),
+            args=[
+                version or '',
+                settings.REDIS_KEY_EXPIRE_TIME,
+                FOLLOWING_SENTINEL,
+                *user_id_set,
+            ],
+        )
+        # 0 could also mean someone else has just built it
+        return bool(built) or connection.exists(keys[0]) == 1
+
+    @classmethod
+    def add_to_following_cache(cls, from_user_id, to_user_id):
+        """
+        Keep the following set up to date, rather than invalidate it
+
+        In production, we normally invalid the cache directly, rather than update it,
+        to avoid the inconsistancy caused by async tasks.
+        Here the version counter does that job: a build started before this change will not be saved,
+        and SADD/SREM are idempotent, they can be applied again after the commit
+        """
+        if from_user_id is None or to_user_id is None:
+            return
+        RedisScripts.run(
+            'sadd_if_exists',
+            keys=list(cls.get_following_cache_keys(from_user_id)),
+            args=[to_user_id, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+
+    @classmethod
+    def remove_from_following_cache(cls, from_user_id, to_user_id):
+        if from_user_id is None or to_user_id is None:
+            return
+        RedisScripts.run(
+            'srem_if_exists',
+            keys=list(cls.get_following_cache_keys(from_user_id)),
+            args=[to_user_id, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+
+    @classmethod
+    def get_follower_cache_keys(cls, to_user_id):
+        """
+        :return: keys of the follower set and its version counter
+        """
+        return (
+            FOLLOWER_SET_PATTERN.format(user_id=to_user_id),
+            FOLLOWER_VERSION_PATTERN.format(user_id=to_user_id),
+        )
+
     @classmethod
-    def invalidate_following_cache(cls, from_user_id):
+    def _build_follower_cache(cls, to_user_id):
+        """
+        Same as _build_following_cache, only called for the users with not too many followers
         """
-        Invalidate the following cache
+        keys = cls.get_follower_cache_keys(to_user_id)
+        return cls._build_set_cache(keys, lambda: cls.get_follower_ids(to_user_id))
+
+    @classmethod
+    def add_to_follower_cache(cls, from_user_id, to_user_id):
+        if from_user_id is None or to_user_id is None:
+            return
+        RedisScripts.run(
+            'sadd_if_exists',
+            keys=list(cls.get_follower_cache_keys(to_user_id)),
+            args=[from_user_id, settings.REDIS_KEY_EXPIRE_TIME],
+        )
 
-        In production, if there are any changes in the following cache
-        We normally invalid it directly, rather than update it.
-        Why?
-        This is to avoid the inconsistancy caused by async tasks (exp)
-        Also, memcached can only support string as value, it doesn't support append/add natively
+    @classmethod
+    def remove_from_follower_cache(cls, from_user_id, to_user_id):
+        if from_user_id is None or to_user_id is None:
+            return
+        RedisScripts.run(
+            'srem_if_exists',
+            keys=list(cls.get_follower_cache_keys(to_user_id)),
+            args=[from_user_id, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+
+    @classmethod
+    def get_mutual_followers(cls, from_user_id, to_user_id, count_only=False):
         """
-        key = FOLLOWING_PATTERN.format(user_id=from_user_id)
-        cache.delete(key)
+        The users from_user_id follows who also follow to_user_id,
+        for "followed by X, Y and N others you follow" on the profile of to_user_id
+
+        The cost is bounded by the smaller one of the two sets:
+        1. to_user_id has at most MUTUAL_FOLLOWERS_SET_LIMIT followers:
+           both sets are in Redis, SINTERCARD (count_only) or SINTER does the job inside Redis,
+           which only walks the smaller set
+        2. otherwise (or the two sets are on different Redis nodes),
+           the smaller side is read MUTUAL_FOLLOWERS_CHUNK_SIZE users at a time,
+           each chunk is checked against the other side in one call, see _get_mutual_followers_by_chunks
+        :return: (count, sorted ids), ids are [] if count_only
+        """
+        if cls.get_follower_count(to_user_id) <= settings.MUTUAL_FOLLOWERS_SET_LIMIT:
+            result = cls._intersect_sets(from_user_id, to_user_id, count_only)
+            if result is not None:
+                return result
+        mutual_ids = cls._get_mutual_followers_by_chunks(from_user_id, to_user_id)
+        return len(mutual_ids), [] if count_only else mutual_ids
+
+    @classmethod
+    def _intersect_sets(cls, from_user_id, to_user_id, count_only):
+        """
+        :return: (count, sorted ids), None if it can't be done in Redis
+        """
+        following_key, _ = cls.get_following_cache_keys(from_user_id)
+        follower_key, _ = cls.get_follower_cache_keys(to_user_id)
+        if RedisClient.get_node_index(following_key) != RedisClient.get_node_index(follower_key):
+            # SINTER only works for the keys on the same node
+            return None
+        connection = RedisClient.get_connection(following_key)
+
+        def intersect():
+            if count_only:
+                return RedisClient.sintercard([following_key, follower_key])
+            return connection.sinter(following_key, follower_key)
+
+        result = intersect()
+        # Both sets have the sentinel, if it is not in the result, one of them is not in the cache
+        if not result:
+            for key, build in (
+                (following_key, lambda: cls._build_following_cache(from_user_id)),
+                (follower_key, lambda: cls._build_follower_cache(to_user_id)),
+            ):
+                if not connection.exists(key) and not build():
+                    return None
+            result = intersect()
+            if not result:
+                return None
+        if count_only:
+            return result - 1, []
+        mutual_ids = sorted(int(member) for member in result)
+        return len(mutual_ids) - 1, mutual_ids[1:]
+        # the sentinel 0 is always the first one
+
+    @classmethod
+    def _get_mutual_followers_by_chunks(cls, from_user_id, to_user_id):
+        """
+        Read the smaller side chunk by chunk, and check each chunk against the bigger side:
+        - fewer followings: which of them follow to_user_id, get_follower_user_ids (IN query or HBase batch get)
+        - fewer followers: which of them are followed, get_followed_user_ids (SMISMEMBER of the following set)
+        So it's never the whole follower list of a celebrity.
+        The followers are sorted by created_at in both MySQL and HBase,
+        a merge of the two sorted lists would have to read both of them till the end
+        :return: sorted ids
+        """
+        chunk_size = settings.MUTUAL_FOLLOWERS_CHUNK_SIZE
+        mutual_ids = []
+        if cls.get_following_count(from_user_id) <= cls.get_follower_count(to_user_id):
+            following_ids = sorted(cls.get_following_user_id_set(from_user_id))
+            for start in range(0, len(following_ids), chunk_size):
+                chunk = following_ids[start:start + chunk_size]
+                mutual_ids.extend(cls.get_follower_user_ids(to_user_id, chunk))
+        else:
+            for chunk in cls._scan_follower_ids(to_user_id, chunk_size):
+                mutual_ids.extend(cls.get_followed_user_ids(from_user_id, chunk))
+        return sorted(mutual_ids)
+
+    @classmethod
+    def _scan_follower_ids(cls, to_user_id, chunk_size):
+        """
+        Yield the follower ids chunk by chunk, only chunk_size rows are fetched from MySQL/HBase at a time
+        """
+        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
+            follower_ids = Friendship.objects.filter(to_user_id=to_user_id)\
+                .values_list('from_user_id', flat=True)\
+                .iterator(chunk_size=chunk_size)
+        else:
+            follower_ids = (
+                follower.from_user_id
+                for follower in HBaseFollower.scan(prefix=(to_user_id, None), batch_size=chunk_size)
+            )
+        while True:
+            chunk = list(islice(follower_ids, chunk_size))
+            if not chunk:
+                return
+            yield chunk
 
     @classmethod
     def get_following_user_ids(cls, to_user_id):
@@ -100,24 +405,41 @@ class FriendshipService(object):
             return None
         
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.create(
+            friendship = Friendship.objects.create(
                 from_user_id=from_user_id,
                 to_user_id=to_user_id,
             )
+            cls._change_counts(from_user_id, to_user_id, 1)
+            FollowerGraphSnapshot.record_delta(from_user_id, to_user_id, followed=True)
+            return friendship
 
         # Create data in HBase
         now = int(time.time() * 1000000)
+        HBaseFriendship.create(
+            from_user_id=from_user_id,
+            to_user_id=to_user_id,
+            created_at=now,
+        )
+        # The relationship goes first and is deleted last in unfollow,
+        # if we crash in the middle, unfollow can still find and clean up the other two rows
         HBaseFollower.create(
             from_user_id=from_user_id,
             to_user_id=to_user_id,
             created_at=now,
         )
-        # You can return either one 
-        return HBaseFollowing.create(
+        following = HBaseFollowing.create(
             from_user_id=from_user_id,
             to_user_id=to_user_id,
             created_at=now,
         )
+        # No signals from HBase, the following/follower sets and the counts are updated here
+        cls.add_to_following_cache(from_user_id, to_user_id)
+        cls.add_to_follower_cache(from_user_id, to_user_id)
+        cls._change_hbase_counts(from_user_id, to_user_id, 1)
+        cls._change_counts(from_user_id, to_user_id, 1)
+        FollowerGraphSnapshot.record_delta(from_user_id, to_user_id, followed=True)
+        # You can return either one 
+        return following
     
     @classmethod
     def unfollow(cls, from_user_id, to_user_id):
@@ -131,6 +453,9 @@ class FriendshipService(object):
                 from_user_id=from_user_id,
                 to_user_id=to_user_id,
             ).delete()
+            if deleted:
+                cls._change_counts(from_user_id, to_user_id, -1)
+                FollowerGraphSnapshot.record_delta(from_user_id, to_user_id, followed=False)
             return deleted
 
         instance = cls.get_follow_instance(from_user_id, to_user_id)
@@ -139,14 +464,36 @@ class FriendshipService(object):
         # Obtaining the instance is mainly for the create_at
         HBaseFollowing.delete(from_user_id=from_user_id, created_at=instance.created_at)
         HBaseFollower.delete(to_user_id=to_user_id, created_at=instance.created_at)
+        HBaseFriendship.delete(from_user_id=from_user_id, to_user_id=to_user_id)
+        cls.remove_from_following_cache(from_user_id, to_user_id)
+        cls.remove_from_follower_cache(from_user_id, to_user_id)
+        cls._change_hbase_counts(from_user_id, to_user_id, -1)
+        cls._change_counts(from_user_id, to_user_id, -1)
+        FollowerGraphSnapshot.record_delta(from_user_id, to_user_id, followed=False)
         return 1
     
     @classmethod
     def get_follow_instance(cls, from_user_id, to_user_id):
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        for follow in followings:
-            if follow.to_user_id == to_user_id:
-                return follow
+        """
+        ONE point read by the row key (from_user_id, to_user_id),
+        rather than scanning all the followings of from_user_id
+
+        The follows made in HBase before HBaseFriendship was added only have the other two rows,
+        for them, fall back to the scan once and write the missing relationship row,
+        the next read is a point read again.
+        Run `backfill_friendships_to_hbase --from-hbase-followings` to fill all of them at once,
+        get_follower_user_ids/get_followed_user_ids only do the point reads
+        """
+        instance = HBaseFriendship.get(from_user_id=from_user_id, to_user_id=to_user_id)
+        if instance is not None:
+            return instance
+        for following in HBaseFollowing.scan(prefix=(from_user_id, None)):
+            if following.to_user_id == to_user_id:
+                return HBaseFriendship.create(
+                    from_user_id=from_user_id,
+                    to_user_id=to_user_id,
+                    created_at=following.created_at,
+                )
         return None
 
     @classmethod
@@ -156,21 +503,143 @@ class FriendshipService(object):
         """
         if from_user_id == to_user_id:
             return True
-        
-        if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(
-                from_user_id=from_user_id, 
-                to_user_id=to_user_id,
-            ).exists()
-        
-        instance = cls.get_follow_instance(from_user_id, to_user_id)
-        return instance is not None
+        # Answered by the following set in Redis, for both MySQL and HBase
+        return to_user_id in cls.get_followed_user_ids(from_user_id, [to_user_id])
     
     @classmethod
     def get_following_count(cls, from_user_id):
+        return cls._get_count(from_user_id, FOLLOWINGS)
+
+    @classmethod
+    def get_follower_count(cls, to_user_id):
+        return cls._get_count(to_user_id, FOLLOWERS)
+
+    @classmethod
+    def get_count_keys(cls, user_id, name):
+        """
+        :param name: FOLLOWERS or FOLLOWINGS
+        :return: keys of the count and the version counter of the counts of the user
+        """
+        return (
+            FRIENDSHIP_COUNT_PATTERN.format(user_id=user_id, name=name),
+            FRIENDSHIP_COUNTS_VERSION_PATTERN.format(user_id=user_id),
+        )
+
+    @classmethod
+    def _get_count(cls, user_id, name):
+        """
+        O(1) GET from Redis, rather than COUNT in MySQL or reading the counters in HBase
+        The count is loaded from the source table lazily, same as the following set
+        """
+        count_key, _ = cls.get_count_keys(user_id, name)
+        count = RedisClient.get_connection(count_key).get(count_key)
+        if count is not None:
+            return int(count)
+        return cls._fill_count(user_id, name)
+
+    @classmethod
+    def _fill_count(cls, user_id, name):
+        """
+        The version is read BEFORE counting in DB, a follow/unfollow in between will not be overwritten
+        """
+        keys = cls.get_count_keys(user_id, name)
+        version = RedisClient.get_connection(keys[0]).get(keys[1])
+        count = cls._count_from_db(name, [user_id])[user_id]
+        RedisScripts.run(
+            'set_count_if_unchanged',
+            keys=list(keys),
+            args=[version or '', count, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+        return count
+
+    @classmethod
+    def _count_from_db(cls, name, user_ids):
+        """
+        :return: dict, user id -> follower/following count in the source table
+        """
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(from_user_id=from_user_id).count()
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        return len(followings)
-    
-    
\ No newline at end of file
+            field = 'to_user_id' if name == FOLLOWERS else 'from_user_id'
+            counts = dict(
+                Friendship.objects.filter(**{field + '__in': user_ids})
+                .order_by()
+                .values_list(field)
+                .annotate(count=Count('id'))
+            )
+            # One GROUP BY query for all the users
+            return {user_id: counts.get(user_id, 0) for user_id in user_ids}
+        # The counters in HBase, ONE read for all the users, rather than scanning the rows of each user
+        return HBaseFriendshipCount.get_counts(name, user_ids)
+
+    @classmethod
+    def _change_hbase_counts(cls, from_user_id, to_user_id, amount):
+        """
+        The source of the counts in HBase mode, what MySQL gets from COUNT(*)
+        The follows made before HBaseFriendshipCount are counted by
+        `python manage.py backfill_friendships_to_hbase --counts`
+        """
+        HBaseFriendshipCount.increase(from_user_id, FOLLOWINGS, amount)
+        HBaseFriendshipCount.increase(to_user_id, FOLLOWERS, amount)
+
+    @classmethod
+    def _change_counts(cls, from_user_id, to_user_id, amount):
+        """
+        Called by follow/unfollow after the DB is changed
+        The two counts are on different users (maybe different Redis nodes), so one script for each
+        """
+        for user_id, name in ((from_user_id, FOLLOWINGS), (to_user_id, FOLLOWERS)):
+            RedisScripts.run(
+                'incr_count_if_exists',
+                keys=list(cls.get_count_keys(user_id, name)),
+                args=[amount, settings.REDIS_KEY_EXPIRE_TIME],
+            )
+
+    @classmethod
+    def reconcile_counts(cls, batch_size=1000):
+        """
+        Recompute the cached counts from the source table, fix the ones drifted
+        e.g. friendships changed in the admin panel, or a crash between the DB and Redis
+        Only the counts in the cache are checked, the others will be counted from DB when read
+        :return: number of counts fixed
+        """
+        fixed = 0
+        last_id = 0
+        while True:
+            user_ids = list(
+                User.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+            for name in (FOLLOWERS, FOLLOWINGS):
+                fixed += cls._reconcile_counts_batch(name, user_ids)
+        return fixed
+
+    @classmethod
+    def _reconcile_counts_batch(cls, name, user_ids):
+        pipeline = RedisClient.pipeline(transaction=False)
+        for user_id in user_ids:
+            count_key, version_key = cls.get_count_keys(user_id, name)
+            pipeline.get(count_key)
+            pipeline.get(version_key)
+        results = pipeline.execute()
+        cached = {
+            user_id: (int(results[2 * i]), results[2 * i + 1])
+            for i, user_id in enumerate(user_ids)
+            if results[2 * i] is not None
+        }
+        if not cached:
+            return 0
+        # The versions are read BEFORE counting in DB, same as _fill_count
+        db_counts = cls._count_from_db(name, list(cached))
+        fixed = 0
+        for user_id, (count, version) in cached.items():
+            if count == db_counts[user_id]:
+                continue
+            fixed += RedisScripts.run(
+                'set_count_if_unchanged',
+                keys=list(cls.get_count_keys(user_id, name)),
+                args=[version or '', db_counts[user_id], settings.REDIS_KEY_EXPIRE_TIME],
+            )
+        return fixed
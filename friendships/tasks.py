@@ -0,0 +1,36 @@
+from celery import shared_task
+from friendships.graph_snapshot import FollowerGraphSnapshot
+from friendships.recommendations import FollowSuggestions
+from friendships.services import FriendshipService
+from utils.time_constants import ONE_HOUR
+
+
+# Scheduled by celery beat, see twitter.settings.CELERY_BEAT_SCHEDULE
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_friendship_counts_task():
+    """
+    Recompute the cached follower/following counts from the friendship tables
+    It scans the whole users table, run it when the traffic is low
+    """
+    return '{} friendship counts fixed'.format(FriendshipService.reconcile_counts())
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def build_follower_snapshot_task():
+    """
+    Export the follower graph for the fanout workers, see friendships.graph_snapshot
+    """
+    manifest = FollowerGraphSnapshot.build()
+    return 'follower snapshot {}: {} users, {} follows'.format(
+        manifest['version'],
+        manifest['users'],
+        manifest['follows'],
+    )
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def build_follow_suggestions_task():
+    """
+    Recompute who to follow for all the users, see friendships.recommendations
+    """
+    return '{} users with follow suggestions'.format(FollowSuggestions.build())
@@ -1,7 +1,25 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import override_settings
+from django_hbase.client import HBaseClient
 from django_hbase.models import EmptyColumnError, BadRowKeyError
-from friendships.models import HBaseFollowing, HBaseFollower, Friendship
+from friendships.graph_snapshot import FollowerGraphSnapshot
+from friendships.models import HBaseFollowing, HBaseFollower, HBaseFriendship, HBaseFriendshipCount, Friendship
 from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
 from testing.testcases import TestCase
+from utils.backend_calls import BackendCalls
+from utils.redis_client import RedisClient
+from utils.redis_scripts import RedisScripts
+from utils.time_helper import datetime_to_timestamp
+import io
+import numpy as np
+import json
+import os
+import shutil
+import tempfile
+import threading
 import time
 
 
@@ -27,6 +45,410 @@ class FriendshipServiceTests(TestCase):
         user_id_set = FriendshipService.get_following_user_id_set(self.user1.id)
         self.assertEqual(user_id_set, {user3.id, user4.id})
 
+    def test_following_cache(self):
+        user3 = self.create_user('user3')
+        user4 = self.create_user('user4')
+        set_key, version_key = FriendshipService.get_following_cache_keys(self.user1.id)
+        conn = RedisClient.get_connection(set_key)
+        self.create_friendship(from_user=self.user1, to_user=user3)
+        # nothing is cached before the first check
+        self.assertEqual(conn.exists(set_key), 0)
+
+        user_ids = [self.user2.id, user3.id, user4.id]
+        self.assertEqual(FriendshipService.get_followed_user_ids(self.user1.id, user_ids), {user3.id})
+        self.assertEqual(conn.exists(set_key), 1)
+        with BackendCalls.collect() as calls:
+            self.assertEqual(FriendshipService.has_followed(self.user1.id, user3.id), True)
+            self.assertEqual(FriendshipService.has_followed(self.user1.id, user4.id), False)
+        self.assertEqual(calls['sql']['count'], 0)
+
+        # follow/unfollow update the set rather than drop it
+        self.create_friendship(from_user=self.user1, to_user=user4)
+        FriendshipService.unfollow(self.user1.id, user3.id)
+        self.assertEqual(conn.exists(set_key), 1)
+        self.assertEqual(FriendshipService.get_followed_user_ids(self.user1.id, user_ids), {user4.id})
+
+        # a user following no one still has the set (only the sentinel) in the cache
+        self.assertEqual(FriendshipService.get_followed_user_ids(self.user2.id, user_ids), set())
+        empty_set_key, _ = FriendshipService.get_following_cache_keys(self.user2.id)
+        self.assertEqual(conn.exists(empty_set_key), 1)
+
+        # a build that read DB before a follow is not saved
+        conn.delete(set_key)
+        version = conn.get(version_key)
+        self.create_friendship(from_user=self.user1, to_user=self.user2)
+        built = RedisScripts.run(
+            'build_set_if_unchanged',
+            keys=[set_key, version_key],
+            args=[version, 60, 0, user4.id],
+        )
+        self.assertEqual(built, 0)
+        self.assertEqual(
+            FriendshipService.get_followed_user_ids(self.user1.id, user_ids),
+            {self.user2.id, user4.id},
+        )
+
+    def test_friendship_counts(self):
+        user3 = self.create_user('user3')
+        self.create_friendship(from_user=self.user1, to_user=self.user2)
+        # lazy loaded from DB
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 1)
+        with BackendCalls.collect() as calls:
+            self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+        self.assertEqual(calls['sql']['count'], 0)
+
+        # follow/unfollow change the cached counts
+        self.create_friendship(from_user=self.user1, to_user=user3)
+        self.create_friendship(from_user=user3, to_user=self.user2)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 2)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 2)
+        FriendshipService.unfollow(self.user1.id, self.user2.id)
+        FriendshipService.unfollow(self.user1.id, self.user2.id)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 1)
+
+        # changes not through the service are fixed by reconcile
+        Friendship.objects.filter(from_user=self.user1).delete()
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+        self.assertEqual(FriendshipService.reconcile_counts(), 1)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 0)
+        self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 1)
+        self.assertEqual(FriendshipService.reconcile_counts(), 0)
+
+    def check_mutual_followers(self):
+        # MUTUAL_FOLLOWERS_SET_LIMIT is 5 and MUTUAL_FOLLOWERS_CHUNK_SIZE is 2 in the tests
+        viewer, target = self.user1, self.user2
+        users = [self.create_user('mutual{}'.format(i)) for i in range(8)]
+        user_ids = [user.id for user in users]
+        for user in users[:4]:
+            FriendshipService.follow(viewer.id, user.id)
+        for user in (users[0], users[2], users[5]):
+            FriendshipService.follow(user.id, target.id)
+
+        # a few followers: SINTER/SINTERCARD in Redis
+        self.assertEqual(
+            FriendshipService.get_mutual_followers(viewer.id, target.id),
+            (2, [user_ids[0], user_ids[2]]),
+        )
+        with BackendCalls.collect() as calls:
+            self.assertEqual(
+                FriendshipService.get_mutual_followers(viewer.id, target.id, count_only=True),
+                (2, []),
+            )
+        # both sets are in Redis now
+        self.assertEqual(calls['sql']['count'], 0)
+        self.assertEqual(calls['hbase']['count'], 0)
+        follower_key, _ = FriendshipService.get_follower_cache_keys(target.id)
+        self.assertEqual(RedisClient.get_connection(follower_key).exists(follower_key), 1)
+        # the follower set is kept up to date
+        FriendshipService.unfollow(users[0].id, target.id)
+        FriendshipService.follow(users[3].id, target.id)
+        self.assertEqual(
+            FriendshipService.get_mutual_followers(viewer.id, target.id),
+            (2, [user_ids[2], user_ids[3]]),
+        )
+
+        # too many followers: the followings (4 < 6) are checked chunk by chunk
+        for user in (users[0], users[6], users[7]):
+            FriendshipService.follow(user.id, target.id)
+        self.assertEqual(FriendshipService.get_follower_count(target.id), 6)
+        self.assertEqual(
+            FriendshipService.get_mutual_followers(viewer.id, target.id),
+            (3, [user_ids[0], user_ids[2], user_ids[3]]),
+        )
+        # more followings than followers: the followers are scanned chunk by chunk
+        for user in users[4:]:
+            FriendshipService.follow(viewer.id, user.id)
+        FriendshipService.follow(viewer.id, self.create_user('another').id)
+        self.assertEqual(
+            FriendshipService.get_mutual_followers(viewer.id, target.id),
+            (6, [user_ids[0], user_ids[2], user_ids[3], user_ids[5], user_ids[6], user_ids[7]]),
+        )
+        self.assertEqual(
+            FriendshipService.get_mutual_followers(viewer.id, target.id, count_only=True),
+            (6, []),
+        )
+        self.assertEqual(FriendshipService.get_mutual_followers(target.id, viewer.id), (0, []))
+
+    def test_mutual_followers(self):
+        self.check_mutual_followers()
+
+    def test_hbase_mutual_followers(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        self.check_mutual_followers()
+
+    def test_old_redis_server(self):
+        # docker.sh installs Redis 4.0: no SMISMEMBER (6.2) or SINTERCARD (7.0)
+        self.addCleanup(setattr, RedisClient, 'unsupported_commands', set())
+        RedisClient.unsupported_commands = {
+            (index, command)
+            for index in range(len(settings.REDIS_NODES))
+            for command in ('SMISMEMBER', 'SINTERCARD')
+        }
+        self.check_mutual_followers()
+        user3 = self.create_user('user3')
+        FriendshipService.follow(user3.id, self.user2.id)
+        self.assertEqual(
+            FriendshipService.get_followed_user_ids(user3.id, [self.user1.id, self.user2.id]),
+            {self.user2.id},
+        )
+
+    def test_hbase_follow_and_unfollow(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        user3 = self.create_user('user3')
+        following = FriendshipService.follow(self.user1.id, self.user2.id)
+        FriendshipService.follow(self.user1.id, user3.id)
+
+        # the relationship is a point read by (from_user_id, to_user_id)
+        instance = FriendshipService.get_follow_instance(self.user1.id, self.user2.id)
+        self.assertEqual(instance.created_at, following.created_at)
+        self.assertEqual(FriendshipService.get_follow_instance(self.user2.id, self.user1.id), None)
+        self.assertEqual(FriendshipService.has_followed(self.user1.id, user3.id), True)
+        self.assertEqual(
+            FriendshipService.get_follower_user_ids(user3.id, [self.user1.id, self.user2.id]),
+            {self.user1.id},
+        )
+
+        self.assertEqual(FriendshipService.unfollow(self.user1.id, self.user2.id), 1)
+        self.assertEqual(FriendshipService.unfollow(self.user1.id, self.user2.id), 0)
+        self.assertEqual(FriendshipService.get_follow_instance(self.user1.id, self.user2.id), None)
+        self.assertEqual(len(HBaseFollowing.filter(prefix=(self.user1.id, None))), 1)
+        self.assertEqual(len(HBaseFollower.filter(prefix=(self.user2.id, None))), 0)
+        self.assertEqual(FriendshipService.get_following_user_id_set(self.user1.id), {user3.id})
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(user3.id), 1)
+
+    def test_hbase_friendship_counts(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        user3 = self.create_user('user3')
+        FriendshipService.follow(self.user1.id, self.user2.id)
+        FriendshipService.follow(self.user1.id, user3.id)
+        FriendshipService.follow(user3.id, self.user2.id)
+        FriendshipService.unfollow(self.user1.id, user3.id)
+        self.assertEqual(
+            HBaseFriendshipCount.get_counts('followings', [self.user1.id, self.user2.id, user3.id]),
+            {self.user1.id: 1, self.user2.id: 0, user3.id: 1},
+        )
+
+        # a cache miss reads the counters, ONE HBase call rather than a scan per user
+        count_key, _ = FriendshipService.get_count_keys(self.user2.id, 'followers')
+        RedisClient.get_connection(count_key).delete(count_key)
+        with BackendCalls.collect() as calls:
+            self.assertEqual(FriendshipService.get_follower_count(self.user2.id), 2)
+        self.assertEqual(calls['hbase']['count'], 1)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+
+        # reconcile compares the cached counts with the counters
+        FriendshipService.follow(self.user1.id, user3.id)
+        HBaseFriendshipCount.set_count(self.user1.id, 'followings', 1)
+        self.assertEqual(FriendshipService.reconcile_counts(), 1)
+        self.assertEqual(FriendshipService.get_following_count(self.user1.id), 1)
+
+    def test_hbase_legacy_follow(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        FriendshipService.follow(self.user1.id, self.user2.id)
+        # a follow made before HBaseFriendship was added
+        HBaseFriendship.delete(from_user_id=self.user1.id, to_user_id=self.user2.id)
+
+        # the relationship row is written back by the first read
+        instance = FriendshipService.get_follow_instance(self.user1.id, self.user2.id)
+        self.assertEqual(instance.to_user_id, self.user2.id)
+        self.assertEqual(
+            FriendshipService.get_follower_user_ids(self.user2.id, [self.user1.id]),
+            {self.user1.id},
+        )
+        HBaseFriendship.delete(from_user_id=self.user1.id, to_user_id=self.user2.id)
+        self.assertEqual(FriendshipService.unfollow(self.user1.id, self.user2.id), 1)
+        self.assertEqual(len(HBaseFollowing.filter(prefix=(self.user1.id, None))), 0)
+        self.assertEqual(len(HBaseFollower.filter(prefix=(self.user2.id, None))), 0)
+        self.assertEqual(FriendshipService.get_follow_instance(self.user1.id, self.user2.id), None)
+
+
+class BackfillCommandTests(TestCase):
+
+    def setUp(self):
+        super(BackfillCommandTests, self).setUp()
+        self.users = [self.create_user('user{}'.format(i)) for i in range(4)]
+        for from_user in self.users:
+            for to_user in self.users:
+                self.create_friendship(from_user=from_user, to_user=to_user)
+        # the switch is off, the friendships are only in MySQL
+        self.checkpoint = os.path.join(tempfile.mkdtemp(), 'backfill.checkpoint')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.checkpoint))
+
+    def call(self, **options):
+        options = {
+            'workers': 1,
+            'chunk_size': 5,
+            'checkpoint': self.checkpoint,
+            **options,
+        }
+        call_command(
+            'backfill_friendships_to_hbase',
+            stdout=io.StringIO(),
+            stderr=io.StringIO(),
+            **options,
+        )
+
+    def test_backfill_and_verify(self):
+        with self.assertRaises(CommandError):
+            self.call(verify=True)
+
+        self.call()
+        with open(self.checkpoint) as f:
+            checkpoint = json.load(f)
+        self.assertEqual(checkpoint['chunk_size'], 5)
+        self.assertEqual(len(checkpoint['done']), 3)
+        # the rows are copied, the counters are not set yet
+        with self.assertRaises(CommandError):
+            self.call(verify=True)
+        self.call(counts=True, chunk_size=3)
+        self.call(verify=True)
+
+        friendship = Friendship.objects.first()
+        instance = HBaseFriendship.get(
+            from_user_id=friendship.from_user_id,
+            to_user_id=friendship.to_user_id,
+        )
+        self.assertEqual(instance.created_at, datetime_to_timestamp(friendship.created_at))
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        self.assertEqual(
+            FriendshipService.get_following_user_id_set(self.users[0].id),
+            {user.id for user in self.users[1:]},
+        )
+
+        # an unfollow after the backfill is found by verify
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 0)
+        FriendshipService.unfollow(self.users[0].id, self.users[1].id)
+        with self.assertRaises(CommandError):
+            self.call(verify=True)
+
+    def test_backfill_from_hbase_followings(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        user_ids = [user.id for user in self.users]
+        for to_user_id in user_ids[1:]:
+            FriendshipService.follow(user_ids[0], to_user_id)
+            HBaseFriendship.delete(from_user_id=user_ids[0], to_user_id=to_user_id)
+        self.assertEqual(FriendshipService.get_follower_user_ids(user_ids[1], user_ids), set())
+
+        self.call(from_hbase_followings=True, chunk_size=2)
+        for to_user_id in user_ids[1:]:
+            self.assertEqual(
+                FriendshipService.get_follower_user_ids(to_user_id, user_ids),
+                {user_ids[0]},
+            )
+
+    def test_resume_from_checkpoint(self):
+        self.call()
+        HBaseFollowing.delete(
+            from_user_id=self.users[0].id,
+            created_at=HBaseFriendship.get(
+                from_user_id=self.users[0].id,
+                to_user_id=self.users[1].id,
+            ).created_at,
+        )
+        # all the chunks are done, nothing is copied again
+        self.call()
+        with self.assertRaises(CommandError):
+            self.call(verify=True)
+        # the checkpoint is for chunk size 5
+        with self.assertRaises(CommandError):
+            self.call(chunk_size=10)
+        self.call(restart=True)
+        self.call(counts=True)
+        self.call(verify=True)
+
+
+class FollowerGraphSnapshotTests(TestCase):
+
+    def setUp(self):
+        super(FollowerGraphSnapshotTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        settings_override = override_settings(FOLLOWER_SNAPSHOT_DIR=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        FollowerGraphSnapshot.snapshot = None
+        self.addCleanup(setattr, FollowerGraphSnapshot, 'snapshot', None)
+        self.users = [self.create_user('user{}'.format(i)) for i in range(5)]
+
+    def follow(self, from_index, to_index):
+        FriendshipService.follow(self.users[from_index].id, self.users[to_index].id)
+
+    def get_follower_ids(self, index):
+        follower_ids = FollowerGraphSnapshot.get_follower_ids(self.users[index].id)
+        return None if follower_ids is None else list(follower_ids)
+
+    def test_build_and_read(self):
+        # no snapshot yet
+        self.assertEqual(self.get_follower_ids(0), None)
+        for from_index in (3, 1, 4):
+            self.follow(from_index, 0)
+        self.follow(0, 2)
+
+        manifest = FollowerGraphSnapshot.build(batch_size=2)
+        self.assertEqual(manifest['follows'], 4)
+        self.assertEqual(manifest['users'], self.users[2].id + 1)
+        user_ids = [user.id for user in self.users]
+        self.assertEqual(self.get_follower_ids(0), [user_ids[1], user_ids[3], user_ids[4]])
+        self.assertEqual(self.get_follower_ids(2), [user_ids[0]])
+        self.assertEqual(self.get_follower_ids(1), [])
+        # the follower ids are read from the mapped files, not from the DB
+        with BackendCalls.collect() as calls:
+            FollowerGraphSnapshot.get_follower_ids(user_ids[0])
+        self.assertEqual(calls['sql']['count'], 0)
+        _, _, ids = FollowerGraphSnapshot.snapshot
+        self.assertIsInstance(ids, np.memmap)
+
+        # follows/unfollows after the snapshot come from the delta log
+        new_user = self.create_user('new_user')
+        FriendshipService.unfollow(user_ids[3], user_ids[0])
+        FriendshipService.follow(user_ids[2], user_ids[0])
+        FriendshipService.follow(new_user.id, user_ids[0])
+        FriendshipService.follow(user_ids[0], new_user.id)
+        self.assertEqual(
+            self.get_follower_ids(0),
+            [user_ids[1], user_ids[2], user_ids[4], new_user.id],
+        )
+        self.assertEqual(self.get_follower_ids(2), [user_ids[0]])
+        self.assertEqual(
+            FollowerGraphSnapshot.get_follower_ids(new_user.id).tolist(),
+            [user_ids[0]],
+        )
+
+        # too old for the delta log
+        FollowerGraphSnapshot.snapshot[0]['started_at'] -= settings.FOLLOWER_SNAPSHOT_DELTA_TTL * 1000
+        self.assertEqual(self.get_follower_ids(0), None)
+
+    def test_rebuild(self):
+        self.follow(1, 0)
+        first = FollowerGraphSnapshot.build()
+        self.assertEqual(self.get_follower_ids(0), [self.users[1].id])
+        self.follow(2, 0)
+        time.sleep(0.002)
+        second = FollowerGraphSnapshot.build()
+        time.sleep(0.002)
+        third = FollowerGraphSnapshot.build()
+        # the loaded snapshot is replaced on the next check
+        FollowerGraphSnapshot.checked_at = 0
+        self.assertEqual(self.get_follower_ids(0), [self.users[1].id, self.users[2].id])
+        self.assertEqual(FollowerGraphSnapshot.snapshot[0]['version'], third['version'])
+        # only the last two snapshots are kept
+        names = os.listdir(self.directory)
+        self.assertNotIn(first['ids'], names)
+        self.assertIn(second['ids'], names)
+        self.assertIn(third['ids'], names)
+
+    def test_hbase_build(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        self.follow(2, 0)
+        self.follow(1, 0)
+        self.follow(0, 1)
+        FollowerGraphSnapshot.build()
+        self.assertEqual(self.get_follower_ids(0), [self.users[1].id, self.users[2].id])
+        self.assertEqual(self.get_follower_ids(1), [self.users[0].id])
+
 
 class HBaseTests(TestCase):
 
@@ -34,6 +456,16 @@ class HBaseTests(TestCase):
     def ts_now(self):
         return int(time.time() * 1000000)
     
+    def test_connection_per_thread(self):
+        connection = HBaseClient.get_connection()
+        self.assertIs(HBaseClient.get_connection(), connection)
+        connections = []
+        thread = threading.Thread(target=lambda: connections.append(HBaseClient.get_connection()))
+        thread.start()
+        thread.join()
+        # a Thrift socket is never shared by two threads
+        self.assertIsNot(connections[0], connection)
+
     def test_save_and_get(self):
         timestamp = self.ts_now
         following = HBaseFollowing(from_user_id=123, to_user_id=34, created_at=timestamp)
@@ -132,4 +564,19 @@ class HBaseTests(TestCase):
         results = HBaseFollowing.filter(start=(1, results[1].created_at), limit=2, reverse=True)
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0].to_user_id, 3)
-        self.assertEqual(results[1].to_user_id, 2)
\ No newline at end of file
+        self.assertEqual(results[1].to_user_id, 2)
+
+    def test_batch_get(self):
+        ts = self.ts_now
+        HBaseFriendship.create(from_user_id=1, to_user_id=2, created_at=ts)
+        HBaseFriendship.create(from_user_id=1, to_user_id=4, created_at=ts + 1)
+
+        results = HBaseFriendship.batch_get([
+            {'from_user_id': 1, 'to_user_id': user_id}
+            for user_id in [2, 3, 4]
+        ])
+        self.assertEqual(results[0].created_at, ts)
+        self.assertEqual(results[1], None)
+        self.assertEqual(results[2].to_user_id, 4)
+        self.assertEqual(results[2].created_at, ts + 1)
+        self.assertEqual(HBaseFriendship.batch_get([]), [])
\ No newline at end of file
@@ -7,8 +7,8 @@ class GateKeeper(object):
 
     @classmethod
     def get(cls, gk_name):
-        conn = RedisClient.get_connection()
         name = f'gatekeeper:{gk_name}'
+        conn = RedisClient.get_connection(name)
         # this is how we name the gatekeeper
         if not conn.exists(name):
             return {'percent': 0, 'description': ''}
@@ -23,8 +23,8 @@ class GateKeeper(object):
     
     @classmethod
     def set_kv(cls, gk_name, key, value):
-        conn = RedisClient.get_connection()
         name = f'gatekeeper:{gk_name}'
+        conn = RedisClient.get_connection(name)
         conn.hset(name, key, value)
 
     @classmethod
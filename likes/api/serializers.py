@@ -90,6 +90,15 @@ class LikeSerializerForCreate(BaseLikeSerializerForCreateAndCancel):
         )
 
 
+class LikeSerializerForList(BaseLikeSerializerForCreateAndCancel):
+    """
+    Validate the query params of GET /api/likes/
+    """
+
+    def get_model_class(self):
+        return self._get_model_class(self.validated_data)
+
+
 class LikeSerializerForCancel(BaseLikeSerializerForCreateAndCancel):
     
     def cancel(self):
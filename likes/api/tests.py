@@ -1,4 +1,10 @@
+from django.contrib.auth.models import AnonymousUser
+from likes.services import LikeService
 from testing.testcases import TestCase
+from tweets.constants import TWEET_DETAIL_LIKES_LIMIT
+from tweets.models import Tweet
+from utils.paginations import EndlessPagination
+from utils.counter_helper import CounterHelper
 
 LIKE_BASE_URL = '/api/likes/'
 LIKE_CANCEL_URL = '/api/likes/cancel/'
@@ -21,9 +27,10 @@ class LikeAPITestCase(TestCase):
         response = self.anonymous_client.post(LIKE_BASE_URL, data)
         self.assertEqual(response.status_code, 403)
 
-        # Negative test: GET method is not allowed
+        # GET method lists the likes
         response = self.client1.get(LIKE_BASE_URL, data)
-        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
 
         # Negative test: wrong spell of content_type
         response = self.client1.post(LIKE_BASE_URL, {
@@ -61,9 +68,10 @@ class LikeAPITestCase(TestCase):
         response = self.anonymous_client.post(LIKE_BASE_URL, data)
         self.assertEqual(response.status_code, 403)
 
-        # Negative test: GET method is not allowed
+        # GET method lists the likes
         response = self.client1.get(LIKE_BASE_URL, data)
-        self.assertEqual(response.status_code, 405)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
 
         # Negative test: wrong spell of content_type
         response = self.client1.post(LIKE_BASE_URL, {
@@ -185,6 +193,14 @@ class LikeAPITestCase(TestCase):
         self.assertEqual(response.data['comments'][0]['has_liked'], True)
         self.assertEqual(response.data['comments'][0]['likes_count'], 2)
 
+        # likes_count of the comment is written to the DB by the flush
+        CounterHelper.flush()
+        comment.refresh_from_db()
+        self.assertEqual(comment.likes_count, 2)
+        self.client1.post(LIKE_CANCEL_URL, {'content_type': 'comment', 'object_id': comment.id})
+        response = self.client2.get(COMMENT_LIST_URL, {'tweet_id': tweet.id})
+        self.assertEqual(response.data['comments'][0]['likes_count'], 1)
+
     def test_likes_in_tweets_api(self):
         tweet = self.create_tweet(self.user1)
 
@@ -234,12 +250,15 @@ class LikeAPITestCase(TestCase):
             client.post(LIKE_BASE_URL, data)
             response = client.get(tweet_url)
             self.assertEqual(response.data['likes_count'], i + 1)
+            # the DB is updated by the flush
+            CounterHelper.flush()
             tweet.refresh_from_db()
             self.assertEqual(tweet.likes_count, i + 1)
         
         self.client2.post(LIKE_BASE_URL, data)
         response = self.client2.get(tweet_url)
         self.assertEqual(response.data['likes_count'], 4)
+        CounterHelper.flush()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 4)
 
@@ -252,6 +271,7 @@ class LikeAPITestCase(TestCase):
 
         # If user2 canceled a like
         self.client2.post(LIKE_BASE_URL + 'cancel/', data)
+        CounterHelper.flush()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 3)
         response = self.client2.get(tweet_url)
@@ -259,4 +279,103 @@ class LikeAPITestCase(TestCase):
         response = self.client1.get(newsfeed_url)
         self.assertEqual(response.data['results'][0]['tweet']['likes_count'], 3)
         response = self.client2.get(newsfeed_url)
-        self.assertEqual(response.data['results'][0]['tweet']['likes_count'], 3)
\ No newline at end of file
+        self.assertEqual(response.data['results'][0]['tweet']['likes_count'], 3)
+
+    def test_has_liked_of_a_page(self):
+        tweets = [self.create_tweet(self.user1) for _ in range(3)]
+        comments = [self.create_comment(self.user1, tweets[0]) for _ in range(3)]
+        for tweet in tweets:
+            self.create_newsfeed(self.user2, tweet)
+        self.create_like(self.user2, tweets[0])
+        self.create_like(self.user2, tweets[2])
+        self.create_like(self.user2, comments[1])
+        self.create_like(self.user1, tweets[1])
+
+        # batch API
+        tweet_ids = [tweet.id for tweet in tweets]
+        self.assertEqual(
+            LikeService.get_liked_object_ids(self.user2, Tweet, tweet_ids),
+            {tweets[0].id, tweets[2].id},
+        )
+        self.assertEqual(LikeService.get_liked_object_ids(self.user2, Tweet, []), set())
+        self.assertEqual(LikeService.get_liked_object_ids(AnonymousUser(), Tweet, tweet_ids), set())
+
+        # every item of the page has its own has_liked
+        expected = {tweets[0].id: True, tweets[1].id: False, tweets[2].id: True}
+        response = self.client2.get(TWEET_LIST_URL, {'user_id': self.user1.id})
+        for tweet_data in response.data['results']:
+            self.assertEqual(tweet_data['has_liked'], expected[tweet_data['id']])
+        response = self.client2.get(NEWSFEED_LIST_URL)
+        for newsfeed_data in response.data['results']:
+            self.assertEqual(
+                newsfeed_data['tweet']['has_liked'],
+                expected[newsfeed_data['tweet']['id']],
+            )
+
+        expected = {comments[0].id: False, comments[1].id: True, comments[2].id: False}
+        response = self.client2.get(COMMENT_LIST_URL, {'tweet_id': tweets[0].id})
+        for comment_data in response.data['comments']:
+            self.assertEqual(comment_data['has_liked'], expected[comment_data['id']])
+        response = self.client2.get(TWEET_DETAIL_URL.format(tweets[0].id))
+        self.assertEqual(response.data['has_liked'], True)
+        for comment_data in response.data['comments']:
+            self.assertEqual(comment_data['has_liked'], expected[comment_data['id']])
+        response = self.anonymous_client.get(TWEET_DETAIL_URL.format(tweets[0].id))
+        self.assertEqual(response.data['has_liked'], False)
+        for comment_data in response.data['comments']:
+            self.assertEqual(comment_data['has_liked'], False)
+
+    def test_list_likes(self):
+        tweet = self.create_tweet(self.user1)
+        comment = self.create_comment(self.user1, tweet)
+
+        # required params and validation
+        response = self.anonymous_client.get(LIKE_BASE_URL, {'content_type': 'tweet'})
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(LIKE_BASE_URL, {'content_type': 'tweet', 'object_id': -1})
+        self.assertEqual(response.status_code, 400)
+        response = self.anonymous_client.get(LIKE_BASE_URL, {'content_type': 'user', 'object_id': tweet.id})
+        self.assertEqual(response.status_code, 400)
+
+        users = [self.create_user('liker{}'.format(i)) for i in range(TWEET_DETAIL_LIKES_LIMIT + 5)]
+        likes = [self.create_like(user, tweet) for user in users]
+        self.create_like(self.user2, comment)
+
+        # first page from the cache, newest first
+        params = {'content_type': 'tweet', 'object_id': tweet.id}
+        response = self.anonymous_client.get(LIKE_BASE_URL, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['has_next_page'], True)
+        self.assertEqual(
+            [like['id'] for like in response.data['results']],
+            [like.id for like in likes[::-1][:EndlessPagination.page_size]],
+        )
+        # next page goes beyond the cached list, from DB
+        response = self.anonymous_client.get(LIKE_BASE_URL, {
+            **params,
+            'created_at__lt': response.data['results'][-1]['created_at'],
+        })
+        self.assertEqual(response.data['has_next_page'], False)
+        self.assertEqual(
+            [like['id'] for like in response.data['results']],
+            [like.id for like in likes[::-1][EndlessPagination.page_size:]],
+        )
+
+        # likes of a comment
+        response = self.anonymous_client.get(LIKE_BASE_URL, {'content_type': 'comment', 'object_id': comment.id})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['user']['id'], self.user2.id)
+
+        # new like is pushed into the cached list, unlike drops the list
+        self.create_like(self.user2, tweet)
+        response = self.anonymous_client.get(LIKE_BASE_URL, params)
+        self.assertEqual(response.data['results'][0]['user']['id'], self.user2.id)
+        self.client2.post(LIKE_CANCEL_URL, {'content_type': 'tweet', 'object_id': tweet.id})
+        response = self.anonymous_client.get(LIKE_BASE_URL, params)
+        self.assertEqual(response.data['results'][0]['id'], likes[-1].id)
+
+        # tweet detail only has the newest likes, likes_count is the total
+        response = self.anonymous_client.get(TWEET_DETAIL_URL.format(tweet.id))
+        self.assertEqual(len(response.data['likes']), TWEET_DETAIL_LIKES_LIMIT)
+        self.assertEqual(response.data['likes'][0]['id'], likes[-1].id)
+        self.assertEqual(response.data['likes_count'], len(likes))
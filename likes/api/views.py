@@ -1,18 +1,22 @@
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.utils.decorators import method_decorator
 from inbox.services import NotificationService
 from likes.api.serializers import (
     LikeSerializer, 
     LikeSerializerForCancel,
     LikeSerializerForCreate,
+    LikeSerializerForList,
 )
 from likes.models import Like
+from likes.services import LikeService
 from ratelimit.decorators import ratelimit
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from utils.decorators import required_params
+from utils.paginations import EndlessPagination
 
 
 class LikeViewSet(viewsets.GenericViewSet):
@@ -20,8 +24,43 @@ class LikeViewSet(viewsets.GenericViewSet):
     ViewSet for likes of tweet or comments
     """
     queryset = Like.objects.all()
-    permission_classes = (IsAuthenticated,)
     serializer_class = LikeSerializerForCreate
+    pagination_class = EndlessPagination
+
+    def get_permissions(self):
+        if self.action == 'list':
+            return [AllowAny()]
+        return [IsAuthenticated()]
+
+    @required_params(method='get', params=['content_type', 'object_id'])
+    def list(self, request, *args, **kwargs):
+        """
+        Likes of a tweet or comment, newest first
+        GET /api/likes/?content_type=tweet&object_id=1
+        GET /api/likes/?content_type=tweet&object_id=1&created_at__lt=...
+
+        The tweet detail only embeds the newest likes, a viral tweet could have millions of them
+        The first pages come from the Redis list, older pages go to DB
+        """
+        serializer = LikeSerializerForList(data=request.query_params)
+        if not serializer.is_valid():
+            return Response({
+                'success': False,
+                'message': 'Please check your input',
+                'errors': serializer.errors,
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        model_class = serializer.get_model_class()
+        object_id = serializer.validated_data['object_id']
+        cached_likes = LikeService.get_cached_likes(model_class, object_id)
+        page = self.paginator.paginate_cached_list(cached_likes, request)
+        if page is None:
+            queryset = Like.objects.filter(
+                content_type=ContentType.objects.get_for_model(model_class),
+                object_id=object_id,
+            )
+            page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(LikeSerializer(page, many=True).data)
 
     @required_params(method='post', params=['content_type', 'object_id'])
     @method_decorator(ratelimit(key='user', rate='10/s', method='POST', block=True))
@@ -1,65 +1,74 @@
-from utils.listeners import invalidate_object_cache
-from utils.redis_helper import RedisHelper
+from utils.counter_helper import CounterHelper
+from utils.listeners import invalidate_object_cache, run_now_and_on_commit
 
-def increase_likes_count(sender, instance, created, ** kwargs):
+def _get_counted_target(instance):
+    """
+    The liked object if it has likes_count, otherwise None
+    Only the class and id are used by CounterHelper, no need to load it from DB by content_object
+    """
+    from comments.models import Comment
     from tweets.models import Tweet
-    from django.db.models import F
 
+    model_class = instance.content_type.model_class()
+    if model_class not in (Tweet, Comment):
+        return None
+    return model_class(id=instance.object_id)
+
+
+def increase_likes_count(sender, instance, created, ** kwargs):
     if not created:
         # if this is only update, no need to deal with it
         return
     
-    model_class = instance.content_type.model_class()
-    if model_class != Tweet:
-        # Only Tweet to process
-        # TODO: use the similar method to add likes_count for comments
+    target = _get_counted_target(instance)
+    if target is None:
         return
     
-    # Method 1:
-    # tweet = instance.content_object
-    # Tweet.objects.filter(id=tweet.id).update(likes_count=F('likes_count') + 1)
+    # Before: Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') + 1)
+    # SQL: UPDATE likes_count = likes_count + 1 FROM tweets_table WHERE id=<instance.object_id>
+    # It is atomic with the row lock, but every like of a viral tweet waits for the same row lock
     #
-    # 
-    # # DO NOT: 
-    # tweet = instance.content_object
+    # DO NOT:
     # tweet.likes_count += 1
-    # # <---- if someone else liked at this point and current process is slow at here...
     # tweet.save()
-    # 
     # Why: this is not atomic operation, could causing the wrong value.
-    # Most of databses supports atmoic operation
-    # 
-    # Method 2: (same as method 1)
-    Tweet.objects.filter(id=instance.object_id).update(
-        likes_count=F('likes_count') + 1
-    )
-    # SQL: UPDATE likes_count = likes_count + 1 FROM tweets_table WHERE id=<instance.object_id>
-    # This is atmoic, using MySQL's row lock to ensure the linear operation of this line
-    # F here is to pass the name string into the SQL query in raw
-    # 
-    # What if: Tweet.objects.filter(id=instance.object_id).update(likes_count=tweet.likes_count + 1)
-    # SQL: UPDATE likes_count = 11 FROM tweets_table WHERE id=<instance.object_id>
+    #
+    # Now: write-behind, only the delta is saved in Redis,
+    # flush_counters_task writes the deltas of many likes to the DB by one UPDATE later
+    # see utils.counter_helper.CounterHelper
+    CounterHelper.increase_count(target, 'likes_count')
     
-    # Method 3:
-    # tweet = instance.content_object
-    # tweet.likes_count = F('likes_count') + 1
-    # tweet.save()
-    # 
-    # In this method, .save() will trigger the post_save listener, however, .update will not.
 
-    # Cache part: more knowledge in comments.listeners.increase_comments_count()
-    RedisHelper.increase_count(instance.content_object, 'likes_count')
+def decrease_likes_count(sender, instance, **kwargs):
+    target = _get_counted_target(instance)
+    if target is None:
+        return
     
+    CounterHelper.decrease_count(target, 'likes_count')
 
-def decrease_likes_count(sender, instance, **kwargs):
-    from tweets.models import Tweet
-    from django.db.models import F
 
-    model_class = instance.content_type.model_class()
-    if model_class != Tweet:
+def add_liked_object(sender, instance, created, **kwargs):
+    if not created:
         return
-    
-    Tweet.objects.filter(id=instance.object_id).update(
-        likes_count=F('likes_count') - 1
-    )
-    RedisHelper.decrease_count(instance.content_object, 'likes_count')
\ No newline at end of file
+    from likes.services import LikeService
+    run_now_and_on_commit(LikeService.add_to_liked_cache, instance)
+    # again on commit: the version is bumped after the like is visible in DB,
+    # so a build that read DB before the commit gives up, see LikeService._build_liked_cache
+
+
+def remove_liked_object(sender, instance, **kwargs):
+    from likes.services import LikeService
+    run_now_and_on_commit(LikeService.remove_from_liked_cache, instance)
+
+
+def push_like_to_cache(sender, instance, created, **kwargs):
+    if not created:
+        return
+    from likes.services import LikeService
+    LikeService.push_like_to_cache(instance)
+    # not again on commit: LPUSH is not idempotent
+
+
+def invalidate_likes_cache(sender, instance, **kwargs):
+    from likes.services import LikeService
+    run_now_and_on_commit(LikeService.invalidate_likes_cache, instance)
@@ -5,7 +5,14 @@ from django.db import models
 from django.db.models.signals import pre_delete, post_save
 
 from utils.memcached_helper import MemcachedHelper
-from likes.listeners import increase_likes_count, decrease_likes_count
+from likes.listeners import (
+    add_liked_object,
+    decrease_likes_count,
+    increase_likes_count,
+    invalidate_likes_cache,
+    push_like_to_cache,
+    remove_liked_object,
+)
 
 
 class Like(models.Model):
@@ -55,4 +62,8 @@ class Like(models.Model):
     # Normally, code is not too long 
 
 post_save.connect(increase_likes_count, sender=Like)
-pre_delete.connect(decrease_likes_count, sender=Like)
\ No newline at end of file
+pre_delete.connect(decrease_likes_count, sender=Like)
+post_save.connect(add_liked_object, sender=Like)
+pre_delete.connect(remove_liked_object, sender=Like)
+post_save.connect(push_like_to_cache, sender=Like)
+pre_delete.connect(invalidate_likes_cache, sender=Like)
@@ -1,6 +1,33 @@
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 
 from likes.models import Like
+from twitter.cache import (
+    OBJECT_LIKES_PATTERN,
+    USER_LIKES_BLOOM_PATTERN,
+    USER_LIKES_RECENT_PATTERN,
+    USER_LIKES_VERSION_PATTERN,
+)
+from utils.bloom_filter import BloomFilter
+from utils.cache_versions import CacheVersions
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.redis_scripts import RedisScripts
+
+# states returned by the check_likes script, see utils.redis_scripts
+LIKED = 2
+MAYBE_LIKED = 1
+NOT_LIKED = 0
+
+
+def lazy_load_likes(content_type_id, object_id):
+    def _lazy_load(limit):
+        return Like.objects.filter(
+            content_type_id=content_type_id,
+            object_id=object_id,
+        ).order_by('-created_at')[:limit]
+        # Using the index (content_type, object_id, created_at)
+    return _lazy_load
 
 
 class LikeService(object):
@@ -9,7 +36,13 @@ class LikeService(object):
 
     Methods:
         has_liked
-    
+        get_liked_object_ids
+        add_to_liked_cache
+        remove_from_liked_cache
+        get_cached_likes
+        push_like_to_cache
+        invalidate_likes_cache
+
     Learning note: Why the service not under the api directory?
     Cuz service could used by components more than api, say an async task
     """
@@ -18,11 +51,202 @@ class LikeService(object):
     def has_liked(cls, user, target):
         """
         Check if the user has liked the tweet or comment
+
+        Only asks the liked cache if it is already there: building it loads ALL the likes of the user,
+        too much for one yes/no, a cache miss (or a "maybe") is one point query on the unique index
+        The cache is built by the pages, see get_liked_object_ids
         """
         if user.is_anonymous:
             return False
+        content_type = ContentType.objects.get_for_model(target.__class__)
+        states = cls._check_liked_cache(user.id, content_type.id, [target.id], build=False)
+        if states is not None and states[target.id] != MAYBE_LIKED:
+            return states[target.id] == LIKED
         return Like.objects.filter(
             user=user,
-            content_type=ContentType.objects.get_for_model(target.__class__),
+            content_type=content_type,
             object_id=target.id,
-        ).exists()
\ No newline at end of file
+        ).exists()
+
+    @classmethod
+    def get_liked_object_ids(cls, user, model_class, object_ids):
+        """
+        Which of the objects (tweets or comments) the user has liked
+
+        1. Ask the liked cache of the user in Redis, one script call for all the objects
+           - in the recent likes set: liked
+           - not in the Bloom filter: definitely not liked
+           - Bloom filter positive but not recent: maybe, go to step 2
+        2. Only the "maybe" ones go to DB, in ONE query:
+           SELECT object_id FROM likes_like
+           WHERE user_id = <user_id> AND content_type_id = <id> AND object_id IN (...)
+           Using the unique index (user, content_type, object_id)
+
+        Most of the tweets on a page are not liked by the user, so most of the pages need no SQL at all.
+        Calling has_liked for each object of a page is a N + 1 problem,
+        so the views compute this set once and pass it to the serializers by the context
+        :return: set of the liked object ids
+        """
+        if user.is_anonymous:
+            return set()
+        object_ids = set(object_ids)
+        if not object_ids:
+            return set()
+        content_type = ContentType.objects.get_for_model(model_class)
+        # get_for_model is cached by ContentTypeManager, only the first call hits the DB
+
+        states = cls._check_liked_cache(user.id, content_type.id, object_ids)
+        if states is None:
+            # Someone liked/unliked while the cache was being built, ask DB this time
+            return cls._get_liked_object_ids_from_db(user, content_type, object_ids)
+
+        liked_ids = {object_id for object_id, state in states.items() if state == LIKED}
+        maybe_ids = [object_id for object_id, state in states.items() if state == MAYBE_LIKED]
+        if maybe_ids:
+            liked_ids |= cls._get_liked_object_ids_from_db(user, content_type, maybe_ids)
+        return liked_ids
+
+    @classmethod
+    def _get_liked_object_ids_from_db(cls, user, content_type, object_ids):
+        return set(Like.objects.filter(
+            user=user,
+            content_type=content_type,
+            object_id__in=object_ids,
+        ).values_list('object_id', flat=True))
+
+    @classmethod
+    def get_liked_cache_keys(cls, user_id):
+        """
+        :return: keys of the recent likes zset, the Bloom filter and the version counter
+        """
+        return (
+            USER_LIKES_RECENT_PATTERN.format(user_id=user_id),
+            USER_LIKES_BLOOM_PATTERN.format(user_id=user_id),
+            USER_LIKES_VERSION_PATTERN.format(user_id=user_id),
+        )
+
+    @classmethod
+    def get_liked_member(cls, content_type_id, object_id):
+        return '{}:{}'.format(content_type_id, object_id)
+
+    @classmethod
+    def _check_liked_cache(cls, user_id, content_type_id, object_ids, build=True):
+        """
+        :param build: build the cache on a miss
+        :return: dict, object id -> LIKED/MAYBE_LIKED/NOT_LIKED, None if the cache is not there
+        """
+        recent_key, bloom_key, _ = cls.get_liked_cache_keys(user_id)
+        object_ids = list(object_ids)
+        args = [settings.BLOOM_FILTER_HASHES]
+        for object_id in object_ids:
+            member = cls.get_liked_member(content_type_id, object_id)
+            args.extend([member, *BloomFilter.get_hashes(member)])
+
+        states = RedisScripts.run('check_likes', keys=[recent_key, bloom_key], args=args)
+        if states is None:
+            # Cache miss: build it lazily, then ask again
+            if not build or not cls._build_liked_cache(user_id):
+                return None
+            states = RedisScripts.run('check_likes', keys=[recent_key, bloom_key], args=args)
+            if states is None:
+                return None
+        return dict(zip(object_ids, states))
+
+    @classmethod
+    def _build_liked_cache(cls, user_id):
+        """
+        Load all the likes of the user from DB, build the Bloom filter and the recent likes set
+        The version is read BEFORE loading from DB, if any like/unlike happened after that,
+        the script will not save the (maybe outdated) result
+        :return: True if the cache is there now
+        """
+        keys = cls.get_liked_cache_keys(user_id)
+        connection = RedisClient.get_connection(keys[0])
+        version = connection.get(keys[2])
+
+        likes = Like.objects.filter(user_id=user_id)\
+            .order_by('-created_at')\
+            .values_list('content_type_id', 'object_id', 'created_at')
+        members, recent_args = [], []
+        for content_type_id, object_id, created_at in likes.iterator():
+            member = cls.get_liked_member(content_type_id, object_id)
+            members.append(member)
+            if len(members) <= settings.LIKES_RECENT_LIMIT:
+                recent_args.extend([created_at.timestamp(), member])
+
+        size = BloomFilter.get_size(len(members))
+        args = [
+            version or '',
+            settings.REDIS_KEY_EXPIRE_TIME,
+            BloomFilter.build(members, size),
+            *recent_args,
+        ]
+        built = RedisScripts.run('build_likes_if_unchanged', keys=list(keys), args=args)
+        # 0 could also mean someone else has just built it
+        return bool(built) or connection.exists(keys[1]) == 1
+
+    @classmethod
+    def add_to_liked_cache(cls, like):
+        """
+        Called by the listener of Like, only if the cache of the user is there
+        """
+        if like.user_id is None:
+            return
+        member = cls.get_liked_member(like.content_type_id, like.object_id)
+        RedisScripts.run(
+            'add_like_if_exists',
+            keys=list(cls.get_liked_cache_keys(like.user_id)),
+            args=[
+                member,
+                like.created_at.timestamp(),
+                settings.LIKES_RECENT_LIMIT,
+                settings.REDIS_KEY_EXPIRE_TIME,
+                settings.BLOOM_FILTER_HASHES,
+                *BloomFilter.get_hashes(member),
+            ],
+        )
+
+    @classmethod
+    def remove_from_liked_cache(cls, like):
+        if like.user_id is None:
+            return
+        recent_key, _, version_key = cls.get_liked_cache_keys(like.user_id)
+        RedisScripts.run(
+            'remove_like',
+            keys=[recent_key, version_key],
+            args=[
+                cls.get_liked_member(like.content_type_id, like.object_id),
+                settings.REDIS_KEY_EXPIRE_TIME,
+            ],
+        )
+
+    @classmethod
+    def get_likes_key(cls, content_type_id, object_id):
+        return CacheVersions.format_key(
+            OBJECT_LIKES_PATTERN,
+            Like,
+            content_type_id=content_type_id,
+            object_id=object_id,
+        )
+
+    @classmethod
+    def get_cached_likes(cls, model_class, object_id):
+        """
+        The newest REDIS_LIST_LENGTH_LIMIT likes of a tweet or comment, newest first
+        Same as the tweets of a user: a Redis list, older pages go to DB
+        """
+        content_type_id = ContentType.objects.get_for_model(model_class).id
+        key = cls.get_likes_key(content_type_id, object_id)
+        return RedisHelper.load_objects(key, lazy_load_likes(content_type_id, object_id))
+
+    @classmethod
+    def push_like_to_cache(cls, like):
+        key = cls.get_likes_key(like.content_type_id, like.object_id)
+        RedisHelper.push_object(key, like, lazy_load_likes(like.content_type_id, like.object_id))
+
+    @classmethod
+    def invalidate_likes_cache(cls, like):
+        """
+        An unlike can be anywhere in the list, simply reload the list next time
+        """
+        RedisHelper.invalidate_objects(cls.get_likes_key(like.content_type_id, like.object_id))
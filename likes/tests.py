@@ -0,0 +1,89 @@
+from django.conf import settings
+
+from likes.models import Like
+from likes.services import LikeService
+from testing.testcases import TestCase
+from tweets.models import Tweet
+from utils.backend_calls import BackendCalls
+from utils.bloom_filter import BloomFilter
+from utils.redis_client import RedisClient
+from utils.redis_scripts import RedisScripts
+
+
+class LikeServiceTests(TestCase):
+
+    def setUp(self):
+        super(LikeServiceTests, self).setUp()
+        self.user1 = self.create_user('user1')
+        self.user2 = self.create_user('user2')
+        self.tweets = [self.create_tweet(self.user1) for _ in range(10)]
+
+    def test_liked_cache(self):
+        recent_key, bloom_key, _ = LikeService.get_liked_cache_keys(self.user2.id)
+        conn = RedisClient.get_connection(recent_key)
+        tweet_ids = [tweet.id for tweet in self.tweets]
+        for tweet in self.tweets[:7]:
+            self.create_like(self.user2, tweet)
+        # nothing is cached before the first check
+        self.assertEqual(conn.exists(bloom_key), 0)
+
+        # lazy build, only the newest LIKES_RECENT_LIMIT likes are in the recent set
+        self.assertEqual(
+            LikeService.get_liked_object_ids(self.user2, Tweet, tweet_ids),
+            set(tweet_ids[:7]),
+        )
+        self.assertEqual(conn.exists(bloom_key), 1)
+        self.assertEqual(conn.zcard(recent_key), settings.LIKES_RECENT_LIMIT)
+
+        # recent likes and the definite negatives are answered without DB
+        with BackendCalls.collect() as calls:
+            self.assertEqual(
+                LikeService.get_liked_object_ids(self.user2, Tweet, tweet_ids[5:]),
+                {tweet_ids[5], tweet_ids[6]},
+            )
+        self.assertEqual(calls['sql']['count'], 0)
+        # old likes are only in the Bloom filter, they go to DB
+        self.assertEqual(LikeService.has_liked(self.user2, self.tweets[0]), True)
+
+        # the listeners keep the cache up to date
+        self.create_like(self.user2, self.tweets[9])
+        self.assertEqual(LikeService.has_liked(self.user2, self.tweets[9]), True)
+        Like.objects.filter(user=self.user2, object_id=self.tweets[6].id).delete()
+        self.assertEqual(LikeService.has_liked(self.user2, self.tweets[6]), False)
+        Like.objects.filter(user=self.user2, object_id=self.tweets[0].id).delete()
+        self.assertEqual(LikeService.has_liked(self.user2, self.tweets[0]), False)
+        self.assertEqual(
+            LikeService.get_liked_object_ids(self.user2, Tweet, tweet_ids),
+            set(tweet_ids[1:6]) | {tweet_ids[9]},
+        )
+
+        # a user without any like
+        self.assertEqual(LikeService.get_liked_object_ids(self.user1, Tweet, tweet_ids), set())
+
+    def test_liked_cache_build_race(self):
+        keys = list(LikeService.get_liked_cache_keys(self.user2.id))
+        conn = RedisClient.get_connection(keys[0])
+        # the version was '' when the build read DB, then a like came in
+        self.create_like(self.user2, self.tweets[0])
+        self.assertEqual(conn.get(keys[2]), b'1')
+        size = BloomFilter.get_size(0)
+        built = RedisScripts.run(
+            'build_likes_if_unchanged',
+            keys=keys,
+            args=['', 60, BloomFilter.build([], size)],
+        )
+        # the outdated result (without the new like) is not saved
+        self.assertEqual(built, 0)
+        self.assertEqual(conn.exists(keys[1]), 0)
+        self.assertEqual(LikeService.has_liked(self.user2, self.tweets[0]), True)
+
+    def test_has_liked_without_cache(self):
+        bloom_key = LikeService.get_liked_cache_keys(self.user2.id)[1]
+        for tweet in self.tweets:
+            self.create_like(self.user2, tweet)
+        # a cache miss is one point query, the likes of the user are not loaded for one check
+        with BackendCalls.collect() as calls:
+            self.assertEqual(LikeService.has_liked(self.user2, self.tweets[0]), True)
+            self.assertEqual(LikeService.has_liked(self.user1, self.tweets[0]), False)
+        self.assertEqual(calls['sql']['count'], 2)
+        self.assertEqual(RedisClient.get_connection(bloom_key).exists(bloom_key), 0)
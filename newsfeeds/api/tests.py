@@ -245,4 +245,22 @@ class NewsFeedTestCase(TestCase):
 
         _test_newsfeeds_after_new_feed_pushed()
         self.clear_cache()
-        _test_newsfeeds_after_new_feed_pushed()
\ No newline at end of file
+        _test_newsfeeds_after_new_feed_pushed()
+
+    def test_backend_calls(self):
+        for i in range(EndlessPagination.page_size):
+            tweet = self.create_tweet(self.user2, 'tweet{}'.format(i))
+            self.create_newsfeed(self.user1, tweet)
+
+        # cold cache: no budget check, the caches are filled by this request
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual('sql=' in response['X-Backend-Calls'], True)
+        self.assertEqual('redis;desc=' in response['Server-Timing'], True)
+
+        # warm cache
+        response = self.user1_client.get(NEWSFEEDS_URL)
+        self.assertEqual(len(response.data['results']), EndlessPagination.page_size)
+        self.assertWithinBackendBudget(response)
+        # the newsfeeds are loaded from the redis cache, no HBase scans
+        self.assertEqual(response.backend_calls['hbase']['count'], 0)
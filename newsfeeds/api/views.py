@@ -1,9 +1,11 @@
 from django.utils.decorators import method_decorator
 from gatekeeper.models import GateKeeper
+from likes.services import LikeService
 from newsfeeds.api.serializers import NewsFeedSerializer
 from newsfeeds.models import HBaseNewsFeed, NewsFeed
 from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
+from tweets.models import Tweet
 from rest_framework import viewsets
 from rest_framework.permissions import IsAuthenticated
 from utils.paginations import EndlessPagination
@@ -38,7 +40,13 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
 
         serializer = NewsFeedSerializer(
             page,
-            context = {'request': request},
+            context = {
+                'request': request,
+                # has_liked of all the tweets in this page by one query
+                'liked_tweet_ids': LikeService.get_liked_object_ids(
+                    request.user, Tweet, [newsfeed.tweet_id for newsfeed in page],
+                ),
+            },
             many=True,
         )
         return self.get_paginated_response(serializer.data)
\ No newline at end of file
@@ -3,8 +3,9 @@ from gatekeeper.models import GateKeeper
 from newsfeeds.models import HBaseNewsFeed, NewsFeed
 from newsfeeds.tasks import fanout_newsfeeds_main_task
 from twitter.cache import USER_NEWSFEEDS_PATTERN
+from utils.cache_versions import CacheVersions
 from utils.redis_helper import RedisHelper
-from utils.redis_serializers import HBaseModelSerializer, DjangoModelSerializer
+from utils.shadow_reads import ShadowReads
 
 def lazy_load_newsfeeds(user_id):
     """
@@ -17,9 +18,15 @@ def lazy_load_newsfeeds(user_id):
     Then the function will be actually executed as well as the SQL access.
     """
     def _lazy_load(limit):
-        if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
-            return HBaseNewsFeed.filter(prefix=(user_id,), limit=limit, reverse=True)
-        return NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')[:limit]
+        # Read from both stores for the users in the shadow reads gatekeeper, see utils.shadow_reads
+        return ShadowReads.read(
+            'newsfeeds.list',
+            'switch_newsfeed_to_hbase',
+            user_id,
+            mysql_read=lambda: NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')[:limit],
+            hbase_read=lambda: HBaseNewsFeed.filter(prefix=(user_id,), limit=limit, reverse=True),
+            normalize=lambda newsfeeds: [newsfeed.tweet_id for newsfeed in newsfeeds],
+        )
     return _lazy_load
 
 
@@ -56,17 +63,30 @@ class NewsFeedService(object):
         # This is a synchronous task, user need to wait until the task finish
 
     @classmethod
-    def get_cached_newsfeeds(cls, user_id):
+    def get_newsfeeds_key(cls, user_id):
+        """
+        NewsFeed and HBaseNewsFeed have different fingerprints,
+        so switching the gatekeeper will not read the cache of the other model
+        """
         if GateKeeper.is_switch_on('switch_newsfeed_to_hbase'):
-            serializer = HBaseModelSerializer
+            model_class = HBaseNewsFeed
         else:
-            serializer = DjangoModelSerializer
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(key, lazy_load_newsfeeds(user_id), serializer)
+            model_class = NewsFeed
+        return CacheVersions.format_key(USER_NEWSFEEDS_PATTERN, model_class, user_id=user_id)
+
+    @classmethod
+    def get_cached_newsfeeds(cls, user_id):
+        key = cls.get_newsfeeds_key(user_id)
+        return RedisHelper.load_objects(key, lazy_load_newsfeeds(user_id))
+        # The default serializer supports both NewsFeed and HBaseNewsFeed
 
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+        key = CacheVersions.format_key(
+            USER_NEWSFEEDS_PATTERN,
+            newsfeed.__class__,
+            user_id=newsfeed.user_id,
+        )
         RedisHelper.push_object(key, newsfeed, lazy_load_newsfeeds(newsfeed.user_id))
 
     @classmethod
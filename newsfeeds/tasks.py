@@ -1,4 +1,5 @@
 from celery import shared_task
+from friendships.graph_snapshot import FollowerGraphSnapshot
 from friendships.services import FriendshipService
 from newsfeeds.constants import FANOUT_BATCH_SIZE
 from newsfeeds.models import NewsFeed
@@ -63,12 +64,16 @@ def fanout_newsfeeds_main_task(tweet_id, created_at, tweet_user_id):
         created_at=created_at,
     )
 
-    follower_ids = FriendshipService.get_following_user_ids(tweet_user_id) # Obtain all the follower ids
+    # Obtain all the follower ids, from the mmap-ed snapshot if there is one, no DB call at all
+    follower_ids = FollowerGraphSnapshot.get_follower_ids(tweet_user_id)
+    if follower_ids is None:
+        follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
     index = 0
     while index < len(follower_ids):
         # Call batch tasks, using index to follow task * batch size
         batch_follower_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
-        fanout_newsfeeds_batch_task.delay(tweet_id, created_at, batch_follower_ids)
+        # int(): numpy ints from the snapshot can't be serialized into the message
+        fanout_newsfeeds_batch_task.delay(tweet_id, created_at, [int(i) for i in batch_follower_ids])
         index += FANOUT_BATCH_SIZE
 
     return '{} newsfeeds going to fanout, {} batches created'.format(
@@ -3,7 +3,6 @@ from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from newsfeeds.tasks import fanout_newsfeeds_main_task
 from testing.testcases import TestCase
-from twitter.cache import USER_NEWSFEEDS_PATTERN
 from utils.redis_client import RedisClient
 
 
@@ -44,7 +43,7 @@ class NewsFeedServiceTests(TestCase):
         RedisClient.clear()
         connection = RedisClient.get_connection()
 
-        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.user1.id)
+        key = NewsFeedService.get_newsfeeds_key(self.user1.id)
         self.assertEqual(connection.exists(key), False)
         feed2 = self.create_newsfeed(self.user1, self.create_tweet(self.user1))
         self.assertEqual(connection.exists(key), True)
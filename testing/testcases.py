@@ -13,6 +13,7 @@ from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework.test import APIClient
 from tweets.models import Tweet
+from utils.backend_calls import BackendCalls
 from utils.redis_client import RedisClient
 
 
@@ -83,7 +84,8 @@ class TestCase(DjangoTestCase):
     def create_tweet(self, user, content=None):
         if content is None:
             content = 'default content'
-        return Tweet.objects.create(user=user, content=content)
+        return Tweet.objects.create(user=user, content=content, photo_urls=[])
+        # photo_urls=[]: same as the tweets created by the API
     
     def create_comment(self, user, tweet, content=None):
         if content is None:
@@ -143,4 +145,19 @@ class TestCase(DjangoTestCase):
         )
 
     def create_friendship(self, from_user, to_user):
-        return FriendshipService.follow(from_user.id, to_user.id)
\ No newline at end of file
+        return FriendshipService.follow(from_user.id, to_user.id)
+
+    def assertWithinBackendBudget(self, response, budget=None):
+        """
+        Check the backend calls of a request are within the budget
+
+        :param budget:
+        {backend: max calls}, by default settings.BACKEND_CALL_BUDGETS of the request path
+        """
+        calls = response.backend_calls
+        # set by utils.middlewares.BackendCallsMiddleware
+        if budget is None:
+            budget = BackendCalls.get_budget(response.wsgi_request.path)
+        self.assertIsNotNone(budget, 'No budget for {}'.format(response.wsgi_request.path))
+        over_budget = BackendCalls.get_over_budget(calls, budget)
+        self.assertEqual(over_budget, {}, 'Over budget: {} (calls, limit)'.format(over_budget))
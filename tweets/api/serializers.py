@@ -4,12 +4,17 @@ from rest_framework.exceptions import ValidationError
 
 from accounts.api.serializers import UserSerializerForTweets
 from comments.api.serializers import CommentSerializer
+from comments.services import CommentService
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
-from tweets.constants import TWEET_PHOTOS_UPLOAD_LIMIT
+from tweets.constants import (
+    TWEET_DETAIL_COMMENTS_LIMIT,
+    TWEET_DETAIL_LIKES_LIMIT,
+    TWEET_PHOTOS_UPLOAD_LIMIT,
+)
 from tweets.models import Tweet
 from tweets.services import TweetService
-from utils.redis_helper import RedisHelper
+from utils.counter_helper import CounterHelper
 
 class TweetSerializer(serializers.ModelSerializer):
     user = UserSerializerForTweets(source='cached_user')
@@ -40,6 +45,10 @@ class TweetSerializer(serializers.ModelSerializer):
         )
 
     def get_has_liked(self, obj):
+        # liked_tweet_ids: computed by the view for the whole page, see LikeService.get_liked_object_ids
+        liked_tweet_ids = self.context.get('liked_tweet_ids')
+        if liked_tweet_ids is not None:
+            return obj.id in liked_tweet_ids
         return LikeService.has_liked(self.context['request'].user, obj)
 
     # def get_likes_count(self, obj):
@@ -65,21 +74,30 @@ class TweetSerializer(serializers.ModelSerializer):
     def get_likes_count(self, obj):
         # SELECT COUNT(*) -> Redis Get
         # N + 1 Query: If it is DB query, it is unacceptable, however, Redis query is OK
-        return RedisHelper.get_count(obj, 'likes_count')
+        return CounterHelper.get_count(obj, 'likes_count')
     
     def get_comments_count(self, obj):
-        return RedisHelper.get_count(obj, 'comments_count')
+        return CounterHelper.get_count(obj, 'comments_count')
     
     def get_photo_urls(self, obj):
-        photo_urls = []
-        for photo in obj.tweetphoto_set.all().order_by('order'):
-            photo_urls.append(photo.file.url)
-        return photo_urls
+        # Before: a SELECT of the photos and building their urls for each tweet
+        # Now: denormalized in the tweet, see TweetService.refresh_photo_urls
+        if obj.photo_urls is None:
+            # tweets created before photo_urls and not backfilled yet, computed but not saved:
+            # a GET never writes, run `python manage.py backfill_tweet_photo_urls` to fill them
+            # Signed: their photos could still be private objects
+            return TweetService.get_photo_urls(obj, signed=True)
+        return obj.photo_urls
 
 
 class TweetSerializerForDetail(TweetSerializer):
-    comments = CommentSerializer(source='comment_set', many=True)
-    likes = LikeSerializer(source='like_set', many=True)
+    comments = serializers.SerializerMethodField()
+    # Before: CommentSerializer(source='comment_set', many=True), ALL the comments of the tweet
+    # Now: the newest TWEET_DETAIL_COMMENTS_LIMIT comments from the cache, comments_count for the total
+    likes = serializers.SerializerMethodField()
+    # Before: LikeSerializer(source='like_set', many=True), ALL the likes of the tweet
+    # Now: only the newest TWEET_DETAIL_LIKES_LIMIT likes from the cache, likes_count for the total
+    # the others are in GET /api/likes/?content_type=tweet&object_id=<id>
     
     class Meta:
         """
@@ -101,6 +119,17 @@ class TweetSerializerForDetail(TweetSerializer):
             'photo_urls',
         )
 
+    def get_comments(self, obj):
+        # The view passes the comments it already loaded for has_liked
+        comments = self.context.get('comments')
+        if comments is None:
+            comments = CommentService.get_cached_comments(obj.id)[:TWEET_DETAIL_COMMENTS_LIMIT]
+        return CommentSerializer(comments, many=True, context=self.context).data
+
+    def get_likes(self, obj):
+        likes = LikeService.get_cached_likes(Tweet, obj.id)[:TWEET_DETAIL_LIKES_LIMIT]
+        return LikeSerializer(likes, many=True).data
+
     # Another way to define is to use the serializer method:
     # comments = serializers.SerializerMethodField()
     # def get_comments(self, obj):
@@ -138,7 +167,8 @@ class TweetSerializerForCreate(serializers.ModelSerializer):
     def create(self, validated_data):
         user = self.context['request'].user
         content = validated_data['content']
-        tweet = Tweet.objects.create(user=user, content=content)
+        tweet = Tweet.objects.create(user=user, content=content, photo_urls=[])
+        # photo_urls is filled by create_photos_from_files if there are photos
         # First: create the tweet
         if validated_data.get('files'):
             TweetService.create_photos_from_files(
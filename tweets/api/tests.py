@@ -1,7 +1,9 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APIClient
 
+from comments.services import CommentService
 from testing.testcases import TestCase
+from tweets.api.serializers import TweetSerializerForDetail
 from tweets.models import Tweet, TweetPhoto
 from utils.paginations import EndlessPagination
 
@@ -97,6 +99,14 @@ class TweetApiTests(TestCase):
         response = self.anonymous_client.get(url)
         self.assertEqual(len(response.data['comments']), 2)
 
+        # The serializer takes the comments loaded by the view rather than reading the cache again
+        comments = CommentService.get_cached_comments(tweet.id)
+        data = TweetSerializerForDetail(tweet, context={
+            'request': response.wsgi_request,
+            'comments': comments[:1],
+        }).data
+        self.assertEqual([comment['id'] for comment in data['comments']], [comments[0].id])
+
     def test_create_with_files(self):
         # Positive test: Create a tweet with without file arrtibute
         # To compatible old version API
@@ -1,4 +1,7 @@
+from comments.models import Comment
+from comments.services import CommentService
 from django.utils.decorators import method_decorator
+from likes.services import LikeService
 from newsfeeds.services import NewsFeedService
 from ratelimit.decorators import ratelimit
 from rest_framework import viewsets
@@ -9,6 +12,7 @@ from tweets.api.serializers import (
     TweetSerializerForCreate,
     TweetSerializerForDetail,
 )
+from tweets.constants import TWEET_DETAIL_COMMENTS_LIMIT
 from tweets.models import Tweet
 from tweets.services import TweetService
 from utils.decorators import required_params
@@ -35,10 +39,24 @@ class TweetViewSet(viewsets.GenericViewSet):
         GET /api/tweets/{pk}
         """
         tweet = self.get_object()
+        # The cached comments are loaded ONCE, the serializer gets them from the context
+        comments = CommentService.get_cached_comments(tweet.id)[:TWEET_DETAIL_COMMENTS_LIMIT]
         # MUST have queryset defined in the viewset
         return Response(TweetSerializerForDetail(
             tweet, 
-            context={'request': request},
+            context={
+                'request': request,
+                'comments': comments,
+                # has_liked of the tweet and its comments: 2 batches rather than 1 + n
+                'liked_tweet_ids': LikeService.get_liked_object_ids(
+                    request.user, Tweet, [tweet.id],
+                ),
+                'liked_comment_ids': LikeService.get_liked_object_ids(
+                    request.user,
+                    Comment,
+                    [comment.id for comment in comments],
+                ),
+            },
         ).data)
     
     @required_params(method='get', params=['user_id'])
@@ -63,7 +81,12 @@ class TweetViewSet(viewsets.GenericViewSet):
         serializer = TweetSerializer(
             page, 
             many=True,              # many: a list of dict
-            context={'request': request},
+            context={
+                'request': request,
+                'liked_tweet_ids': LikeService.get_liked_object_ids(
+                    request.user, Tweet, [tweet.id for tweet in page],
+                ),
+            },
         ) 
 
         return self.get_paginated_response(serializer.data) 
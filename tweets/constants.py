@@ -19,4 +19,9 @@ TWEET_PHOTO_STATUS_CHOICES = (
 # First level touple means the choices you can make
 # Second level touple means (value of this choice, information in admin panel) 
 
-TWEET_PHOTOS_UPLOAD_LIMIT = 4
\ No newline at end of file
+TWEET_PHOTOS_UPLOAD_LIMIT = 4
+
+# Only the newest likes are embedded in the tweet detail, the rest are in GET /api/likes/
+TWEET_DETAIL_LIKES_LIMIT = 20
+# Same for the comments, the rest are in GET /api/comments/
+TWEET_DETAIL_COMMENTS_LIMIT = 20
@@ -3,4 +3,14 @@ def push_tweet_to_cache(sender, instance, created, **kwargs):
     Push a tweet to the cache
     """
     from tweets.services import TweetService
-    TweetService.push_tweet_to_cache(instance)
\ No newline at end of file
+    TweetService.push_tweet_to_cache(instance)
+
+
+def refresh_photo_urls(sender, instance, **kwargs):
+    """
+    A photo is changed (e.g. status) or deleted, recompute the photo urls of its tweet
+    """
+    if instance.tweet_id is None:
+        return
+    from tweets.services import TweetService
+    TweetService.refresh_photo_urls(instance.tweet)
@@ -0,0 +1,75 @@
+"""
+Fill tweet.photo_urls of the tweets created before it was added
+
+The serializer never writes on a GET: until a tweet is backfilled, its photo urls are
+computed (and signed) for each read, one SELECT of the photos. Run this once after the migration:
+    python manage.py backfill_tweet_photo_urls
+
+The photos uploaded before PublicPhotoStorage are private objects, they are made public-read
+here before their plain urls are saved, otherwise the urls would return 403.
+
+The tweets are read in id order, batch size tweets at a time, with one SELECT for the photos of the batch.
+Only the tweets with photo_urls still NULL are touched, so an interrupted backfill can be run again.
+"""
+from django.core.management.base import BaseCommand, CommandError
+from tweets.models import Tweet, TweetPhoto
+from tweets.services import TweetService
+from tweets.storages import make_photo_public
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_helper import RedisHelper
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = 'Fill photo_urls of the tweets created before it was added'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError('--batch-size should be positive')
+
+        last_id, filled = 0, 0
+        while True:
+            tweets = list(
+                Tweet.objects.filter(id__gt=last_id, photo_urls__isnull=True)
+                .order_by('id')
+                .values_list('id', 'user_id')[:batch_size]
+            )
+            if not tweets:
+                break
+            last_id = tweets[-1][0]
+            filled += self.backfill_batch(tweets)
+        self.stdout.write('{} tweets backfilled'.format(filled))
+
+    def backfill_batch(self, tweets):
+        """
+        :param tweets: list of (tweet id, user id)
+        :return: number of tweets filled
+        """
+        tweet_ids = [tweet_id for tweet_id, _ in tweets]
+        photo_urls = {tweet_id: [] for tweet_id in tweet_ids}
+        photos = TweetPhoto.objects.filter(tweet_id__in=tweet_ids).order_by('tweet_id', 'order')
+        for photo in photos:
+            if photo.file:
+                make_photo_public(photo.file)
+                photo_urls[photo.tweet_id].append(photo.file.url)
+
+        # Most of the tweets have no photo, they are done by one UPDATE
+        Tweet.objects.filter(
+            id__in=[tweet_id for tweet_id, urls in photo_urls.items() if not urls],
+            photo_urls__isnull=True,
+        ).update(photo_urls=[])
+        for tweet_id, urls in photo_urls.items():
+            if urls:
+                Tweet.objects.filter(id=tweet_id).update(photo_urls=urls)
+
+        # The cached copies still have photo_urls None, same as TweetService.refresh_photo_urls
+        for tweet_id in tweet_ids:
+            MemcachedHelper.invalidate_object(Tweet, tweet_id)
+        for user_id in {user_id for _, user_id in tweets}:
+            RedisHelper.invalidate_objects(TweetService.get_user_tweets_key(user_id))
+        return len(tweets)
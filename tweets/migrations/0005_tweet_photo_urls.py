@@ -0,0 +1,18 @@
+# Generated by Django 3.2.19 on 2026-10-19 11:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0004_auto_20240516_0052'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tweet',
+            name='photo_urls',
+            field=models.JSONField(null=True),
+        ),
+    ]
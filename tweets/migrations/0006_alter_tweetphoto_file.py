@@ -0,0 +1,19 @@
+# Generated by Django 3.2.19 on 2026-10-19 15:02
+
+from django.db import migrations, models
+import tweets.storages
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tweets', '0005_tweet_photo_urls'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='tweetphoto',
+            name='file',
+            field=models.FileField(storage=tweets.storages.get_photo_storage, upload_to=''),
+        ),
+    ]
@@ -30,6 +30,12 @@ class Tweet(models.Model):
     # Then how about the likes_count and comments_count for existing tweets?
     # We need to have an another script to fill the number one by one to avoid table lock.
 
+    photo_urls = models.JSONField(null=True)
+    # Denormalized urls of the photos, in their order
+    # Before: every tweet in a timeline runs SELECT ... FROM tweets_tweetphoto and builds the url of each file
+    # Now: computed when the photos are uploaded or changed, see TweetService.refresh_photo_urls
+    # null: not computed yet (tweets created before this column), filled when it is serialized
+
     class Meta:
         index_together = (('user', 'created_at'),)
         # This way to create a compound index
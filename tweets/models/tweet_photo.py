@@ -1,6 +1,9 @@
 from django.contrib.auth.models import User
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from tweets.constants import TWEET_PHOTO_STATUS_CHOICES, TweetPhotoStatus
+from tweets.listeners import refresh_photo_urls
+from tweets.storages import get_photo_storage
 
 from .tweet import Tweet
 # You can only use reletive reference in this case to avoid circular import
@@ -18,8 +21,8 @@ class TweetPhoto(models.Model):
     # Here we provided a better way to query
     # We can know who sent this photo directly rather than join two tables which could causing performance issue
 
-    file = models.FileField()
-    # Image file
+    file = models.FileField(storage=get_photo_storage)
+    # Image file, plain (unsigned) urls, see tweets.storages
     order = models.IntegerField(default=0)
     # The order of photo in a tweet
 
@@ -57,4 +60,10 @@ class TweetPhoto(models.Model):
         )
 
     def __str__(self):
-        return f'{self.created_at} {self.tweet_id}: {self.user} {self.file}'
\ No newline at end of file
+        return f'{self.created_at} {self.tweet_id}: {self.user} {self.file}'
+
+
+post_save.connect(refresh_photo_urls, sender=TweetPhoto)
+post_delete.connect(refresh_photo_urls, sender=TweetPhoto)
+# post_delete rather than pre_delete: the photo should be gone when the urls are computed
+# bulk_create sends no signal, TweetService.create_photos_from_files refreshes the urls by itself
@@ -1,5 +1,8 @@
 from tweets.models import Tweet, TweetPhoto
+from tweets.storages import get_signed_photo_url
 from twitter.cache import USER_TWEETS_PATTERN
+from utils.cache_versions import CacheVersions
+from utils.memcached_helper import MemcachedHelper
 from utils.redis_helper import RedisHelper
 
 
@@ -22,13 +25,52 @@ class TweetService(object):
             )
             photos.append(photo)
         TweetPhoto.objects.bulk_create(photos)
+        cls.refresh_photo_urls(tweet)
+
+    @classmethod
+    def get_photo_urls(cls, tweet, signed=False):
+        """
+        Compute the urls of the photos, nothing is saved
+        signed: for the tweets not backfilled yet, their photos could still be private objects
+        (uploaded before PublicPhotoStorage), a plain url would return 403
+        """
+        return [
+            get_signed_photo_url(photo.file) if signed else photo.file.url
+            for photo in TweetPhoto.objects.filter(tweet_id=tweet.id).order_by('order')
+            if photo.file
+        ]
+
+    @classmethod
+    def refresh_photo_urls(cls, tweet):
+        """
+        Compute the urls of the photos and save them into tweet.photo_urls
+        Building a url is not cheap with S3 storage, so it is done here once rather than for each request
+        :return: the photo urls
+        """
+        if tweet.photo_urls is None:
+            # not backfilled yet, the photos may be private, leave them to backfill_tweet_photo_urls
+            # the reads sign the urls until then, see TweetSerializer.get_photo_urls
+            return cls.get_photo_urls(tweet, signed=True)
+        photo_urls = cls.get_photo_urls(tweet)
+        Tweet.objects.filter(id=tweet.id).update(photo_urls=photo_urls)
+        # update() rather than save(): no post_save, the tweet is not pushed to the cache again
+        tweet.photo_urls = photo_urls
+
+        # The tweet is also cached in memcached and in the tweets list of its user
+        MemcachedHelper.invalidate_object(Tweet, tweet.id)
+        RedisHelper.invalidate_objects(cls.get_user_tweets_key(tweet.user_id))
+        return photo_urls
+
+    @classmethod
+    def get_user_tweets_key(cls, user_id):
+        return CacheVersions.format_key(USER_TWEETS_PATTERN, Tweet, user_id=user_id)
 
     @classmethod
     def get_cached_tweets(cls, user_id):
-        key = USER_TWEETS_PATTERN.format(user_id=user_id)
+        key = cls.get_user_tweets_key(user_id)
         return RedisHelper.load_objects(key, lazy_load_tweets(user_id))
     
     @classmethod
     def push_tweet_to_cache(cls, tweet):
-        key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
+        key = cls.get_user_tweets_key(tweet.user_id)
         RedisHelper.push_object(key, tweet, lazy_load_tweets(tweet.user_id))
\ No newline at end of file
@@ -0,0 +1,45 @@
+from django.conf import settings
+from django.core.files.storage import default_storage
+from storages.backends.s3boto3 import S3Boto3Storage
+
+S3_STORAGE = 'storages.backends.s3boto3.S3Boto3Storage'
+
+
+class PublicPhotoStorage(S3Boto3Storage):
+    """
+    Storage of the tweet photos only, the other files (e.g. avatars) still get signed urls
+
+    The photo urls are saved in Tweet.photo_urls (see TweetService.refresh_photo_urls),
+    a signed url expires (1 hour by default), so these ones are plain urls.
+    The photos are uploaded as public-read objects, the rest of the bucket can stay private
+    """
+    querystring_auth = False
+    default_acl = 'public-read'
+
+    def make_public(self, name):
+        """
+        The photos uploaded before this storage are private objects, their plain urls return 403,
+        see backfill_tweet_photo_urls
+        """
+        name = self._normalize_name(self._clean_name(name))
+        self.bucket.Object(name).Acl().put(ACL=self.default_acl)
+
+
+def get_photo_storage():
+    # Called once when TweetPhoto is loaded, the tests use the file system storage
+    if settings.DEFAULT_FILE_STORAGE != S3_STORAGE:
+        return default_storage
+    return PublicPhotoStorage()
+
+
+def make_photo_public(file):
+    # Nothing to do for the other storages, e.g. the file system storage of the tests
+    if isinstance(file.storage, PublicPhotoStorage):
+        file.storage.make_public(file.name)
+
+
+def get_signed_photo_url(file):
+    """
+    Url of a photo that may still be private, signed by the default storage (expires, never save it)
+    """
+    return default_storage.url(file.name)
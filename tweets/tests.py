@@ -1,12 +1,18 @@
 from datetime import timedelta
+from io import StringIO
 
-from django.test import TestCase
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from storages.backends.s3boto3 import S3Boto3Storage
 
 from testing.testcases import TestCase
+from tweets.api.serializers import TweetSerializer
 from tweets.constants import TWEET_PHOTO_STATUS_CHOICES, TweetPhotoStatus
 from tweets.models import Tweet, TweetPhoto
 from tweets.services import TweetService
-from twitter.cache import USER_TWEETS_PATTERN
+from tweets.storages import PublicPhotoStorage, S3_STORAGE, get_photo_storage
+from utils.memcached_helper import MemcachedHelper
 from utils.redis_client import RedisClient
 from utils.redis_serializers import DjangoModelSerializer
 from utils.time_helper import utc_now
@@ -53,6 +59,75 @@ class TweetTests(TestCase):
         self.assertEqual(self.tweet.tweetphoto_set.count(), 1)
         # reverse query: lowercase of the table name plus _set
 
+    def test_photo_urls(self):
+        # tweets created before photo_urls: computed when serialized, but only saved by the backfill
+        Tweet.objects.filter(id=self.tweet.id).update(photo_urls=None)
+        self.tweet.refresh_from_db()
+        self.assertIsNone(self.tweet.photo_urls)
+        self.assertEqual(TweetSerializer().get_photo_urls(self.tweet), [])
+        self.tweet.refresh_from_db()
+        self.assertIsNone(self.tweet.photo_urls)
+        call_command('backfill_tweet_photo_urls', stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.photo_urls, [])
+
+        photos = [
+            TweetPhoto.objects.create(
+                user=self.user1,
+                tweet=self.tweet,
+                file=SimpleUploadedFile('photo{}.png'.format(i), b'photo'),
+                order=i,
+            )
+            for i in range(2)
+        ]
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.photo_urls, [photo.file.url for photo in photos])
+
+        # the backfill reads the photos of a whole batch at once
+        Tweet.objects.filter(id=self.tweet.id).update(photo_urls=None)
+        call_command('backfill_tweet_photo_urls', batch_size=1, stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.photo_urls, [photo.file.url for photo in photos])
+
+        # the cached tweet and the tweets list of the user are refreshed too
+        TweetService.get_cached_tweets(self.user1.id)
+        photos[0].status = TweetPhotoStatus.APPROVED
+        photos[0].save()
+        photos[0].delete()
+        self.assertEqual(
+            MemcachedHelper.get_object_through_cache(Tweet, self.tweet.id).photo_urls,
+            [photos[1].file.url],
+        )
+        self.assertEqual(
+            TweetService.get_cached_tweets(self.user1.id)[0].photo_urls,
+            [photos[1].file.url],
+        )
+
+    def test_photo_urls_not_backfilled(self):
+        Tweet.objects.filter(id=self.tweet.id).update(photo_urls=None)
+        self.tweet.refresh_from_db()
+        photo = TweetPhoto.objects.create(
+            user=self.user1,
+            tweet=self.tweet,
+            file=SimpleUploadedFile('photo.png', b'photo'),
+        )
+        # the photo may still be private, its url is not saved until the backfill makes it public
+        self.tweet.refresh_from_db()
+        self.assertIsNone(self.tweet.photo_urls)
+        self.assertEqual(TweetSerializer().get_photo_urls(self.tweet), [default_storage.url(photo.file.name)])
+        call_command('backfill_tweet_photo_urls', stdout=StringIO())
+        self.tweet.refresh_from_db()
+        self.assertEqual(self.tweet.photo_urls, [photo.file.url])
+
+    def test_photo_storage(self):
+        with self.settings(DEFAULT_FILE_STORAGE=S3_STORAGE):
+            storage = get_photo_storage()
+            # only the tweet photos get plain urls, the other files (avatars) are still signed
+            self.assertIsInstance(storage, PublicPhotoStorage)
+            self.assertEqual(storage.querystring_auth, False)
+            self.assertEqual(S3Boto3Storage().querystring_auth, True)
+        self.assertIs(get_photo_storage(), default_storage)
+
     def test_cache_tweet_in_redis(self):
         """
         This function is testing the basic usage of get a tweet from Redis 
@@ -110,7 +185,7 @@ class TweetServiceTests(TestCase):
         RedisClient.clear()
         connection = RedisClient.get_connection()
 
-        key = USER_TWEETS_PATTERN.format(user_id=self.user1.id)
+        key = TweetService.get_user_tweets_key(self.user1.id)
         self.assertEqual(connection.exists(key), False)
         tweet2 = self.create_tweet(self.user1, 'tweet2')
         self.assertEqual(connection.exists(key), True)
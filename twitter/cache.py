@@ -1,8 +1,13 @@
-# memcached: for firendships - followings
-FOLLOWING_PATTERN = 'followings:{user_id}'
+# redis: for firendships - followings set of a user
+# {followings:id} is the hash tag, the set and its version counter are on the same node
+FOLLOWING_SET_PATTERN = '{{followings:{user_id}}}:set'
+FOLLOWING_VERSION_PATTERN = '{{followings:{user_id}}}:version'
+# follower/following counts of a user: {name} is followers or followings
+FRIENDSHIP_COUNT_PATTERN = '{{friendship_counts:{user_id}}}:{name}_count'
+FRIENDSHIP_COUNTS_VERSION_PATTERN = '{{friendship_counts:{user_id}}}:version'
 # Why this constant?
 # This is to define the key format of your requests
-# As memcached is just like a hash table in the memory
+# As Redis and memcached are just like hash tables in the memory
 # You need to define the globally unique key for the cache operations
 # 
 # Why not followers?
@@ -14,9 +19,33 @@ FOLLOWING_PATTERN = 'followings:{user_id}'
 # This is because:
 # 1. memcached is not natively support for set, so it is better to save objects
 # 2. User and Profile model will not be changed so easily, therefore, it can have a over 98% hit rate
+# So the followings are a Redis set: follow/unfollow is a SADD/SREM instead of dropping the whole list,
+# and SMISMEMBER checks only the users on a page
 
-USER_PROFILE_PATTERN = 'user_profile:{user_id}'
+# The followers are only cached for the users with not too many of them (MUTUAL_FOLLOWERS_SET_LIMIT),
+# for SINTER with the following set, see FriendshipService.get_mutual_followers
+FOLLOWER_SET_PATTERN = '{{followers:{user_id}}}:set'
+FOLLOWER_VERSION_PATTERN = '{{followers:{user_id}}}:version'
+
+USER_PROFILE_PATTERN = 'user_profile:{version}:{user_id}'
 
 # redis
-USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
-USER_NEWSFEEDS_PATTERN = 'newsfeeds:{user_id}'
\ No newline at end of file
+USER_TWEETS_PATTERN = 'user_tweets:{version}:{user_id}'
+USER_NEWSFEEDS_PATTERN = 'newsfeeds:{version}:{user_id}'
+# newest likes of a tweet or comment
+OBJECT_LIKES_PATTERN = 'likes:{version}:{content_type_id}:{object_id}'
+# newest comments of a tweet
+TWEET_COMMENTS_PATTERN = 'tweet_comments:{version}:{tweet_id}'
+# liked objects of a user, {user_likes:id} is the hash tag, so the 3 keys are on the same node
+# and can be used in one Lua script
+USER_LIKES_RECENT_PATTERN = '{{user_likes:{user_id}}}:recent'
+USER_LIKES_BLOOM_PATTERN = '{{user_likes:{user_id}}}:bloom'
+USER_LIKES_VERSION_PATTERN = '{{user_likes:{user_id}}}:version'
+# follows/unfollows of a user since the last follower graph snapshot,
+# see friendships.graph_snapshot.FollowerGraphSnapshot.record_delta
+FOLLOWER_DELTAS_PATTERN = 'follower_deltas:{user_id}'
+# who to follow, built by friendships.recommendations.FollowSuggestions every day
+FOLLOW_SUGGESTIONS_PATTERN = 'follow_suggestions:{user_id}'
+
+# {version}: schema fingerprint of the cached model, see utils.cache_versions.CacheVersions
+# Use CacheVersions.format_key(PATTERN, model_class, ...) to get the keys
\ No newline at end of file
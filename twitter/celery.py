@@ -18,6 +18,8 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.autodiscover_tasks()
 # Mainly for this line
 # registered Django apps means INSTALLED_APPS in settings
+app.autodiscover_tasks(['utils'])
+# utils is not a django app, but has the tasks of utils.counter_helper
 
 @app.task(bind=True, ignore_result=True)
 def debug_task(self):
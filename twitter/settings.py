@@ -10,10 +10,12 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+from celery.schedules import crontab
 from kombu import Queue
 from pathlib import Path
 import sys
 import os
+import tempfile
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -79,6 +81,7 @@ REST_FRAMEWORK = {
 }
 
 MIDDLEWARE = [
+    'utils.middlewares.BackendCallsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -193,6 +196,9 @@ if TESTING:
     # 1. To save the time of the unit time
     # 2. Causing unexpected error due to the 3rd party 
     # That's why Unit test should not have external dependencies such as AWS
+    MEDIA_ROOT = os.path.join(tempfile.gettempdir(), 'django-twitter-test-media')
+    # The files uploaded by the tests go to a temp dir, rather than the working tree
+    # (MEDIA_ROOT is not set above, FileSystemStorage would save them into the current directory)
 AWS_STORAGE_BUCKET_NAME = 'django-twitter'
 AWS_S3_REGION_NAME = 'ap-tokyo-1'
 # Also, you need to add the AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY
@@ -230,8 +236,79 @@ REDIS_HOST = '127.0.0.1'
 REDIS_PORT = 6379
 REDIS_DB = 0 if TESTING else 1
 # DB names of Redis are integer, there is no character-based names for it
+
+# Cache nodes, keys are sharded onto them by consistent hashing, see utils.redis_client.RedisClient
+# Add more nodes to scale the timeline cache horizontally, e.g.
+# {'host': '10.0.0.2', 'port': 6379, 'db': 1},
+# NOTE: Celery broker is NOT sharded, it still uses REDIS_HOST below
+REDIS_NODES = [
+    {'host': REDIS_HOST, 'port': REDIS_PORT, 'db': REDIS_DB},
+]
+REDIS_VIRTUAL_NODES = 160
+# Every node has its own connection pool with these settings
+REDIS_CONNECTION_POOL = {
+    'max_connections': 64,
+    'socket_timeout': 1,
+    'socket_connect_timeout': 1,
+    'health_check_interval': 30,
+    'retry_on_timeout': True,
+}
 REDIS_KEY_EXPIRE_TIME = 3600 * 24 * 7
 REDIS_LIST_LENGTH_LIMIT = 100 if not TESTING else 20
+# How to serialize objects in the Redis lists, see utils.redis_serializers.SERIALIZERS
+# 'json': readable, 'compact': msgpack, smaller and faster
+REDIS_CACHE_SERIALIZER = 'compact'
+# Cache stampede protection, see utils.redis_helper.RedisHelper.load_objects
+# Only one loader can hold the lock of a key, the lock will expire automatically if the loader crashed
+REDIS_CACHE_FILL_LOCK_TIMEOUT = 10
+# How long (in seconds) the others wait for the loader before they go to DB by themselves
+REDIS_CACHE_FILL_WAIT_TIME = 2 if not TESTING else 0.2
+REDIS_CACHE_FILL_POLL_INTERVAL = 0.05
+# A loader reads the DB again if a push landed while it was reading, at most this many times
+REDIS_CACHE_FILL_ATTEMPTS = 3
+# beta > 1 favors refreshing earlier, beta < 1 favors refreshing later
+REDIS_EARLY_REFRESH_BETA = 1.0
+# Write-behind counters, see utils.counter_helper.CounterHelper
+# Pending deltas are split into this many Redis hashes by object id
+COUNTER_PENDING_BUCKETS = 16
+COUNTER_FLUSH_LOCK_TIMEOUT = 60
+# Liked objects of each user, see likes.services.LikeService.get_liked_object_ids
+# Newest likes kept in the recent set, older ones are only in the Bloom filter
+LIKES_RECENT_LIMIT = 1000 if not TESTING else 5
+# see utils.bloom_filter.BloomFilter, about 1% false positive rate
+BLOOM_FILTER_BITS_PER_ITEM = 10
+BLOOM_FILTER_HASHES = 7
+BLOOM_FILTER_MIN_BITS = 8192
+# Shadow reads of the MySQL -> HBase migrations, see utils.shadow_reads.ShadowReads
+SHADOW_READS_MAX_WORKERS = 4
+# Shadow reads waiting for a worker, more than this are dropped rather than queued
+SHADOW_READS_MAX_PENDING = 100
+# Upper bounds (ms) of the latency histogram buckets
+SHADOW_READS_LATENCY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+# Same as CELERY_TASK_ALWAYS_EAGER, the tests run the shadow reads in the request thread
+SHADOW_READS_SYNC = TESTING
+# Follower graph snapshot for the fanout workers, see friendships.graph_snapshot.FollowerGraphSnapshot
+# None: no snapshot, the follows/unfollows are not logged either
+FOLLOWER_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshots') if not TESTING else None
+# How long (in seconds) the follows/unfollows stay in the delta log
+# It must cover the time between two snapshots (1 hour) and the build, a snapshot older than this is not used
+FOLLOWER_SNAPSHOT_DELTA_TTL = 3 * 3600
+# How often (in seconds) a worker checks if there is a new snapshot
+FOLLOWER_SNAPSHOT_CHECK_INTERVAL = 60
+# Clocks of the servers could be this many seconds apart
+FOLLOWER_SNAPSHOT_CLOCK_SKEW = 60
+# Who to follow, see friendships.recommendations.FollowSuggestions
+# How many suggestions are saved for each user
+FOLLOW_SUGGESTIONS_LIMIT = 100
+# How many users are scored by one sparse matrix product
+FOLLOW_SUGGESTIONS_BLOCK_SIZE = 1000
+# Rebuilt every day, the suggestions of a user are kept for 2 days in case a build fails
+FOLLOW_SUGGESTIONS_EXPIRE_TIME = 3600 * 24 * 2
+# Mutual followers, see friendships.services.FriendshipService.get_mutual_followers
+# Users with at most this many followers have their followers cached in a Redis set, intersected in Redis
+MUTUAL_FOLLOWERS_SET_LIMIT = 10000 if not TESTING else 5
+# Otherwise the smaller side is read this many users at a time
+MUTUAL_FOLLOWERS_CHUNK_SIZE = 1000 if not TESTING else 2
 
 # Celery
 CELERY_BROKER_URL = 'redis://{}:{}/{}'.format(REDIS_HOST, REDIS_PORT, "2") \
@@ -279,6 +356,32 @@ if os.getenv('WORKER_TYPE') == 'everything':
 # Celery can be directly executed using command line for workers:
 #   celery -A twitter worker -l info
 
+# Periodic tasks, run by: celery -A twitter beat -l info
+CELERY_BEAT_SCHEDULE = {
+    'flush-counters': {
+        'task': 'utils.tasks.flush_counters_task',
+        'schedule': 10.0,
+        # seconds, how long likes_count/comments_count in the DB could be behind Redis
+    },
+    'reconcile-counters': {
+        'task': 'utils.tasks.reconcile_counters_task',
+        'schedule': crontab(hour=4, minute=0),
+    },
+    'reconcile-friendship-counts': {
+        'task': 'friendships.tasks.reconcile_friendship_counts_task',
+        'schedule': crontab(hour=4, minute=30),
+    },
+    'build-follower-snapshot': {
+        'task': 'friendships.tasks.build_follower_snapshot_task',
+        'schedule': crontab(minute=15),
+        # every hour, FOLLOWER_SNAPSHOT_DELTA_TTL must be longer than this
+    },
+    'build-follow-suggestions': {
+        'task': 'friendships.tasks.build_follow_suggestions_task',
+        'schedule': crontab(hour=5, minute=0),
+    },
+}
+
 
 # Rate Limit
 RATELIMIT_USER_CACHE = 'ratelimit'
@@ -293,6 +396,21 @@ RATELIMIT_ENABLE = not TESTING
 # HBase
 HBASE_HOST = '127.0.0.1'
 
+
+# Backend call accounting, see utils.middlewares.BackendCallsMiddleware
+# Out of production, the counts and latencies are in the response headers
+# In production, they are written to the log
+BACKEND_CALLS_IN_HEADERS = os.getenv('ENVIRONMENT', 'DEV') != 'PROD'
+# Max calls to each backend for one request, matched by the longest path prefix
+# Over budget requests are logged as warnings, and tests can assert them
+# see testing.testcases.TestCase.assertWithinBackendBudget
+# Measured for a page of 20 with warm caches, most of the redis/memcached calls are per-tweet (counters, tweets, users)
+# /api/tweets/ also covers POST (tweet, photos, fanout), so its sql budget is looser
+BACKEND_CALL_BUDGETS = {
+    '/api/newsfeeds/': {'sql': 5, 'redis': 50, 'memcached': 65, 'hbase': 5},
+    '/api/tweets/': {'sql': 25, 'redis': 50, 'memcached': 65, 'hbase': 5},
+}
+
 # This is how to import local settings in django
 try:
     from .local_settings import *
@@ -0,0 +1,242 @@
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.db import connections
+import contextvars
+import redis
+import time
+
+# How many calls a request made to each backend, and how long they took
+#
+# Why contextvars rather than a global dict?
+# One process could serve many requests at the same time (threads of gunicorn),
+# a context variable is separated for each thread (and each asyncio task),
+# so the calls of one request will not be counted into another one.
+# Out of a request (celery tasks, shell), there is no context, nothing will be recorded.
+_backend_calls = contextvars.ContextVar('backend_calls', default=None)
+
+
+class BackendCalls:
+    BACKENDS = ('sql', 'redis', 'memcached', 'hbase')
+
+    @classmethod
+    def start(cls):
+        """
+        Start counting for the current request
+        :return: token to stop counting
+        """
+        return _backend_calls.set({
+            backend: {'count': 0, 'time': 0.0}
+            for backend in cls.BACKENDS
+        })
+
+    @classmethod
+    def stop(cls, token):
+        """
+        :return: the calls of the request, {backend: {'count': int, 'time': seconds}}
+        """
+        calls = _backend_calls.get()
+        _backend_calls.reset(token)
+        return calls
+
+    @classmethod
+    def get_calls(cls):
+        return _backend_calls.get()
+
+    @classmethod
+    @contextmanager
+    def collect(cls):
+        """
+        Count the calls inside the with block, including the SQL queries
+            with BackendCalls.collect() as calls:
+                ...
+        """
+        token = cls.start()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(cls.sql_wrapper))
+                yield _backend_calls.get()
+        finally:
+            cls.stop(token)
+
+    @classmethod
+    def record(cls, backend, seconds, count=1):
+        calls = _backend_calls.get()
+        if calls is None:
+            return
+        calls[backend]['count'] += count
+        calls[backend]['time'] += seconds
+
+    @classmethod
+    @contextmanager
+    def track(cls, backend, count=1):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.record(backend, time.perf_counter() - start, count)
+
+    @classmethod
+    def sql_wrapper(cls, execute, sql, params, many, context):
+        """
+        Used by connection.execute_wrapper(), called for every query sent to the DB
+        https://docs.djangoproject.com/en/3.2/topics/db/instrumentation/
+        """
+        with cls.track('sql'):
+            return execute(sql, params, many, context)
+
+    @classmethod
+    def get_budget(cls, path):
+        """
+        The budget with the longest prefix matching the path, or None
+        """
+        matched = None
+        for prefix in settings.BACKEND_CALL_BUDGETS:
+            if path.startswith(prefix) and (matched is None or len(prefix) > len(matched)):
+                matched = prefix
+        if matched is None:
+            return None
+        return settings.BACKEND_CALL_BUDGETS[matched]
+
+    @classmethod
+    def get_over_budget(cls, calls, budget):
+        """
+        :return: {backend: (count, limit)} for the backends called more than the budget
+        """
+        if not budget:
+            return {}
+        return {
+            backend: (calls[backend]['count'], limit)
+            for backend, limit in budget.items()
+            if calls[backend]['count'] > limit
+        }
+
+
+class InstrumentedPipeline(redis.client.Pipeline):
+    """
+    Commands of a pipeline are sent in one round-trip, so it is counted as one call
+    """
+
+    def execute(self, raise_on_error=True):
+        with BackendCalls.track('redis'):
+            return super().execute(raise_on_error)
+
+
+class InstrumentedRedis(redis.Redis):
+    """
+    Every command goes through execute_command, including the ones used by locks and scripts
+    """
+
+    def execute_command(self, *args, **options):
+        with BackendCalls.track('redis'):
+            return super().execute_command(*args, **options)
+
+    def pipeline(self, transaction=True, shard_hint=None):
+        return InstrumentedPipeline(
+            self.connection_pool,
+            self.response_callbacks,
+            transaction,
+            shard_hint,
+        )
+
+
+class InstrumentedCache:
+    """
+    Wrap a django cache, e.g. cache = InstrumentedCache(caches['default'])
+    Every method call (get, set, get_many, delete...) is one call to memcached
+    """
+
+    def __init__(self, cache):
+        self._cache = cache
+
+    def __getattr__(self, name):
+        attr = getattr(self._cache, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            with BackendCalls.track('memcached'):
+                return attr(*args, **kwargs)
+        return method
+
+
+class InstrumentedHBaseBatch:
+    """
+    put/delete of a batch are buffered locally, only send() talks to HBase
+    """
+
+    def __init__(self, batch):
+        self._batch = batch
+
+    def __getattr__(self, name):
+        return getattr(self._batch, name)
+
+    def send(self):
+        with BackendCalls.track('hbase'):
+            return self._batch.send()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # same as happybase.Batch: only send when there is no exception (transaction=False)
+        with BackendCalls.track('hbase'):
+            return self._batch.__exit__(exc_type, exc_value, traceback)
+
+
+class InstrumentedHBaseTable:
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getattr__(self, name):
+        attr = getattr(self._table, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            with BackendCalls.track('hbase'):
+                return attr(*args, **kwargs)
+        return method
+
+    def scan(self, *args, **kwargs):
+        # scan() returns a generator, the rows are fetched from HBase while iterating it
+        # so we count the time of the whole iteration as one call
+        # (only the time waiting for the rows, not the time spent by the caller between them)
+        rows = iter(self._table.scan(*args, **kwargs))
+        elapsed = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    row = next(rows)
+                except StopIteration:
+                    break
+                finally:
+                    elapsed += time.perf_counter() - start
+                yield row
+        finally:
+            BackendCalls.record('hbase', elapsed)
+
+    def batch(self, *args, **kwargs):
+        return InstrumentedHBaseBatch(self._table.batch(*args, **kwargs))
+
+
+class InstrumentedHBaseConnection:
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __getattr__(self, name):
+        attr = getattr(self._connection, name)
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kwargs):
+            with BackendCalls.track('hbase'):
+                return attr(*args, **kwargs)
+        return method
+
+    def table(self, name, *args, **kwargs):
+        # table() only creates a local object, no call to HBase
+        return InstrumentedHBaseTable(self._connection.table(name, *args, **kwargs))
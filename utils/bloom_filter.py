@@ -0,0 +1,65 @@
+import hashlib
+
+from django.conf import settings
+
+
+class BloomFilter:
+    """
+    Bloom filter saved as a Redis bitmap (a string, SETBIT/GETBIT)
+
+    A Bloom filter answers "is x in the set?" with:
+    - NO: x is definitely not in the set
+    - MAYBE: x is probably in the set, false positive rate is about (1 - e^(-kn/m))^k
+      m: number of bits, n: number of items, k: number of hash functions
+    Items can be added but never removed, a removed item is still MAYBE.
+
+    With 10 bits per item and k = 7, the false positive rate is about 1%,
+    100k items only take 125KB.
+
+    The k positions of an item are h1 + i * h2 (i = 0..k-1), mod m (double hashing),
+    h1 and h2 come from one md5, so only one hash is computed for each item.
+    The positions are computed in the same way in Python (here) and in Lua (utils.redis_scripts),
+    m is always a power of 2 and a multiple of 8, so it can be read back from STRLEN * 8.
+    """
+
+    @classmethod
+    def get_size(cls, count):
+        """
+        Number of bits for `count` items, doubled as the headroom for the items added later
+        """
+        bits = max(
+            settings.BLOOM_FILTER_MIN_BITS,
+            count * settings.BLOOM_FILTER_BITS_PER_ITEM * 2,
+        )
+        return 1 << (bits - 1).bit_length()
+
+    @classmethod
+    def get_hashes(cls, item):
+        digest = hashlib.md5(item.encode('utf-8')).hexdigest()
+        # h2 is odd, so the k positions are all different when m is a power of 2
+        return int(digest[:8], 16), int(digest[8:16], 16) | 1
+
+    @classmethod
+    def get_positions(cls, item, size):
+        h1, h2 = cls.get_hashes(item)
+        return [(h1 + i * h2) % size for i in range(settings.BLOOM_FILTER_HASHES)]
+
+    @classmethod
+    def build(cls, items, size):
+        """
+        :return: the bitmap as bytes, which can be SET into Redis directly
+        """
+        bitmap = bytearray(size // 8)
+        for item in items:
+            for position in cls.get_positions(item, size):
+                # bit 0 of Redis bitmaps is the highest bit of the first byte
+                bitmap[position >> 3] |= 0x80 >> (position & 7)
+        return bytes(bitmap)
+
+    @classmethod
+    def contains(cls, bitmap, item):
+        size = len(bitmap) * 8
+        return all(
+            bitmap[position >> 3] & (0x80 >> (position & 7))
+            for position in cls.get_positions(item, size)
+        )
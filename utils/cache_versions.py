@@ -0,0 +1,72 @@
+import hashlib
+
+import django
+from django.conf import settings
+from django_hbase.models import HBaseModel
+
+
+class CacheVersions:
+    """
+    Schema fingerprints of the models saved in the cache
+
+    Why?
+    Cached objects are saved in a certain format, say, the field list of Tweet when they were cached.
+    If we add a field to Tweet, or change the serializer, the new code cannot read the old cache any more.
+    Flushing the whole cache while deploying is risky: 
+    all the requests go to DB at the same time, a cold cache storm.
+
+    So we put a fingerprint of the model schema into the cache key:
+        user_tweets:1 -> user_tweets:3f2a9c01:1
+    After the model or the serializer changed, the fingerprint changes,
+    new code reads and writes the new keys, and the old keys will age out by their TTL.
+    No flushdb is needed, and the keys of the unchanged models stay warm.
+    """
+
+    fingerprints = {}
+    # (model_class, serializer_name) -> fingerprint, computed once per process
+
+    @classmethod
+    def get_field_spec(cls, model_class):
+        """
+        A list of strings describing the fields that are saved in the cache
+        """
+        if issubclass(model_class, HBaseModel):
+            return [
+                '{}:{}:{}:{}'.format(key, field.field_type, field.reverse, field.column_family)
+                for key, field in model_class.get_field_hash().items()
+            ]
+        return [
+            '{}:{}'.format(field.attname, field.get_internal_type())
+            for field in model_class._meta.concrete_fields
+        ]
+
+    @classmethod
+    def get_fingerprint(cls, model_class, serializer_name=None):
+        """
+        :param serializer_name: how the objects are serialized in the cache
+        by default it is settings.REDIS_CACHE_SERIALIZER for the Redis lists,
+        use 'pickle' for memcached, which is how django cache saves objects
+        """
+        if serializer_name is None:
+            serializer_name = settings.REDIS_CACHE_SERIALIZER
+        cache_key = (model_class, serializer_name)
+        if cache_key in cls.fingerprints:
+            return cls.fingerprints[cache_key]
+        spec = [model_class.__name__, serializer_name] + cls.get_field_spec(model_class)
+        if serializer_name == 'pickle':
+            # Pickled django models are bound to the django version
+            spec.append(django.get_version())
+        fingerprint = hashlib.sha1(','.join(spec).encode('utf-8')).hexdigest()[:8]
+        # 8 hex digits are enough to tell the versions of a model apart
+        cls.fingerprints[cache_key] = fingerprint
+        return fingerprint
+
+    @classmethod
+    def format_key(cls, pattern, model_class, serializer_name=None, **kwargs):
+        """
+        CacheVersions.format_key(USER_TWEETS_PATTERN, Tweet, user_id=1)
+        """
+        return pattern.format(
+            version=cls.get_fingerprint(model_class, serializer_name),
+            **kwargs
+        )
@@ -0,0 +1,315 @@
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Count, F
+from redis.exceptions import LockError
+from utils.redis_client import RedisClient
+from utils.redis_scripts import RedisScripts
+
+
+class CounterHelper:
+    """
+    Write-behind counters, e.g. likes_count and comments_count of the tweets, likes_count of the comments
+
+    Why not UPDATE likes_count = likes_count + 1 for each like?
+    The UPDATE locks the row of the tweet until the transaction ends,
+    for a viral tweet, thousands of likes are waiting for the same row lock one by one.
+
+    How it works:
+    1. like/comment: only Redis is changed, by one script (RedisScripts 'change_count')
+       - HINCRBY the delta into the pending hash: field '{model label}:{id}:{attr}'
+       - INCRBY the cached count if it is in the cache (what the users see)
+    2. every 10 seconds (CELERY_BEAT_SCHEDULE), flush_counters_task moves the pending deltas to MySQL,
+       all the likes of a tweet since the last flush become ONE update: likes_count = likes_count + 1000
+    3. cache miss of a count: MySQL value + the deltas not flushed yet
+    4. reconcile_counters_task recomputes the counts from the likes/comments table,
+       to fix the drift of the DB and of the cached counts caused by a crashed flush, etc.
+
+    The pending deltas are split into COUNTER_PENDING_BUCKETS hashes by object id,
+    so they are sharded onto all the Redis nodes, and each bucket is flushed on its own.
+    The cached counts carry the hash tag of their bucket, so one script can change both.
+    """
+
+    @classmethod
+    def get_count_key(cls, obj, attr):
+        """
+        This class method is to compose the key for likes_count or comments_count ...
+        Structure is {counters:bucket}:{class/model name}.{attribute(which count)}:{object id}
+        The hash tag puts the count on the node of the pending hash of its bucket
+        """
+        return '{{counters:{}}}:{}.{}:{}'.format(
+            cls.get_bucket(obj.id),
+            obj.__class__.__name__,
+            attr,
+            obj.id,
+        )
+
+    @classmethod
+    def get_field(cls, model_class, object_id, attr):
+        return '{}:{}:{}'.format(model_class._meta.label, object_id, attr)
+
+    @classmethod
+    def get_bucket(cls, object_id):
+        return object_id % settings.COUNTER_PENDING_BUCKETS
+
+    @classmethod
+    def get_pending_key(cls, bucket):
+        # {counters:n}: hash tag, pending, flushing and lock of a bucket are on the same node
+        return '{{counters:{}}}:pending'.format(bucket)
+
+    @classmethod
+    def get_flushing_key(cls, bucket):
+        return '{{counters:{}}}:flushing'.format(bucket)
+
+    @classmethod
+    def get_flush_lock_key(cls, bucket):
+        return '{{counters:{}}}:lock'.format(bucket)
+
+    @classmethod
+    def get_flush_lock(cls, bucket):
+        """
+        Held by the flush of the bucket, and by reconcile while it fixes the counters of the bucket
+        """
+        return RedisClient.get_connection(cls.get_pending_key(bucket)).lock(
+            cls.get_flush_lock_key(bucket),
+            timeout=settings.COUNTER_FLUSH_LOCK_TIMEOUT,
+        )
+
+    @classmethod
+    def get_pending_deltas(cls, model_class, attr, object_ids):
+        """
+        Deltas not in the DB yet, including the ones being flushed right now
+        :return: dict, object id -> delta
+        """
+        pipeline = RedisClient.pipeline(transaction=False)
+        for object_id in object_ids:
+            field = cls.get_field(model_class, object_id, attr)
+            bucket = cls.get_bucket(object_id)
+            pipeline.hget(cls.get_pending_key(bucket), field)
+            pipeline.hget(cls.get_flushing_key(bucket), field)
+        results = pipeline.execute()
+        return {
+            object_id: int(results[2 * i] or 0) + int(results[2 * i + 1] or 0)
+            for i, object_id in enumerate(object_ids)
+        }
+
+    @classmethod
+    def _fill_count(cls, obj, attr):
+        """
+        Back fill the cached count: DB (the flushed part) + the pending deltas
+        SET NX + EX in one command: if someone else has just filled it, don't overwrite
+        """
+        model_class = obj.__class__
+        key = cls.get_count_key(obj, attr)
+        db_count = model_class.objects.filter(id=obj.id).values_list(attr, flat=True).first()
+        # values_list rather than refresh_from_db, obj could be shared by others (e.g. from memcached)
+        count = (db_count or 0) + cls.get_pending_deltas(model_class, attr, [obj.id])[obj.id]
+        connection = RedisClient.get_connection(key)
+        connection.set(key, count, ex=settings.REDIS_KEY_EXPIRE_TIME, nx=True)
+        return count
+
+    @classmethod
+    def _change_count(cls, obj, attr, amount):
+        count = RedisScripts.run(
+            'change_count',
+            keys=[cls.get_pending_key(cls.get_bucket(obj.id)), cls.get_count_key(obj, attr)],
+            args=[cls.get_field(obj.__class__, obj.id, attr), amount],
+        )
+        # pending delta + exists + incr in one atomic script
+        if count is not None:
+            return count
+        # cache miss: the delta above is already pending, so fill = DB + pending, no extra +1
+        return cls._fill_count(obj, attr)
+
+    @classmethod
+    def increase_count(cls, obj, attr):
+        return cls._change_count(obj, attr, 1)
+
+    @classmethod
+    def decrease_count(cls, obj, attr):
+        return cls._change_count(obj, attr, -1)
+
+    @classmethod
+    def get_count(cls, obj, attr):
+        key = cls.get_count_key(obj, attr)
+        count = RedisClient.get_connection(key).get(key)
+        if count is not None:
+            return int(count)
+        return cls._fill_count(obj, attr)
+
+    @classmethod
+    def flush(cls, buckets=None):
+        """
+        Write the pending deltas into the DB
+        :return: number of counters flushed
+        """
+        if buckets is None:
+            buckets = range(settings.COUNTER_PENDING_BUCKETS)
+        return sum(cls._flush_bucket(bucket) for bucket in buckets)
+
+    @classmethod
+    def _flush_bucket(cls, bucket):
+        pending_key = cls.get_pending_key(bucket)
+        flushing_key = cls.get_flushing_key(bucket)
+        connection = RedisClient.get_connection(pending_key)
+
+        # Only one flusher for a bucket, the others skip it
+        lock = cls.get_flush_lock(bucket)
+        if not lock.acquire(blocking=False):
+            return 0
+        try:
+            if not connection.exists(flushing_key):
+                # A flushing hash still there means the last flush crashed, flush it first
+                if not connection.exists(pending_key):
+                    return 0
+                connection.rename(pending_key, flushing_key)
+                # RENAME is atomic: new deltas go to a new pending hash from now on
+            deltas = connection.hgetall(flushing_key)
+            cls._apply_deltas(deltas)
+            connection.delete(flushing_key)
+            # If we crash between the DB commit and this line, the deltas will be applied twice,
+            # reconcile will fix them
+            return len(deltas)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # The lock expired, someone else might have got it
+                pass
+
+    @classmethod
+    def _apply_deltas(cls, deltas):
+        """
+        Coalesce the deltas: objects with the same (model, attr, delta) are updated by ONE query
+        UPDATE tweets_tweet SET likes_count = likes_count + 1 WHERE id IN (...)
+        """
+        groups = {}
+        for field, delta in deltas.items():
+            label, object_id, attr = field.decode('utf-8').split(':')
+            delta = int(delta)
+            if delta == 0:
+                continue
+            groups.setdefault((label, attr, delta), []).append(int(object_id))
+
+        with transaction.atomic():
+            for (label, attr, delta), object_ids in groups.items():
+                model_class = apps.get_model(label)
+                model_class.objects.filter(id__in=sorted(object_ids)).update(**{
+                    attr: F(attr) + delta,
+                })
+                # sorted: rows are always locked in the same order, no deadlock between transactions
+
+    @classmethod
+    def get_sources(cls):
+        """
+        Where the counters can be recomputed from
+        (model class, attr) -> (queryset of the source rows, field of the object id in the source rows)
+        """
+        from comments.models import Comment
+        from likes.models import Like
+        from tweets.models import Tweet
+
+        return {
+            (Tweet, 'likes_count'): (
+                Like.objects.filter(content_type=ContentType.objects.get_for_model(Tweet)),
+                'object_id',
+            ),
+            (Tweet, 'comments_count'): (Comment.objects.all(), 'tweet_id'),
+            (Comment, 'likes_count'): (
+                Like.objects.filter(content_type=ContentType.objects.get_for_model(Comment)),
+                'object_id',
+            ),
+        }
+
+    @classmethod
+    def reconcile(cls, batch_size=1000):
+        """
+        Recompute the counters from the source rows, fix the DB and drop the wrong cached counts
+        :return: number of counters fixed
+        """
+        cls.flush()
+        fixed = 0
+        for (model_class, attr), source in cls.get_sources().items():
+            last_id = 0
+            while True:
+                object_ids = list(
+                    model_class.objects.filter(id__gt=last_id)
+                    .order_by('id')
+                    .values_list('id', flat=True)[:batch_size]
+                )
+                if not object_ids:
+                    break
+                last_id = object_ids[-1]
+                buckets = {}
+                for object_id in object_ids:
+                    buckets.setdefault(cls.get_bucket(object_id), []).append(object_id)
+                for bucket, bucket_object_ids in sorted(buckets.items()):
+                    fixed += cls._reconcile_bucket(bucket, model_class, attr, source, bucket_object_ids)
+        return fixed
+
+    @classmethod
+    def _reconcile_bucket(cls, bucket, model_class, attr, source, object_ids):
+        """
+        Fix the counters of object_ids, all in this bucket, under the flush lock of the bucket:
+        expected DB value = count of the source rows - pending deltas, a flush running in between
+        would move the pending deltas into the DB, and they would be subtracted twice (or dropped)
+        :return: number of counters fixed
+        """
+        lock = cls.get_flush_lock(bucket)
+        if not lock.acquire(blocking=True, blocking_timeout=settings.COUNTER_FLUSH_LOCK_TIMEOUT):
+            # A flush is stuck on this bucket, the next reconcile will do it
+            return 0
+        try:
+            source_queryset, source_field = source
+            pending_before = cls.get_pending_deltas(model_class, attr, object_ids)
+            counts = dict(
+                source_queryset.filter(**{source_field + '__in': object_ids})
+                .order_by()
+                .values_list(source_field)
+                .annotate(count=Count('id'))
+            )
+            pending_deltas = cls.get_pending_deltas(model_class, attr, object_ids)
+            # Read in the lock, no flush can change them now
+            db_counts = model_class.objects.filter(id__in=object_ids).values_list('id', attr)
+            cached_counts = cls._get_cached_counts(model_class, attr, object_ids)
+            fixed = 0
+            for object_id, db_count in db_counts:
+                if pending_deltas[object_id] != pending_before[object_id]:
+                    # Liked/unliked while counting, can't tell if the source rows have it, next time
+                    continue
+                count = counts.get(object_id, 0)
+                expected = count - pending_deltas[object_id]
+                cached_count = cached_counts[object_id]
+                if db_count == expected and cached_count in (None, count):
+                    continue
+                if db_count != expected:
+                    model_class.objects.filter(id=object_id).update(**{attr: expected})
+                # The cached count is dropped even when the DB is right,
+                # e.g. filled between the DB commit of a flush and the delete of its flushing hash,
+                # the deltas were counted twice, and SET NX never overwrites it
+                # A like between the count above and now drops a right one, only costs a fill
+                key = cls.get_count_key(model_class(id=object_id), attr)
+                RedisClient.get_connection(key).delete(key)
+                fixed += 1
+            return fixed
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # The lock expired, a flush might have got it
+                pass
+
+    @classmethod
+    def _get_cached_counts(cls, model_class, attr, object_ids):
+        """
+        :return: dict, object id -> cached count, None if not in the cache
+        """
+        pipeline = RedisClient.pipeline(transaction=False)
+        for object_id in object_ids:
+            pipeline.get(cls.get_count_key(model_class(id=object_id), attr))
+        results = pipeline.execute()
+        return {
+            object_id: None if result is None else int(result)
+            for object_id, result in zip(object_ids, results)
+        }
@@ -1,3 +1,18 @@
+from django.db import transaction
+
+
 def invalidate_object_cache(sender, instance, **kwargs):
     from utils.memcached_helper import MemcachedHelper
-    MemcachedHelper.invalidate_object(sender, instance.id)
\ No newline at end of file
+    MemcachedHelper.invalidate_object(sender, instance.id)
+
+
+def run_now_and_on_commit(func, *args):
+    """
+    post_save/pre_delete run BEFORE the transaction commits (e.g. get_or_create and delete are atomic).
+    A cache filled from DB between the signal and the commit would miss this change,
+    so the change is applied to the cache again after the commit.
+    Only for idempotent changes (invalidation, ZADD/SETBIT/ZREM), a LPUSH would be done twice.
+    """
+    func(*args)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: func(*args))
@@ -1,7 +1,9 @@
 from django.conf import settings
 from django.core.cache import caches
+from utils.backend_calls import InstrumentedCache
+from utils.cache_versions import CacheVersions
 
-cache = caches['testing'] if settings.TESTING else caches['default']
+cache = InstrumentedCache(caches['testing'] if settings.TESTING else caches['default'])
 
 class MemcachedHelper:
     """
@@ -16,7 +18,12 @@ class MemcachedHelper:
 
     @classmethod
     def get_keys(cls, model_class, object_id):
-        return '{}:{}'.format(model_class.__name__, object_id)
+        # The schema fingerprint is in the key, so objects pickled by an older model will not be read
+        return '{}:{}:{}'.format(
+            model_class.__name__,
+            CacheVersions.get_fingerprint(model_class, 'pickle'),
+            object_id,
+        )
     
     @classmethod
     def get_object_through_cache(cls, model_class, object_id):
@@ -44,6 +51,33 @@ class MemcachedHelper:
         # A 5xx error will be reported here if None returned
         return object
     
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        Batch version of get_object_through_cache, for the objects of a page
+        ONE get_many to memcached, ONE IN query for the cache misses, ONE set_many to fill them,
+        rather than a get (and maybe a SELECT) for each object
+        :return: dict, object id -> object, the ids not in the DB are not in it
+        """
+        keys = {
+            object_id: cls.get_keys(model_class, object_id)
+            for object_id in set(object_ids)
+        }
+        if not keys:
+            return {}
+        cached = cache.get_many(list(keys.values()))
+        objects = {
+            object_id: cached[key]
+            for object_id, key in keys.items()
+            if key in cached
+        }
+        missing_ids = [object_id for object_id in keys if object_id not in objects]
+        if missing_ids:
+            loaded = {obj.id: obj for obj in model_class.objects.filter(id__in=missing_ids)}
+            cache.set_many({keys[object_id]: obj for object_id, obj in loaded.items()})
+            objects.update(loaded)
+        return objects
+    
     @classmethod
     def invalidate_object(cls, model_class, object_id):
         key = cls.get_keys(model_class, object_id)
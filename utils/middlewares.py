@@ -0,0 +1,69 @@
+from django.conf import settings
+from utils.backend_calls import BackendCalls
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BackendCallsMiddleware:
+    """
+    Count the calls to MySQL, Redis, memcached and HBase of each request, and how long they took
+
+    Out of production: totals are in the response headers, e.g.
+        X-Backend-Calls: sql=3, redis=2, memcached=21, hbase=0
+        Server-Timing: sql;desc="3 calls";dur=1.52, redis;desc="2 calls";dur=0.31, ...
+    Server-Timing is shown by the Network panel of the browser dev tools.
+
+    In production: totals are written to the log as one JSON line for each request,
+    which can be collected by the log/metrics pipeline.
+
+    Requests over the budget in settings.BACKEND_CALL_BUDGETS are logged as warnings in any environment.
+
+    Put it at the top of the MIDDLEWARE so the calls of other middlewares (sessions, auth) are counted too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with BackendCalls.collect() as calls:
+            response = self.get_response(request)
+
+        response.backend_calls = calls
+        # for tests, see testing.testcases.TestCase.assertWithinBackendBudget
+        over_budget = BackendCalls.get_over_budget(calls, BackendCalls.get_budget(request.path))
+
+        if settings.BACKEND_CALLS_IN_HEADERS:
+            response['X-Backend-Calls'] = ', '.join(
+                '{}={}'.format(backend, calls[backend]['count'])
+                for backend in BackendCalls.BACKENDS
+            )
+            response['Server-Timing'] = ', '.join(
+                '{};desc="{} calls";dur={:.2f}'.format(
+                    backend,
+                    calls[backend]['count'],
+                    calls[backend]['time'] * 1000,
+                )
+                for backend in BackendCalls.BACKENDS
+            )
+        else:
+            logger.info(json.dumps({
+                'event': 'backend_calls',
+                'method': request.method,
+                'path': request.path,
+                'query': request.META.get('QUERY_STRING', ''),
+                'user_id': request.user.id if getattr(request, 'user', None) else None,
+                'status': response.status_code,
+                'calls': calls,
+                # same format as the input of benchmarks.replay, so the log can be replayed
+            }))
+
+        if over_budget:
+            logger.warning(json.dumps({
+                'event': 'backend_calls_over_budget',
+                'method': request.method,
+                'path': request.path,
+                'over_budget': over_budget,
+            }))
+        return response
@@ -1,26 +1,191 @@
+import bisect
+import hashlib
+
 from django.conf import settings
+from redis.exceptions import ResponseError
+from utils.backend_calls import InstrumentedRedis
 import redis
 
+
 class RedisClient:
-    connection = None
-    # variable here will be shared by the whole class
+    """
+    Redis client routing keys to the nodes in settings.REDIS_NODES
+
+    Why sharding?
+    One Redis instance holds all the timelines, counters and gatekeepers of the site.
+    Memory and throughput of one instance are limited, 
+    so we split the keys onto several nodes, each node only holds part of the keys.
+
+    How to find the node of a key? Consistent hashing:
+    Every node is put on a hash ring for REDIS_VIRTUAL_NODES times,
+    a key goes to the first node clockwise from hash(key) on the ring.
+    When a node is added or removed, only ~1/N of the keys move to another node,
+    rather than almost all of them with hash(key) % N.
+
+    Hash tags: if a key contains {...}, only the part inside the braces is hashed (same as Redis Cluster)
+    So {user_tweets:1}:delta and user_tweets:1 are always on the same node,
+    which means they can be used in one pipeline, transaction or Lua script.
+    """
+    connections = None
+    # one redis.Redis per node, each node has its own connection pool
+    ring = None
+    # sorted list of (hash, node index)
+    unsupported_commands = set()
+    # (node index, command) unknown to the server of the node, see call_or_fallback
 
     @classmethod
-    def get_connection(cls):
-        if cls.connection:
-            return cls.connection
+    def _get_connections(cls):
+        if cls.connections:
+            return cls.connections
         # singleton style: only one "instance" for the whole class
         # 
         # Why singleton?
         # Our normal request is like: request -> web server 1 process -> response to client
         # inside the 1 web server process, there are many redis get/set
         # So, most of the remote service will use singleton to reuse the connection within the process
-        cls.connection = redis.Redis(
-            host=settings.REDIS_HOST, 
-            port=settings.REDIS_PORT,
-            db=settings.REDIS_DB,
+        cls.connections = [
+            InstrumentedRedis(connection_pool=redis.ConnectionPool(
+                host=node['host'],
+                port=node['port'],
+                db=node.get('db', 0),
+                **settings.REDIS_CONNECTION_POOL
+            ))
+            for node in settings.REDIS_NODES
+        ]
+        return cls.connections
+
+    @classmethod
+    def _hash(cls, value):
+        return int(hashlib.md5(value.encode('utf-8')).hexdigest()[:16], 16)
+
+    @classmethod
+    def _get_ring(cls):
+        if cls.ring:
+            return cls.ring
+        ring = []
+        for index, node in enumerate(settings.REDIS_NODES):
+            node_name = '{}:{}/{}'.format(node['host'], node['port'], node.get('db', 0))
+            for i in range(settings.REDIS_VIRTUAL_NODES):
+                ring.append((cls._hash('{}#{}'.format(node_name, i)), index))
+        ring.sort()
+        cls.ring = ring
+        return ring
+
+    @classmethod
+    def get_hash_key(cls, key):
+        """
+        The part of the key used for hashing, the content of the first non-empty {...}
+        """
+        if isinstance(key, bytes):
+            key = key.decode('utf-8')
+        key = str(key)
+        start = key.find('{')
+        if start != -1:
+            end = key.find('}', start + 1)
+            if end > start + 1:
+                return key[start + 1:end]
+        return key
+
+    @classmethod
+    def get_node_index(cls, key):
+        if len(settings.REDIS_NODES) == 1:
+            return 0
+        ring = cls._get_ring()
+        position = bisect.bisect(ring, (cls._hash(cls.get_hash_key(key)),))
+        if position == len(ring):
+            # Back to the beginning of the ring
+            position = 0
+        return ring[position][1]
+
+    @classmethod
+    def get_connection(cls, key=None):
+        """
+        Get the connection of the node holding this key
+        Without key, return the connection of the first node
+        """
+        connections = cls._get_connections()
+        if key is None:
+            return connections[0]
+        return connections[cls.get_node_index(key)]
+
+    @classmethod
+    def pipeline(cls, transaction=True):
+        """
+        A pipeline grouping the commands by node, see ShardedPipeline
+        """
+        return ShardedPipeline(transaction=transaction)
+
+    @classmethod
+    def group_keys_by_node(cls, keys):
+        """
+        :return: dict, node index -> keys on this node
+        """
+        groups = {}
+        for key in keys:
+            groups.setdefault(cls.get_node_index(key), []).append(key)
+        return groups
+
+    @classmethod
+    def call_or_fallback(cls, key, command, call, fallback):
+        """
+        Some commands are newer than the Redis of docker.sh (4.0), e.g. SMISMEMBER (6.2), SINTERCARD (7.0)
+        Try call(connection) first, if the server of the node doesn't know the command,
+        remember it and use fallback(connection) for this node from now on
+        """
+        index = cls.get_node_index(key)
+        connection = cls.get_connection(key)
+        if (index, command) not in cls.unsupported_commands:
+            try:
+                return call(connection)
+            except ResponseError as e:
+                if not str(e).lower().startswith('unknown command'):
+                    raise
+                cls.unsupported_commands.add((index, command))
+        return fallback(connection)
+
+    @classmethod
+    def smismember(cls, key, members):
+        """
+        :return: list, truthy for each member in the set
+        Older servers: SISMEMBER of each member in one pipeline, still one round-trip
+        """
+        def fallback(connection):
+            pipeline = connection.pipeline(transaction=False)
+            for member in members:
+                pipeline.sismember(key, member)
+            return pipeline.execute()
+
+        return cls.call_or_fallback(
+            key,
+            'SMISMEMBER',
+            lambda connection: connection.smismember(key, members),
+            fallback,
+        )
+
+    @classmethod
+    def sintercard(cls, keys):
+        """
+        Size of the intersection, the keys must be on the same node
+        Older servers: SINTER, the members are sent back only to be counted
+        """
+        return cls.call_or_fallback(
+            keys[0],
+            'SINTERCARD',
+            lambda connection: connection.sintercard(len(keys), keys),
+            lambda connection: len(connection.sinter(*keys)),
         )
-        return cls.connection
+
+    @classmethod
+    def reset(cls):
+        """
+        Drop the connections, say, in a forked process, or after the nodes are changed
+        """
+        if cls.connections:
+            for connection in cls.connections:
+                connection.connection_pool.disconnect()
+        cls.connections = None
+        cls.ring = None
+        cls.unsupported_commands = set()
     
     @classmethod
     def clear(cls):
@@ -31,5 +196,45 @@ class RedisClient:
         """
         if not settings.TESTING:
             raise Exception("You can not flush redis in production environment")
-        connection = cls.get_connection()
-        connection.flushdb()
\ No newline at end of file
+        for connection in cls._get_connections():
+            connection.flushdb()
+
+
+class ShardedPipeline:
+    """
+    A pipeline for keys on multiple nodes.
+
+    Each command is routed by its first argument (the key) to the pipeline of that node.
+    execute() sends one batch per node, then puts the results back into the order of the commands.
+    Commands with multiple keys (say delete(key1, key2)) must have all the keys on the same node,
+    use hash tags to make sure of it.
+
+    transaction=True: MULTI/EXEC on each node, it is NOT a transaction across the nodes
+    """
+
+    def __init__(self, transaction=True):
+        self.transaction = transaction
+        self.pipelines = {}
+        # node index -> redis pipeline
+        self.commands = []
+        # (node index, position in the pipeline of that node)
+
+    def __getattr__(self, name):
+        def command(key, *args, **kwargs):
+            index = RedisClient.get_node_index(key)
+            if index not in self.pipelines:
+                self.pipelines[index] = RedisClient.get_connection(key).pipeline(
+                    transaction=self.transaction,
+                )
+            pipeline = self.pipelines[index]
+            getattr(pipeline, name)(key, *args, **kwargs)
+            self.commands.append((index, len(pipeline) - 1))
+            return self
+        return command
+
+    def execute(self):
+        results = {
+            index: pipeline.execute()
+            for index, pipeline in self.pipelines.items()
+        }
+        return [results[index][position] for index, position in self.commands]
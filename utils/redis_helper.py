@@ -1,140 +1,256 @@
+import math
+import random
+import time
+
 from django.conf import settings
+from redis.exceptions import LockError
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer, HBaseModelSerializer
-from django_hbase.models import HBaseModel
+from utils.redis_scripts import RedisScripts
+from utils.redis_serializers import SchemaMismatchError, get_serializer
 
 class RedisHelper:
 
     @classmethod
-    def _load_object_to_cache(cls, key, objects, serializer):
+    def get_delta_key(cls, key):
+        """
+        Meta key saving how long (in seconds) it took to load the list from DB last time.
+
+        It is also a marker saying "this key has been loaded", 
+        so an empty result (e.g. a user without any tweets) will not go to DB again and again.
+        Redis will delete a list once it becomes empty, so we cannot tell that from the list itself.
+        """
+        return '{{{}}}:delta'.format(key)
+        # {key}: hash tag, so the meta key is always on the same node as the key
+
+    @classmethod
+    def get_lock_key(cls, key):
+        return '{{{}}}:lock'.format(key)
+
+    @classmethod
+    def get_version_key(cls, key):
+        """
+        Bumped by every push and invalidation of the list, see _load_object_to_cache
+        """
+        return '{{{}}}:version'.format(key)
+
+    @classmethod
+    def _deserialize_list(cls, serialized_list, serializer):
+        objects = []
+        for serialized_data in serialized_list:
+            # deserialize each tweet object in the Redis list one by one
+            deserialized_obj = serializer.deserialize(serialized_data)
+            # serializer: change to fit different kind of DB
+            objects.append(deserialized_obj)
+        return objects
+
+    @classmethod
+    def _load_object_to_cache(cls, key, objects, serializer, delta=0, version=None):
         """
         This function is to load objects that already obtained from DB to Redis.
 
         serializer is added to support multiple kinds of DB
-        """
-        connection = RedisClient.get_connection()
 
+        delete + rpush + expire are done by one Lua script:
+        - nobody can see a half-filled list
+        - if two loaders fill the same key, the latter replaces the former rather than append twice
+        - if the version of the list is not the one read before the DB load, nothing is written:
+          a push (or an invalidation) landed in between, and the objects could be a snapshot from
+          before its commit, writing them would drop the pushed object until the key expires
+        :return: True if filled
+        """
         serialized_list = []
         for obj in objects: 
             # Bug Fix: Removed the length limit here, this one did not actually limited the length
             serialized_data = serializer.serialize(obj)
             serialized_list.append(serialized_data)
 
-        if serialized_list:
-            connection.rpush(key, *serialized_list)
-            # rpush: append multiple values to the end of the list
-            # *[]: expand the list
-            connection.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-            # Why expire?
-            # For spare space, clean the dirty cache
+        filled = RedisScripts.run(
+            'fill_list_if_unchanged',
+            keys=[key, cls.get_version_key(key), cls.get_delta_key(key)],
+            args=[version or '', settings.REDIS_KEY_EXPIRE_TIME, delta] + serialized_list,
+        )
+        # Why expire?
+        # For spare space, clean the dirty cache
+        return bool(filled)
 
     @classmethod
-    def load_objects(cls, key, lazy_load_objects, serializer=DjangoModelSerializer):
+    def _load_from_db_to_cache(cls, key, lazy_load_objects, serializer):
+        """
+        Load from DB and fill the cache, also record how long the loading took (delta)
+        The caller should hold the lock of this key.
+
+        The version is read BEFORE the DB, if it has changed when filling, read the DB again,
+        at most REDIS_CACHE_FILL_ATTEMPTS times, then return the last objects without filling
+        """
+        connection = RedisClient.get_connection(key)
+        for _ in range(settings.REDIS_CACHE_FILL_ATTEMPTS):
+            version = connection.get(cls.get_version_key(key))
+            start = time.time()
+            objects = list(lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT))
+            delta = time.time() - start
+            if cls._load_object_to_cache(key, objects, serializer, delta, version):
+                break
+        return objects
+
+    @classmethod
+    def _should_refresh_early(cls, ttl, delta):
+        """
+        Probabilistic early refresh (XFetch)
+
+        A hot key should be reloaded by ONE request a little bit BEFORE it expires,
+        then the key never really expires and no request will see a cache miss.
+        The closer the key goes to its expiry, and the slower the DB load (delta) is,
+        the higher chance a request will be picked to refresh it:
+            -delta * beta * log(random()) >= ttl
+        random() is in (0, 1], log(random()) <= 0, so the left side is >= 0.
+        """
+        if delta is None or ttl is None or ttl < 0:
+            # ttl == -1: no expiry, ttl == -2: key not exist
+            return False
+        delta = float(delta)
+        if delta <= 0:
+            return False
+        rand = 1.0 - random.random()
+        # random() is [0, 1), log(0) is not defined, so use 1 - random() which is (0, 1]
+        return -delta * settings.REDIS_EARLY_REFRESH_BETA * math.log(rand) >= ttl
+
+    @classmethod
+    def load_objects(cls, key, lazy_load_objects, serializer=None):
         """
         This function is to load objects from Redis or from DB directly if data is not in Redis
 
         lazy_load_objects and serializer is added to support HBase database
         lazy_load_objects: accept a lazy loading function for both HBase and SQL DB
-        serializer: by default is DjangoModelSerializer since most of the components are still using SQL DB
-                    But as for HBase models, you need to use approprate HBase serializer
-        """
-        connection = RedisClient.get_connection()
-
-        # cache hit: check if key exists
-        # If yes, load from cache directly
-        if connection.exists(key):
-            # load from cache
-            serialized_list = connection.lrange(key, 0, -1)
-            # Get all the objects in the Redis, from 0 to -1
-            objects = []
-            for serialized_data in serialized_list:
-                # deserialize each tweet object in the Redis list one by one
-                deserialized_obj = serializer.deserialize(serialized_data)
-                # serializer: change to fit different kind of DB
-                objects.append(deserialized_obj)
-            return objects
+        serializer: by default is settings.REDIS_CACHE_SERIALIZER, which supports both SQL and HBase models
+
+        Cache stampede protection:
+        When a popular key expires, every concurrent request will see the miss at the same time,
+        then all of them go to MySQL/HBase and fill the same list again and again.
+        1. single-flight: only the request holding the lock of this key can load from DB
+           the others wait for it, and then read from the cache
+        2. serve-stale + early refresh: before the key expires, one lucky request reloads it in advance,
+           others keep reading the current list without waiting
+        """
+        if serializer is None:
+            serializer = get_serializer()
+        # One round-trip to get the list, its ttl and the meta key
+        pipeline = RedisClient.pipeline(transaction=False)
+        pipeline.lrange(key, 0, -1)
+        # Get all the objects in the Redis, from 0 to -1
+        pipeline.ttl(key)
+        pipeline.get(cls.get_delta_key(key))
+        serialized_list, ttl, delta = pipeline.execute()
+
+        # cache hit
+        if serialized_list or delta is not None:
+            if serialized_list and cls._should_refresh_early(ttl, delta):
+                objects = cls._refresh_objects(key, lazy_load_objects, serializer)
+                if objects is not None:
+                    return objects
+                # Someone else is refreshing it, serve the current (a little bit stale) list
+            try:
+                return cls._deserialize_list(serialized_list, serializer)
+            except SchemaMismatchError:
+                # Cached by another version of code, treat it as a cache miss
+                pass
 
         # cache miss
         # Redis will only cache REDIS_LIST_LENGTH_LIMIT objects to save space
         # When objects went beyond the limitation, then you need to obtain the objects from DB
         # There are not too many people really goes beyond the limitation
-        objects = lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT)
-        cls._load_object_to_cache(key, objects, serializer)
-        return list(objects) 
+        objects = cls._refresh_objects(key, lazy_load_objects, serializer)
+        if objects is not None:
+            return objects
+        return cls._wait_for_objects(key, lazy_load_objects, serializer)
+
+    @classmethod
+    def _refresh_objects(cls, key, lazy_load_objects, serializer):
+        """
+        Try to become the only loader of this key.
+        Return the loaded objects if we got the lock, otherwise return None.
+        """
+        connection = RedisClient.get_connection(key)
+        lock = connection.lock(
+            cls.get_lock_key(key),
+            timeout=settings.REDIS_CACHE_FILL_LOCK_TIMEOUT,
+        )
+        # timeout: the lock will be released automatically if the loader crashed
+        if not lock.acquire(blocking=False):
+            return None
+        try:
+            return cls._load_from_db_to_cache(key, lazy_load_objects, serializer)
+        finally:
+            try:
+                lock.release()
+            except LockError:
+                # The lock has expired and may be owned by someone else now, leave it
+                pass
+
+    @classmethod
+    def _wait_for_objects(cls, key, lazy_load_objects, serializer):
+        """
+        Another request is loading this key from DB, wait for it to fill the cache.
+        If it takes too long, read from DB directly but do not touch the cache.
+        """
+        deadline = time.time() + settings.REDIS_CACHE_FILL_WAIT_TIME
+        while time.time() < deadline:
+            time.sleep(settings.REDIS_CACHE_FILL_POLL_INTERVAL)
+            pipeline = RedisClient.pipeline(transaction=False)
+            pipeline.lrange(key, 0, -1)
+            pipeline.exists(cls.get_delta_key(key))
+            pipeline.exists(cls.get_lock_key(key))
+            serialized_list, loaded, locked = pipeline.execute()
+            if serialized_list or loaded:
+                try:
+                    return cls._deserialize_list(serialized_list, serializer)
+                except SchemaMismatchError:
+                    # Still the data of another version, wait for the loader to replace it
+                    pass
+            if not locked:
+                # The loader is gone without filling anything, try to be the loader
+                objects = cls._refresh_objects(key, lazy_load_objects, serializer)
+                if objects is not None:
+                    return objects
+        return list(lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT))
     
     @classmethod
-    def push_object(cls, key, obj, lazy_load_objects):
+    def push_object(cls, key, obj, lazy_load_objects, serializer=None):
         """
         This function is to push objects to Redis
 
         lazy_load_objects is newly added for both SQL and HBase DB
         """
-        if isinstance(obj, HBaseModel):
-            serializer = HBaseModelSerializer
-        else:
-            serializer = DjangoModelSerializer
-        # This if-else is to choose to use which serializer since both are different
-        connection = RedisClient.get_connection()
-        
-        if connection.exists(key):
-            # If key is in the Redis
-            serialized_data = serializer.serialize(obj)
-            connection.lpush(key, serialized_data)
-            # We put the object to the top of the "list" in cache
-            connection.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
-            # Then trim the length 
+        if serializer is None:
+            serializer = get_serializer()
+        # The serializer should be the same as the one of load_objects
+        serialized_data = serializer.serialize(obj)
+        pushed = RedisScripts.run(
+            'push_if_exists',
+            keys=[key, cls.get_version_key(key)],
+            args=[serialized_data, settings.REDIS_LIST_LENGTH_LIMIT, settings.REDIS_KEY_EXPIRE_TIME],
+        )
+        # If key is in the Redis, 
+        # the script put the object to the top of the "list" and trim the length in one round-trip
+        if pushed:
             return
         # if key is not in the Cache
         # Then we need to call the lazy load function
-        objects = lazy_load_objects(settings.REDIS_LIST_LENGTH_LIMIT)
-        cls._load_object_to_cache(key, objects, serializer)
+        # If someone else is loading this key, the push above has bumped the version,
+        # the loader will read the DB again rather than fill the cache without obj
+        cls._refresh_objects(key, lazy_load_objects, serializer)
         return
 
     @classmethod
-    def get_count_key(cls, obj, attr):
+    def invalidate_objects(cls, key):
         """
-        This class method is to compose the key for likes_count or comments_count ...
-        Structure is {class/model name}.{attribute(which count)}:{object id}
+        Drop a cached list, the next load_objects will reload it from DB
+        The delta key goes too, otherwise an empty list would still be treated as loaded
+        The version is bumped, so a loader reading the DB right now will not fill the old objects
         """
-        return '{}.{}:{}'.format(obj.__class__.__name__, attr, obj.id)
-    
-    @classmethod
-    def increase_count(cls, obj, attr):
-        connection = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if connection.exists(key):
-            return connection.incr(key) # An atmoic operation built-in in redis package
-        # If we cannot find the key in the cache, we need to back fill cache from DB
-        # No +1 operation will be implemented in this block
-        # -> Because obj.attr has already +1 in DB, before call incr_count()
-        obj.refresh_from_db() # reload the object from DB
-        connection.set(key, getattr(obj, attr))
-        # getattr: obtain certain attribute, say varible/function/etc., in the object
-        # This is because all these things are a dictonary within the object managed by python
-        # equals: obj.__dict__.get(attr)
-        connection.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-        return getattr(obj, attr)
-        
-    
-    @classmethod
-    def decrease_count(cls, obj, attr):
-        connection = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        if connection.exists(key):
-            return connection.decr(key)
-        obj.refresh_from_db()
-        connection.set(key, getattr(obj, attr))
-        connection.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
-        return getattr(obj, attr)
-        
-    @classmethod
-    def get_count(cls, obj, attr):
-        connection = RedisClient.get_connection()
-        key = cls.get_count_key(obj, attr)
-        count = connection.get(key)
-        if count is not None:
-            return int(count)
-        obj.refresh_from_db()
-        count = getattr(obj, attr)
-        connection.set(key, count)
-        return count
\ No newline at end of file
+        version_key = cls.get_version_key(key)
+        pipeline = RedisClient.get_connection(key).pipeline()
+        pipeline.delete(key, cls.get_delta_key(key))
+        # one DEL for both, they are on the same node by the hash tag
+        pipeline.incr(version_key)
+        pipeline.expire(version_key, settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.execute()
@@ -0,0 +1,250 @@
+from utils.redis_client import RedisClient
+
+# Why Lua scripts?
+# Operations like "check exists, then lpush, then ltrim" are 3 round-trips to Redis,
+# and other clients could change the key between any two of them
+# e.g. the key expired right after exists() returned True, lpush will create a list with ONLY one object
+# Redis runs a Lua script atomically, nothing else can happen while the script is running,
+# and it only costs one round-trip.
+#
+# Scripts are loaded into Redis once (SCRIPT LOAD) and called by its sha1 (EVALSHA),
+# so we don't need to send the whole script body for every call.
+# redis-py will reload the script automatically if Redis has been restarted or flushed (NOSCRIPT error)
+
+# Cached lists, see utils.redis_helper.RedisHelper
+# KEYS[1]: list key, KEYS[2]: version counter of the list
+# ARGV[1]: serialized object, ARGV[2]: list length limit, ARGV[3]: expire time
+# Every push bumps the version, even if the list is not in the cache,
+# so a loader that read the DB before the push can tell (see FILL_LIST_IF_UNCHANGED)
+# return 1 if pushed, 0 if the key is not in the cache
+PUSH_IF_EXISTS = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('LPUSH', KEYS[1], ARGV[1])
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[2]) - 1)
+return 1
+"""
+
+# KEYS[1]: list key, KEYS[2]: version counter, KEYS[3]: delta key
+# ARGV[1]: version read before loading from DB ('' if none), ARGV[2]: expire time, ARGV[3]: delta
+# ARGV[4...]: serialized objects
+# return 1 if filled, 0 if someone pushed or invalidated in between, the DB snapshot could miss it
+FILL_LIST_IF_UNCHANGED = """
+local version = redis.call('GET', KEYS[2])
+if (version or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 4, #ARGV, 1000 do
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+if #ARGV > 3 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+redis.call('SET', KEYS[3], ARGV[3], 'EX', ARGV[2])
+return 1
+"""
+
+# Write-behind counters, see utils.counter_helper.CounterHelper
+# KEYS[1]: pending hash of the bucket, KEYS[2]: cached count (same hash tag as the bucket)
+# ARGV[1]: field in the pending hash, ARGV[2]: amount, could be negative
+# The delta and the cached count change together: a fill or a flush never sees one without the other
+# return the new count, or nil if the count is not in the cache
+CHANGE_COUNT = """
+redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return nil
+end
+return redis.call('INCRBY', KEYS[2], ARGV[2])
+"""
+
+# Liked objects of a user, see likes.services.LikeService
+# KEYS[1]: recent likes zset, KEYS[2]: Bloom filter bitmap, KEYS[3]: version counter
+# Every like/unlike bumps the version, so a build started before it can tell and give up
+
+# ARGV[1]: member, ARGV[2]: score (created_at), ARGV[3]: recent set size limit, ARGV[4]: expire time
+# ARGV[5]: number of hashes k, ARGV[6], ARGV[7]: h1, h2 of the member (see utils.bloom_filter)
+# return 1 if added, 0 if the filter is not in the cache
+ADD_LIKE_IF_EXISTS = """
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], ARGV[4])
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return 0
+end
+local size = redis.call('STRLEN', KEYS[2]) * 8
+local h1, h2 = tonumber(ARGV[6]), tonumber(ARGV[7])
+for i = 0, tonumber(ARGV[5]) - 1 do
+    redis.call('SETBIT', KEYS[2], (h1 + i * h2) % size, 1)
+end
+redis.call('ZADD', KEYS[1], ARGV[2], ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[3]) - 1)
+local ttl = redis.call('TTL', KEYS[2])
+if ttl > 0 then
+    redis.call('EXPIRE', KEYS[1], ttl)
+end
+return 1
+"""
+
+# KEYS[1]: recent likes zset, KEYS[2]: version counter
+# ARGV[1]: member, ARGV[2]: expire time
+# The member stays in the Bloom filter, it can't be removed from there
+REMOVE_LIKE = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('ZREM', KEYS[1], ARGV[1])
+"""
+
+# KEYS: same as ADD_LIKE_IF_EXISTS
+# ARGV[1]: version read before loading the likes from DB ('' if none), ARGV[2]: expire time
+# ARGV[3]: Bloom filter bitmap, ARGV[4...]: score, member pairs of the recent likes
+# return 1 if built, 0 if someone liked/unliked in between or the filter is already there
+BUILD_LIKES_IF_UNCHANGED = """
+local version = redis.call('GET', KEYS[3])
+if (version or '') ~= ARGV[1] then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('SET', KEYS[2], ARGV[3], 'EX', ARGV[2])
+redis.call('DEL', KEYS[1])
+for i = 4, #ARGV, 2 do
+    redis.call('ZADD', KEYS[1], ARGV[i], ARGV[i + 1])
+end
+if #ARGV > 3 then
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 1
+"""
+
+# KEYS[1]: recent likes zset, KEYS[2]: Bloom filter bitmap
+# ARGV[1]: number of hashes k, ARGV[2...]: member, h1, h2 triples
+# return nil if the filter is not in the cache, otherwise one state for each member:
+# 2: in the recent set (liked), 1: maybe (Bloom filter positive), 0: definitely not liked
+CHECK_LIKES = """
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    return false
+end
+local size = redis.call('STRLEN', KEYS[2]) * 8
+local k = tonumber(ARGV[1])
+local states = {}
+for j = 2, #ARGV, 3 do
+    local state = 2
+    if not redis.call('ZSCORE', KEYS[1], ARGV[j]) then
+        state = 1
+        local h1, h2 = tonumber(ARGV[j + 1]), tonumber(ARGV[j + 2])
+        for i = 0, k - 1 do
+            if redis.call('GETBIT', KEYS[2], (h1 + i * h2) % size) == 0 then
+                state = 0
+                break
+            end
+        end
+    end
+    states[#states + 1] = state
+end
+return states
+"""
+
+# Following set of a user, see friendships.services.FriendshipService
+# KEYS[1]: the set, KEYS[2]: version counter, same idea as the liked cache above
+# ARGV[1]: member, ARGV[2]: expire time
+# return 1 if changed, 0 if the set is not in the cache (or the member is already there/gone)
+SADD_IF_EXISTS = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+return redis.call('SADD', KEYS[1], ARGV[1])
+"""
+
+SREM_IF_EXISTS = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+return redis.call('SREM', KEYS[1], ARGV[1])
+"""
+
+# KEYS: same as SADD_IF_EXISTS
+# ARGV[1]: version read before loading from DB ('' if none), ARGV[2]: expire time, ARGV[3...]: members
+# return 1 if built, 0 if someone changed the set in between or it is already there
+# SADD in chunks, unpack() of too many values would overflow the Lua stack
+BUILD_SET_IF_UNCHANGED = """
+local version = redis.call('GET', KEYS[2])
+if (version or '') ~= ARGV[1] then
+    return 0
+end
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+for i = 3, #ARGV, 1000 do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Cached counts without a DB column, e.g. the follower/following counts of a user
+# KEYS[1]: count, KEYS[2]: version counter
+# ARGV[1]: amount, could be negative, ARGV[2]: expire time
+# return the new value, or nil if the count is not in the cache
+INCR_COUNT_IF_EXISTS = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[2])
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return nil
+end
+return redis.call('INCRBY', KEYS[1], ARGV[1])
+"""
+
+# KEYS: same as INCR_COUNT_IF_EXISTS
+# ARGV[1]: version read before counting in DB ('' if none), ARGV[2]: count, ARGV[3]: expire time
+# return 1 if saved, 0 if the count changed in between
+SET_COUNT_IF_UNCHANGED = """
+local version = redis.call('GET', KEYS[2])
+if (version or '') ~= ARGV[1] then
+    return 0
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+return 1
+"""
+
+
+class RedisScripts:
+    scripts = {}
+    # script name -> redis.commands.core.Script, shared by the whole process
+
+    sources = {
+        'push_if_exists': PUSH_IF_EXISTS,
+        'fill_list_if_unchanged': FILL_LIST_IF_UNCHANGED,
+        'change_count': CHANGE_COUNT,
+        'add_like_if_exists': ADD_LIKE_IF_EXISTS,
+        'remove_like': REMOVE_LIKE,
+        'build_likes_if_unchanged': BUILD_LIKES_IF_UNCHANGED,
+        'check_likes': CHECK_LIKES,
+        'sadd_if_exists': SADD_IF_EXISTS,
+        'srem_if_exists': SREM_IF_EXISTS,
+        'build_set_if_unchanged': BUILD_SET_IF_UNCHANGED,
+        'incr_count_if_exists': INCR_COUNT_IF_EXISTS,
+        'set_count_if_unchanged': SET_COUNT_IF_UNCHANGED,
+    }
+
+    @classmethod
+    def get(cls, script_name):
+        if script_name in cls.scripts:
+            return cls.scripts[script_name]
+        connection = RedisClient.get_connection()
+        cls.scripts[script_name] = connection.register_script(cls.sources[script_name])
+        # register_script will not talk to Redis,
+        # the script will be loaded by the first EVALSHA call
+        return cls.scripts[script_name]
+
+    @classmethod
+    def run(cls, script_name, keys=None, args=None, client=None):
+        keys = keys or []
+        if client is None and keys:
+            # A script runs on one node, all its keys must be on the node of the first key
+            client = RedisClient.get_connection(keys[0])
+        return cls.get(script_name)(keys=keys, args=args or [], client=client)
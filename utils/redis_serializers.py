@@ -1,8 +1,14 @@
 import json
+import zlib
 
+import msgpack
+from django.apps import apps
+from django.conf import settings
 from django.core import serializers
 from django_hbase.models import HBaseModel
+from utils.cache_versions import CacheVersions
 from utils.json_encoder import JSONEncoder
+from utils.time_helper import datetime_to_timestamp, timestamp_to_datetime
 
 
 class DjangoModelSerializer():
@@ -51,4 +57,179 @@ class HBaseModelSerializer:
         # model_class is already a class created by the previous function:
         # model_class = HBaseModel # means
         # model_class(...) == HBaseModel(...)
-        return model_class(**json_data)
\ No newline at end of file
+        return model_class(**json_data)
+
+class JSONSerializer:
+    """
+    The original JSON format, DjangoModelSerializer or HBaseModelSerializer based on the instance
+    """
+
+    @classmethod
+    def serialize(cls, instance):
+        if isinstance(instance, HBaseModel):
+            return HBaseModelSerializer.serialize(instance)
+        return DjangoModelSerializer.serialize(instance)
+
+    @classmethod
+    def deserialize(cls, serialized_data):
+        if isinstance(serialized_data, str):
+            serialized_data = serialized_data.encode('utf-8')
+        if serialized_data[:1] == b'{':
+            # HBaseModelSerializer dumps a dict
+            return HBaseModelSerializer.deserialize(serialized_data)
+        # DjangoModelSerializer dumps a list
+        return DjangoModelSerializer.deserialize(serialized_data)
+
+
+class SchemaMismatchError(Exception):
+    """
+    The cached data was written with a different field list of the model,
+    say, by the code before a deployment. It should be treated as a cache miss.
+    """
+    pass
+
+
+class CompactModelSerializer:
+    """
+    A compact binary format for cached objects:
+        msgpack([model_id, schema_version, value1, value2, ...])
+
+    Why?
+    The JSON format above stores the model name and every field name for each object,
+    say '[{"model": "tweets.tweet", "pk": 1, "fields": {"user": 1, "content": ...}}]'
+    For a Redis list of 100 tweets, most of the bytes are the same field names again and again.
+    And deserializing goes through django.core.serializers, which is slow.
+
+    Here:
+    - model_id: a small integer instead of the model name, see MODEL_IDS
+    - schema_version: a checksum of the field list, to find out data written by another version of code
+    - values: in the order of the fields, so no field names are needed
+    - datetime: integer microseconds timestamp rather than an iso format string
+    Deserializing constructs the model instance directly.
+    """
+
+    MODEL_IDS = {
+        'tweets.Tweet': 1,
+        'newsfeeds.NewsFeed': 2,
+        'newsfeeds.HBaseNewsFeed': 3,
+        'likes.Like': 4,
+        'comments.Comment': 5,
+    }
+    # DO NOT change or reuse an id, just add new models to the end
+    # ids are saved in the cache, changing them means reading another model's data
+
+    _models_by_id = None
+    # model_id -> (model_class, field_names, datetime_fields, schema_version)
+
+    @classmethod
+    def get_model_label(cls, model_class):
+        if issubclass(model_class, HBaseModel):
+            # newsfeeds.models.hbase_newsfeed -> newsfeeds.HBaseNewsFeed
+            return '{}.{}'.format(model_class.__module__.split('.')[0], model_class.__name__)
+        return model_class._meta.label
+
+    @classmethod
+    def get_schema(cls, model_class):
+        """
+        :return: field names, names of datetime fields, field spec used for the version
+        """
+        field_spec = CacheVersions.get_field_spec(model_class)
+        if issubclass(model_class, HBaseModel):
+            return list(model_class.get_field_hash().keys()), set(), field_spec
+        fields = model_class._meta.concrete_fields
+        field_names = [field.attname for field in fields]
+        # attname: user_id rather than user, so we don't need to load the user
+        datetime_fields = {
+            field.attname
+            for field in fields
+            if field.get_internal_type() == 'DateTimeField'
+        }
+        return field_names, datetime_fields, field_spec
+
+    @classmethod
+    def get_schema_version(cls, field_spec):
+        return zlib.crc32(','.join(field_spec).encode('utf-8')) & 0xffff
+
+    @classmethod
+    def _load_models(cls):
+        if cls._models_by_id is not None:
+            return cls._models_by_id
+        models_by_id = {}
+        hbase_models = {
+            cls.get_model_label(subclass): subclass
+            for subclass in HBaseModel.__subclasses__()
+        }
+        for label, model_id in cls.MODEL_IDS.items():
+            if label in hbase_models:
+                model_class = hbase_models[label]
+            else:
+                model_class = apps.get_model(label)
+            field_names, datetime_fields, field_spec = cls.get_schema(model_class)
+            models_by_id[model_id] = (
+                model_class,
+                field_names,
+                datetime_fields,
+                cls.get_schema_version(field_spec),
+            )
+        cls._models_by_id = models_by_id
+        return models_by_id
+
+    @classmethod
+    def _get_model_id(cls, model_class):
+        model_id = cls.MODEL_IDS.get(cls.get_model_label(model_class))
+        if model_id is None:
+            raise Exception('Model {} is not registered in CompactModelSerializer'.format(
+                cls.get_model_label(model_class),
+            ))
+        return model_id
+
+    @classmethod
+    def serialize(cls, instance):
+        model_id = cls._get_model_id(instance.__class__)
+        _, field_names, datetime_fields, schema_version = cls._load_models()[model_id]
+        data = [model_id, schema_version]
+        for name in field_names:
+            value = getattr(instance, name)
+            if name in datetime_fields and value is not None:
+                value = datetime_to_timestamp(value)
+            data.append(value)
+        return msgpack.packb(data)
+
+    @classmethod
+    def deserialize(cls, serialized_data):
+        if isinstance(serialized_data, str):
+            serialized_data = serialized_data.encode('utf-8')
+        if serialized_data[:1] in (b'[', b'{'):
+            # Written by JSONSerializer before we switched the format
+            return JSONSerializer.deserialize(serialized_data)
+        data = msgpack.unpackb(serialized_data)
+        model_id, schema_version, values = data[0], data[1], data[2:]
+        if model_id not in cls._load_models():
+            raise SchemaMismatchError('Unknown model id {}'.format(model_id))
+        model_class, field_names, datetime_fields, current_version = cls._load_models()[model_id]
+        if schema_version != current_version or len(values) != len(field_names):
+            raise SchemaMismatchError('{} schema changed'.format(model_class.__name__))
+        if datetime_fields:
+            values = [
+                timestamp_to_datetime(value)
+                if name in datetime_fields and value is not None else value
+                for name, value in zip(field_names, values)
+            ]
+        if issubclass(model_class, HBaseModel):
+            return model_class(**dict(zip(field_names, values)))
+        return model_class.from_db(None, field_names, values)
+        # from_db is what Django uses to build an instance from a DB row
+        # values in the order of concrete fields, so it goes the fast path of Model.__init__
+
+
+SERIALIZERS = {
+    'json': JSONSerializer,
+    'compact': CompactModelSerializer,
+}
+
+
+def get_serializer(name=None):
+    """
+    Get the serializer for the cached objects, by default settings.REDIS_CACHE_SERIALIZER
+    """
+    return SERIALIZERS[name or settings.REDIS_CACHE_SERIALIZER]
@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+from gatekeeper.models import GateKeeper
+from utils.redis_client import RedisClient
+
+logger = logging.getLogger(__name__)
+
+MYSQL = 'mysql'
+HBASE = 'hbase'
+
+
+class ShadowReads:
+    """
+    Read from both MySQL and HBase while migrating, to see how HBase does under the real traffic
+
+    A read guarded by switch_friendship_to_hbase/switch_newsfeed_to_hbase only goes to one store,
+    the primary: HBase if the switch is on, otherwise MySQL.
+    For the users in the gatekeeper 'shadow_<switch name>' (GateKeeper.in_gk percent),
+    the same read also goes to the other store (secondary):
+    - in a thread pool, off the request path: the response never waits for it, and its errors are only logged
+    - the two results are compared, the mismatches are counted
+    - the latencies of both stores go to histograms
+
+    The stats of each read are in a Redis hash shadow_reads:<name>, see get_stats
+    Turn on the shadow reads for 1% users:
+        GateKeeper.set_kv('shadow_switch_friendship_to_hbase', 'percent', 1)
+    """
+    executor = None
+    # one thread pool for the whole process, created on the first shadow read
+    pending = None
+    # semaphore, the number of shadow reads queued or running is limited
+
+    @classmethod
+    def get_executor(cls):
+        if cls.executor is None:
+            cls.executor = ThreadPoolExecutor(
+                max_workers=settings.SHADOW_READS_MAX_WORKERS,
+                thread_name_prefix='shadow-reads',
+            )
+            cls.pending = threading.BoundedSemaphore(settings.SHADOW_READS_MAX_PENDING)
+        return cls.executor
+
+    @classmethod
+    def get_key(cls, name):
+        return 'shadow_reads:{}'.format(name)
+
+    @classmethod
+    def read(cls, name, switch_name, user_id, mysql_read, hbase_read, normalize=None):
+        """
+        :param name: name of the read in the stats, e.g. 'friendships.follower_ids'
+        :param user_id: who is sampled, the same user is always in or out of the shadow reads
+        :param mysql_read, hbase_read: functions without parameters, the reads on the two stores
+        :param normalize: turns a result into something comparable with ==, e.g. a list of ids
+        :return: result of the primary read
+        """
+        if GateKeeper.is_switch_on(switch_name):
+            primary, secondary = (HBASE, hbase_read), (MYSQL, mysql_read)
+        else:
+            primary, secondary = (MYSQL, mysql_read), (HBASE, hbase_read)
+        if user_id is None or not GateKeeper.in_gk('shadow_' + switch_name, user_id):
+            return primary[1]()
+
+        normalize = normalize or (lambda result: result)
+        start = time.perf_counter()
+        result = primary[1]()
+        expected = normalize(result)
+        # normalize in the request thread: a lazy queryset is evaluated here, the caller reuses it
+        primary_latency = time.perf_counter() - start
+
+        if settings.SHADOW_READS_SYNC:
+            cls._run_secondary(name, primary[0], primary_latency, expected, secondary, normalize)
+            return result
+        cls.get_executor()
+        if not cls.pending.acquire(blocking=False):
+            # HBase/MySQL is slow, the pool can't catch up, don't pile up the reads in the memory
+            RedisClient.get_connection(cls.get_key(name)).hincrby(cls.get_key(name), 'dropped', 1)
+            return result
+        future = cls.executor.submit(
+            cls._run_secondary, name, primary[0], primary_latency, expected, secondary, normalize,
+        )
+        future.add_done_callback(lambda _: cls.pending.release())
+        return result
+
+    @classmethod
+    def _run_secondary(cls, name, primary_store, primary_latency, expected, secondary, normalize):
+        secondary_store, secondary_read = secondary
+        close_old_connections()
+        # Each thread has its own DB connection, close it if it is broken or too old
+        # Same for HBase, see django_hbase.client.HBaseClient
+        try:
+            start = time.perf_counter()
+            actual = normalize(secondary_read())
+            secondary_latency = time.perf_counter() - start
+        except Exception:
+            logger.exception('shadow read %s on %s failed', name, secondary_store)
+            key = cls.get_key(name)
+            RedisClient.get_connection(key).hincrby(key, '{}:errors'.format(secondary_store), 1)
+            return
+        finally:
+            close_old_connections()
+
+        mismatched = actual != expected
+        if mismatched:
+            logger.warning('shadow read %s mismatched: %s %r, %s %r',
+                name, primary_store, expected, secondary_store, actual)
+        cls._record(name, {
+            primary_store: primary_latency,
+            secondary_store: secondary_latency,
+        }, mismatched)
+
+    @classmethod
+    def get_bucket(cls, latency):
+        latency_ms = latency * 1000
+        for bound in settings.SHADOW_READS_LATENCY_BUCKETS:
+            if latency_ms <= bound:
+                return 'le_{}'.format(bound)
+        return 'inf'
+
+    @classmethod
+    def _record(cls, name, latencies, mismatched):
+        """
+        All the fields of one comparison in ONE pipeline
+        """
+        key = cls.get_key(name)
+        pipeline = RedisClient.get_connection(key).pipeline(transaction=False)
+        pipeline.hincrby(key, 'compared', 1)
+        if mismatched:
+            pipeline.hincrby(key, 'mismatches', 1)
+        for store, latency in latencies.items():
+            pipeline.hincrby(key, '{}:{}'.format(store, cls.get_bucket(latency)), 1)
+            pipeline.hincrby(key, '{}:latency_us_sum'.format(store), int(latency * 1000000))
+        pipeline.execute()
+
+    @classmethod
+    def get_stats(cls, name):
+        """
+        :return: {'compared': n, 'mismatches': n, 'dropped': n,
+                  'mysql': {'errors': n, 'mean_ms': x, 'histogram': {'le_1': n, ..., 'inf': n}}, 'hbase': {...}}
+        """
+        key = cls.get_key(name)
+        fields = {
+            field.decode('utf-8'): int(value)
+            for field, value in RedisClient.get_connection(key).hgetall(key).items()
+        }
+        stats = {
+            'compared': fields.get('compared', 0),
+            'mismatches': fields.get('mismatches', 0),
+            'dropped': fields.get('dropped', 0),
+        }
+        buckets = ['le_{}'.format(bound) for bound in settings.SHADOW_READS_LATENCY_BUCKETS] + ['inf']
+        for store in (MYSQL, HBASE):
+            histogram = {bucket: fields.get('{}:{}'.format(store, bucket), 0) for bucket in buckets}
+            count = sum(histogram.values())
+            latency_sum = fields.get('{}:latency_us_sum'.format(store), 0)
+            stats[store] = {
+                'errors': fields.get('{}:errors'.format(store), 0),
+                'mean_ms': latency_sum / count / 1000 if count else None,
+                'histogram': histogram,
+            }
+        return stats
@@ -0,0 +1,22 @@
+from celery import shared_task
+from utils.counter_helper import CounterHelper
+from utils.time_constants import ONE_HOUR
+
+
+# Scheduled by celery beat, see twitter.settings.CELERY_BEAT_SCHEDULE
+#   celery -A twitter beat -l info
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def flush_counters_task():
+    """
+    Write the pending likes_count/comments_count deltas from Redis to the DB
+    """
+    return '{} counters flushed'.format(CounterHelper.flush())
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_counters_task():
+    """
+    Recompute the counters from the likes/comments tables, it scans the whole tweets table
+    Run it when the traffic is low
+    """
+    return '{} counters fixed'.format(CounterHelper.reconcile())
@@ -1,5 +1,20 @@
+import msgpack
+import threading
+from django.test import override_settings
+from redis.exceptions import ResponseError
+
+from gatekeeper.models import GateKeeper
+from newsfeeds.models import HBaseNewsFeed, NewsFeed
 from testing.testcases import TestCase
+from tweets.models import Tweet
+from tweets.services import TweetService
+from utils.bloom_filter import BloomFilter
+from utils.cache_versions import CacheVersions
+from utils.counter_helper import CounterHelper
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+from utils.redis_serializers import CompactModelSerializer, JSONSerializer, SchemaMismatchError
+from utils.shadow_reads import ShadowReads
 
 
 class UtilsTests(TestCase):
@@ -36,4 +51,360 @@ class UtilsTests(TestCase):
 
         RedisClient.clear()
         cached_list = conn.lrange('list', 0, -1)
-        self.assertEqual(cached_list, [])
\ No newline at end of file
+        self.assertEqual(cached_list, [])
+
+    def test_redis_sharding(self):
+        nodes = [
+            {'host': '10.0.0.{}'.format(i), 'port': 6379, 'db': 1}
+            for i in range(4)
+        ]
+        keys = ['user_tweets:{}'.format(i) for i in range(1000)]
+        try:
+            with override_settings(REDIS_NODES=nodes):
+                RedisClient.reset()
+                before = {key: RedisClient.get_node_index(key) for key in keys}
+                # keys are spread onto all the nodes
+                self.assertEqual(set(before.values()), {0, 1, 2, 3})
+                # hash tag: meta keys are on the same node as the key
+                for key in keys[:10]:
+                    self.assertEqual(
+                        RedisClient.get_node_index(RedisHelper.get_delta_key(key)),
+                        before[key],
+                    )
+
+            # remove a node, only the keys on that node are moved
+            with override_settings(REDIS_NODES=nodes[:3]):
+                RedisClient.reset()
+                for key in keys:
+                    if before[key] != 3:
+                        self.assertEqual(RedisClient.get_node_index(key), before[key])
+        finally:
+            RedisClient.reset()
+
+        # pipeline results are in the order of the commands
+        pipeline = RedisClient.pipeline(transaction=False)
+        pipeline.set('a', 1)
+        pipeline.get('a')
+        pipeline.get('b')
+        self.assertEqual(pipeline.execute(), [True, b'1', None])
+
+    def test_call_or_fallback(self):
+        self.addCleanup(RedisClient.reset)
+        calls = []
+
+        def call(connection):
+            calls.append('call')
+            raise ResponseError("unknown command 'SINTERCARD', with args beginning with: ")
+
+        def fallback(connection):
+            calls.append('fallback')
+            return 0
+
+        for _ in range(2):
+            self.assertEqual(RedisClient.call_or_fallback('a', 'SINTERCARD', call, fallback), 0)
+        # the server is only asked once, the node is remembered
+        self.assertEqual(calls, ['call', 'fallback', 'fallback'])
+
+        def broken(connection):
+            raise ResponseError('WRONGTYPE Operation against a key holding the wrong kind of value')
+
+        with self.assertRaises(ResponseError):
+            RedisClient.call_or_fallback('a', 'SMISMEMBER', broken, fallback)
+
+    def test_bloom_filter(self):
+        self.assertEqual(BloomFilter.get_size(0), 8192)
+        self.assertEqual(BloomFilter.get_size(1000), 32768)
+        items = ['1:{}'.format(i) for i in range(1000)]
+        size = BloomFilter.get_size(len(items))
+        bitmap = BloomFilter.build(items, size)
+        self.assertEqual(len(bitmap) * 8, size)
+        # no false negative
+        self.assertTrue(all(BloomFilter.contains(bitmap, item) for item in items))
+        false_positives = sum(
+            BloomFilter.contains(bitmap, '2:{}'.format(i))
+            for i in range(10000)
+        )
+        self.assertLess(false_positives, 100)
+
+        # the bits are in the same order as SETBIT/GETBIT of Redis
+        conn = RedisClient.get_connection()
+        conn.set('bloom', bitmap)
+        for position in BloomFilter.get_positions(items[0], size):
+            self.assertEqual(conn.getbit('bloom', position), 1)
+
+
+class ShadowReadsTests(TestCase):
+
+    def read(self, user_id, hbase_read):
+        return ShadowReads.read(
+            'test.read',
+            'switch_test_to_hbase',
+            user_id,
+            mysql_read=lambda: [3, 1, 2],
+            hbase_read=hbase_read,
+            normalize=sorted,
+        )
+
+    def test_shadow_reads(self):
+        # not in the gatekeeper: only the primary is read
+        self.assertEqual(self.read(1, lambda: 1 / 0), [3, 1, 2])
+        self.assertEqual(ShadowReads.get_stats('test.read')['compared'], 0)
+
+        GateKeeper.set_kv('shadow_switch_test_to_hbase', 'percent', 50)
+        self.assertEqual(self.read(1, lambda: [1, 2, 3]), [3, 1, 2])
+        self.assertEqual(self.read(2, lambda: [1, 2]), [3, 1, 2])
+        self.assertEqual(self.read(3, lambda: 1 / 0), [3, 1, 2])
+        # user 99 is not in the 50%
+        self.read(99, lambda: [])
+        stats = ShadowReads.get_stats('test.read')
+        self.assertEqual(stats['compared'], 2)
+        self.assertEqual(stats['mismatches'], 1)
+        self.assertEqual(stats['hbase']['errors'], 1)
+        self.assertEqual(sum(stats['mysql']['histogram'].values()), 2)
+        self.assertEqual(sum(stats['hbase']['histogram'].values()), 2)
+        self.assertIsNotNone(stats['hbase']['mean_ms'])
+
+        # the switch is on: HBase becomes the primary
+        GateKeeper.set_kv('switch_test_to_hbase', 'percent', 100)
+        self.assertEqual(self.read(1, lambda: [2, 1, 3]), [2, 1, 3])
+        self.assertEqual(ShadowReads.get_stats('test.read')['compared'], 3)
+
+    @override_settings(SHADOW_READS_SYNC=False)
+    def test_shadow_reads_in_thread_pool(self):
+        GateKeeper.set_kv('shadow_switch_test_to_hbase', 'percent', 100)
+        request_thread = threading.current_thread()
+        threads = []
+
+        def hbase_read():
+            threads.append(threading.current_thread())
+            return [1, 2, 3]
+
+        self.assertEqual(self.read(1, hbase_read), [3, 1, 2])
+        ShadowReads.executor.shutdown(wait=True)
+        ShadowReads.executor = None
+        self.assertNotEqual(threads, [request_thread])
+        self.assertEqual(ShadowReads.get_stats('test.read')['compared'], 1)
+
+class RedisHelperTests(TestCase):
+
+    def setUp(self):
+        super(RedisHelperTests, self).setUp()
+        self.user1 = self.create_user('user1')
+        self.key = TweetService.get_user_tweets_key(self.user1.id)
+        self.load_times = 0
+
+    def lazy_load_tweets(self, limit):
+        self.load_times += 1
+        return Tweet.objects.filter(user_id=self.user1.id).order_by('-created_at')[:limit]
+
+    def test_load_objects_single_flight(self):
+        tweets = [self.create_tweet(self.user1) for _ in range(3)]
+        RedisClient.clear()
+        conn = RedisClient.get_connection(self.key)
+
+        # Someone else is loading this key, we should not fill the cache
+        lock = conn.lock(RedisHelper.get_lock_key(self.key), timeout=10)
+        self.assertEqual(lock.acquire(blocking=False), True)
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[::-1]])
+        self.assertEqual(self.load_times, 1)
+        self.assertEqual(conn.exists(self.key), False)
+        lock.release()
+
+        # cache miss, fill the cache
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[::-1]])
+        self.assertEqual(self.load_times, 2)
+        self.assertEqual(conn.llen(self.key), 3)
+
+        # cache hit
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[::-1]])
+        self.assertEqual(self.load_times, 2)
+
+        # Early refresh: the loader is extremely slow, so the key should be reloaded before expiry
+        conn.set(RedisHelper.get_delta_key(self.key), 10 ** 9)
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual([t.id for t in objects], [t.id for t in tweets[::-1]])
+        self.assertEqual(self.load_times, 3)
+        # The list is replaced rather than appended
+        self.assertEqual(conn.llen(self.key), 3)
+
+    def test_push_during_fill(self):
+        tweets = [self.create_tweet(self.user1) for _ in range(2)]
+        RedisClient.clear()
+        new_tweets = []
+
+        def lazy_load_with_push(limit):
+            # the DB snapshot is taken, then a new tweet is committed and pushed before the fill
+            objects = list(self.lazy_load_tweets(limit))
+            if not new_tweets:
+                new_tweets.append(self.create_tweet(self.user1))
+            return objects
+
+        objects = RedisHelper.load_objects(self.key, lazy_load_with_push)
+        # the old snapshot is not cached, the DB is read again
+        self.assertEqual(self.load_times, 2)
+        expected = [new_tweets[0].id] + [t.id for t in tweets[::-1]]
+        self.assertEqual([t.id for t in objects], expected)
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual([t.id for t in objects], expected)
+        self.assertEqual(self.load_times, 2)
+
+        # an invalidation in between is not overwritten either
+        RedisHelper.invalidate_objects(self.key)
+        self.load_times = 0
+
+        def lazy_load_with_invalidation(limit):
+            objects = list(self.lazy_load_tweets(limit))
+            if self.load_times < 10:
+                RedisHelper.invalidate_objects(self.key)
+            return objects
+
+        RedisHelper.load_objects(self.key, lazy_load_with_invalidation)
+        # gives up after REDIS_CACHE_FILL_ATTEMPTS, nothing cached
+        self.assertEqual(self.load_times, 3)
+        self.assertEqual(RedisClient.get_connection(self.key).exists(self.key), False)
+
+    def test_load_empty_objects(self):
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual(objects, [])
+        objects = RedisHelper.load_objects(self.key, self.lazy_load_tweets)
+        self.assertEqual(objects, [])
+        # Empty result is also cached
+        self.assertEqual(self.load_times, 1)
+
+
+class CounterHelperTests(TestCase):
+
+    def setUp(self):
+        super(CounterHelperTests, self).setUp()
+        self.user1 = self.create_user('user1')
+
+    def test_increase_and_decrease_count(self):
+        tweet = self.create_tweet(self.user1)
+        key = CounterHelper.get_count_key(tweet, 'likes_count')
+        conn = RedisClient.get_connection(key)
+
+        # cache miss: DB + pending deltas
+        Tweet.objects.filter(id=tweet.id).update(likes_count=5)
+        self.assertEqual(CounterHelper.increase_count(tweet, 'likes_count'), 6)
+        self.assertEqual(conn.get(key), b'6')
+        self.assertTrue(conn.ttl(key) > 0)
+
+        # the count and the pending deltas of its bucket are on the same node, changed by one script
+        pending_key = CounterHelper.get_pending_key(CounterHelper.get_bucket(tweet.id))
+        self.assertEqual(RedisClient.get_hash_key(key), RedisClient.get_hash_key(pending_key))
+
+        # cache hit: exists + incr in one script
+        self.assertEqual(CounterHelper.increase_count(tweet, 'likes_count'), 7)
+        self.assertEqual(CounterHelper.decrease_count(tweet, 'likes_count'), 6)
+        self.assertEqual(CounterHelper.get_count(tweet, 'likes_count'), 6)
+
+        # DB is not changed until the flush
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 5)
+        conn.delete(key)
+        self.assertEqual(CounterHelper.get_count(tweet, 'likes_count'), 6)
+
+        # Deltas of the tweets are coalesced into the DB
+        tweet2 = self.create_tweet(self.user1)
+        for _ in range(3):
+            CounterHelper.increase_count(tweet2, 'comments_count')
+        self.assertEqual(CounterHelper.flush(), 2)
+        tweet.refresh_from_db()
+        tweet2.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 6)
+        self.assertEqual(tweet2.comments_count, 3)
+        self.assertEqual(CounterHelper.flush(), 0)
+
+        conn.delete(key)
+        self.assertEqual(CounterHelper.get_count(tweet, 'likes_count'), 6)
+
+    def test_reconcile(self):
+        tweet = self.create_tweet(self.user1)
+        self.create_comment(self.user1, tweet)
+        self.create_like(self.user1, tweet)
+        # drift: no likes in the likes table for these
+        Tweet.objects.filter(id=tweet.id).update(likes_count=10)
+        CounterHelper.increase_count(tweet, 'likes_count')
+
+        self.assertEqual(CounterHelper.reconcile(), 1)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+        self.assertEqual(tweet.comments_count, 1)
+        self.assertEqual(CounterHelper.get_count(tweet, 'likes_count'), 1)
+        self.assertEqual(CounterHelper.reconcile(), 0)
+
+        # a flush holds the bucket, reconcile must not read its pending deltas meanwhile
+        Tweet.objects.filter(id=tweet.id).update(likes_count=10)
+        bucket = CounterHelper.get_bucket(tweet.id)
+        lock = RedisClient.get_connection(CounterHelper.get_pending_key(bucket)).lock(
+            CounterHelper.get_flush_lock_key(bucket),
+            timeout=10,
+        )
+        self.assertEqual(lock.acquire(blocking=False), True)
+        with override_settings(COUNTER_FLUSH_LOCK_TIMEOUT=0.1):
+            # reconcile gives up waiting for the lock after COUNTER_FLUSH_LOCK_TIMEOUT
+            self.assertEqual(CounterHelper.reconcile(), 0)
+            tweet.refresh_from_db()
+            self.assertEqual(tweet.likes_count, 10)
+            lock.release()
+        self.assertEqual(CounterHelper.reconcile(), 1)
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.likes_count, 1)
+
+        # drift of the cached count only, e.g. filled while a flush was between its commit and delete
+        key = CounterHelper.get_count_key(tweet, 'likes_count')
+        RedisClient.get_connection(key).set(key, 2)
+        self.assertEqual(CounterHelper.reconcile(), 1)
+        self.assertIsNone(RedisClient.get_connection(key).get(key))
+        self.assertEqual(CounterHelper.get_count(tweet, 'likes_count'), 1)
+        self.assertEqual(CounterHelper.reconcile(), 0)
+
+
+class RedisSerializerTests(TestCase):
+
+    def setUp(self):
+        super(RedisSerializerTests, self).setUp()
+        self.user1 = self.create_user('user1')
+
+    def test_compact_serializer(self):
+        tweet = self.create_tweet(self.user1, 'hello world')
+        serialized_data = CompactModelSerializer.serialize(tweet)
+        self.assertTrue(len(serialized_data) < len(JSONSerializer.serialize(tweet)))
+        cached_tweet = CompactModelSerializer.deserialize(serialized_data)
+        self.assertEqual(cached_tweet, tweet)
+        self.assertEqual(cached_tweet.user_id, tweet.user_id)
+        self.assertEqual(cached_tweet.content, tweet.content)
+        self.assertEqual(cached_tweet.created_at, tweet.created_at)
+
+        # HBase models
+        newsfeed = HBaseNewsFeed(user_id=self.user1.id, created_at=tweet.timestamp, tweet_id=tweet.id)
+        cached_newsfeed = CompactModelSerializer.deserialize(
+            CompactModelSerializer.serialize(newsfeed),
+        )
+        self.assertEqual(cached_newsfeed.user_id, self.user1.id)
+        self.assertEqual(cached_newsfeed.created_at, tweet.timestamp)
+        self.assertEqual(cached_newsfeed.tweet_id, tweet.id)
+
+        # Data written in the JSON format can still be read
+        self.assertEqual(CompactModelSerializer.deserialize(JSONSerializer.serialize(tweet)), tweet)
+
+        # Data written by another version of the model
+        data = msgpack.unpackb(serialized_data)
+        data[1] = data[1] + 1
+        with self.assertRaises(SchemaMismatchError):
+            CompactModelSerializer.deserialize(msgpack.packb(data))
+
+    def test_cache_versions(self):
+        fingerprint = CacheVersions.get_fingerprint(Tweet)
+        self.assertEqual(len(fingerprint), 8)
+        self.assertEqual(CacheVersions.get_fingerprint(Tweet), fingerprint)
+        self.assertEqual(
+            TweetService.get_user_tweets_key(self.user1.id),
+            'user_tweets:{}:{}'.format(fingerprint, self.user1.id),
+        )
+        # Another serializer or another model should never share the keys
+        self.assertNotEqual(CacheVersions.get_fingerprint(Tweet, 'json'), fingerprint)
+        self.assertNotEqual(CacheVersions.get_fingerprint(NewsFeed), CacheVersions.get_fingerprint(HBaseNewsFeed))
@@ -1,5 +1,19 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
 def utc_now():
-    return datetime.now().replace(tzinfo=pytz.utc)
\ No newline at end of file
+    return datetime.now().replace(tzinfo=pytz.utc)
+
+def datetime_to_timestamp(value):
+    """
+    datetime -> integer microseconds since epoch, the same unit as Tweet.timestamp
+    Integer arithmetic rather than value.timestamp(), so no precision is lost in float
+    """
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=pytz.utc)
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+def timestamp_to_datetime(timestamp):
+    return EPOCH + timedelta(microseconds=timestamp)